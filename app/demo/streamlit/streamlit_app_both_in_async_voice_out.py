@@ -1,3 +1,4 @@
+import hashlib
 import os
 import sys
 import streamlit as st
@@ -11,22 +12,32 @@ from copy import deepcopy
 # __file__ is "app/demo/streamlit/streamlit_app.py". We need to go up three directories to reach the project root.
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../"))
 
-# Append the 'src/be' directory (relative to the project root) to sys.path.
-sys.path.append(os.path.join(project_root, "src", "be"))
+# Append the 'src/be' directory (relative to the project root) to sys.path once;
+# Streamlit re-executes this script on every interaction.
+be_dir = os.path.join(project_root, "src", "be")
+if be_dir not in sys.path:
+    sys.path.append(be_dir)
 
 
 from gpt4o_audio import GPT4oAudioClient
 from gpt4o_transcribe import GPT4oTranscribeClient
 
-# Path setup
-project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../"))
-sys.path.append(os.path.join(project_root, "src", "be"))
 
-# Load environment variables
-load_dotenv()
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-if OPENAI_API_KEY is None:
-    raise ValueError("OPENAI_API_KEY is not set in the environment or .env file!")
+@st.cache_resource
+def get_clients():
+    """
+    Load .env and build the API clients once per server process instead of on
+    every rerun. Prompt and voice are passed per call, so one client serves all.
+    """
+    load_dotenv()
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if api_key is None:
+        raise ValueError("OPENAI_API_KEY is not set in the environment or .env file!")
+    audio_client = GPT4oAudioClient(api_key=api_key,
+                                    system_prompt="",
+                                    output_audio_config={"voice": "alloy", "format": "mp3"})
+    return audio_client, GPT4oTranscribeClient(api_key=api_key)
+
 
 # Session state initialization
 if "chat_history" not in st.session_state:
@@ -38,6 +49,10 @@ if "latest_audio" not in st.session_state:
 if "latest_text" not in st.session_state:
     st.session_state.latest_text = None
 
+# fingerprints of recordings already answered in this session
+if "processed_recordings" not in st.session_state:
+    st.session_state.processed_recordings = set()
+
 st.title("Youth Counselor Bot")
 
 # Sidebar
@@ -59,11 +74,7 @@ output_audio_config = {
 }
 
 # Client
-client = GPT4oAudioClient(api_key=OPENAI_API_KEY,
-                          system_prompt=system_prompt,
-                          output_audio_config=output_audio_config)
-
-client_trans = GPT4oTranscribeClient(api_key=OPENAI_API_KEY)
+client, client_trans = get_clients()
 
 # Toggle for input mode
 mode = st.radio("Choose input mode:", ["Text", "Voice"], horizontal=True)
@@ -85,10 +96,12 @@ if mode == "Text":
                     ]
                     conv_history += history
 
-            print("output audio config: ", client.output_audio_config)
+            print("output audio config: ", output_audio_config)
             print("user_query: ", user_query)
             print("conv_history: ", conv_history)
-            audio_response = client.chat_completion_text_input(user_query, convo_history=conv_history)
+            audio_response = client.chat_completion_text_input(user_query, convo_history=conv_history,
+                                                               system_prompt=system_prompt,
+                                                               output_audio_config=output_audio_config)
             print("audio_response: ", audio_response)
 
         # Update latest audio and text (not storing audio in chat history)
@@ -116,13 +129,21 @@ else:
     st.markdown("**Record your voice input**")
     audio = audiorecorder("Click to record", "Recording...")
 
+    # Reruns (any widget interaction) keep returning the last recording;
+    # fingerprint its samples so each recording is processed (and exported) once.
+    recording_id = None
     if len(audio) > 0:
-        buffer = BytesIO()
-        audio.export(buffer, format="wav")
-        audio_bytes = buffer.getvalue()
-        buffer.seek(0)
+        digest = hashlib.sha256(f"{audio.frame_rate}:{audio.sample_width}:{audio.channels}:".encode())
+        digest.update(audio.raw_data)
+        recording_id = digest.hexdigest()
+
+    if recording_id and recording_id not in st.session_state.processed_recordings:
 
         with st.spinner("Generating response..."):
+            buffer = BytesIO()
+            audio.export(buffer, format="wav")
+            audio_bytes = buffer.getvalue()
+
             conv_history = []
             if st.session_state.chat_history:
                 for entry in st.session_state.chat_history:
@@ -135,17 +156,20 @@ else:
             # transcribe using gpt4o-transcribe model
             audio_file_obj = BytesIO(audio_bytes)
             audio_file_obj.name = "recorded_audio.wav"
+            # cached across sessions by the wav's content hash, so re-uploads of a clip skip upstream
             user_query = client_trans.transcribe(audio_file_obj)
             print(user_query)
             st.markdown(f"**User Transcription:** {user_query}")
 
-            print("output audio config: ", client.output_audio_config)
+            print("output audio config: ", output_audio_config)
             print("user_query: ", user_query)
             print("conv_history: ", conv_history)
 
             # Patch: Since your GPT4oAudioClient expects a URL, adapt to accept raw data
             # We'll reuse chat_completion_audio_input with minor local changes
-            audio_response = client.chat_completion_text_input(user_query, convo_history=conv_history)
+            audio_response = client.chat_completion_text_input(user_query, convo_history=conv_history,
+                                                               system_prompt=system_prompt,
+                                                               output_audio_config=output_audio_config)
             print("audio_response: ", audio_response)
 
             # Update latest audio and text (not storing audio in chat history)
@@ -167,6 +191,9 @@ else:
                 st.warning("No audio data returned.")
                 st.session_state.latest_audio = b""  # empty bytes for no audio
 
+            # only now: a recording whose turn failed is retried on the next rerun
+            st.session_state.processed_recordings.add(recording_id)
+
 # Show result
 if st.session_state.latest_text:
     st.markdown(f"**AI:** {st.session_state.latest_text}")
@@ -1,16 +1,37 @@
 import streamlit as st
 from dotenv import load_dotenv
 import os
+import hashlib
 from io import BytesIO
 from audiorecorder import audiorecorder  # pip install streamlit-audiorecorder
 from openai import OpenAI
 
 
-# Load environment variables
-load_dotenv()
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-if OPENAI_API_KEY is None:
-    raise ValueError("OPENAI_API_KEY is not set in the environment or .env file!")
+@st.cache_resource
+def get_client():
+    """
+    Load .env and build the client once per server process instead of on every rerun.
+    """
+    load_dotenv()
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if api_key is None:
+        raise ValueError("OPENAI_API_KEY is not set in the environment or .env file!")
+    return OpenAI(api_key=api_key)
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def transcribe(audio_bytes: bytes) -> str:
+    """
+    Keyed by the clip's content, so the same recording or upload is sent
+    upstream once per server process.
+    """
+    audio_file_obj = BytesIO(audio_bytes)
+    audio_file_obj.name = "recorded_audio.wav"
+    return get_client().audio.transcriptions.create(
+        model="gpt-4o-transcribe",
+        file=audio_file_obj,
+        response_format="text"
+    )
 
 
 st.title("Audio Recorder and Transcription App")
@@ -22,18 +43,22 @@ audio = audiorecorder("Click to record", "Recording...")
 
 audio_bytes = b""
 if len(audio) > 0:
-    buffer = BytesIO()
-    audio.export(buffer, format="wav")
-    audio_bytes = buffer.getvalue()
-    buffer.seek(0)
+    # only re-export when the recording itself changed, not on every rerun
+    digest = hashlib.sha256(f"{audio.frame_rate}:{audio.sample_width}:{audio.channels}:".encode())
+    digest.update(audio.raw_data)
+    recording_id = digest.hexdigest()
+    if st.session_state.get("recording_id") != recording_id:
+        buffer = BytesIO()
+        audio.export(buffer, format="wav")
+        st.session_state.recording_id = recording_id
+        st.session_state.recording_wav = buffer.getvalue()
+    audio_bytes = st.session_state.recording_wav
 
 if audio_bytes:
     st.audio(audio_bytes, format="audio/wav")
 
     if st.button("Transcribe"):
         # Call the OpenAI transcription endpoint with the custom model
-        client_trans = OpenAI(api_key=OPENAI_API_KEY)
-
         # # Option 1: saving to a wav file, and load it
         # # Save the recorded audio temporarily
         # audio_filename = "recorded_audio.wav"
@@ -50,13 +75,7 @@ if audio_bytes:
 
 
         # Option 2: without saving to a wav file
-        audio_file_obj = BytesIO(audio_bytes)
-        audio_file_obj.name = "recorded_audio.wav"
-        transcription = client_trans.audio.transcriptions.create(
-            model="gpt-4o-transcribe",
-            file=audio_file_obj,
-            response_format="text"
-        )
+        transcription = transcribe(audio_bytes)
         print(transcription)
 
 
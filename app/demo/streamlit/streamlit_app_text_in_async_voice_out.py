@@ -5,13 +5,15 @@ import sys
 # __file__ is "app/demo/streamlit/streamlit_app.py". We need to go up three directories to reach the project root.
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../"))
 
-# Append the 'src/be' directory (relative to the project root) to sys.path.
-sys.path.append(os.path.join(project_root, "src", "be"))
+# Append the 'src/be' directory (relative to the project root) to sys.path once;
+# Streamlit re-executes this script on every interaction.
+be_dir = os.path.join(project_root, "src", "be")
+if be_dir not in sys.path:
+    sys.path.append(be_dir)
 
 import streamlit as st
 from io import BytesIO
 import base64
-from openai import OpenAI
 from gpt4o_audio import GPT4oAudioClient  # Or paste the class directly above
 from dotenv import load_dotenv
 from copy import deepcopy
@@ -29,10 +31,21 @@ if "latest_text" not in st.session_state:
 # Streamlit UI
 st.title("Youth Counselor Bot")
 
-load_dotenv()
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-if OPENAI_API_KEY is None:
-    raise ValueError("OPENAI_API_KEY is not set in the environment or .env file!")
+
+@st.cache_resource
+def get_client():
+    """
+    Load .env and build the API client once per server process instead of on
+    every rerun. Prompt and voice are passed per call, so one client serves all.
+    """
+    load_dotenv()
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if api_key is None:
+        raise ValueError("OPENAI_API_KEY is not set in the environment or .env file!")
+    return GPT4oAudioClient(api_key=api_key,
+                            system_prompt="",
+                            output_audio_config={"voice": "alloy", "format": "mp3"})
+
 
 # Sidebar inputs
 system_prompt_str = """
@@ -60,8 +73,8 @@ output_audio_config = {
 }
 
 # Send button
-if st.button("Send") and OPENAI_API_KEY and user_query:
-    client = GPT4oAudioClient(api_key=OPENAI_API_KEY, system_prompt=system_prompt, output_audio_config=output_audio_config)
+if st.button("Send") and user_query:
+    client = get_client()
 
     # Generate response
     with st.spinner("Generating response..."):
@@ -74,16 +87,17 @@ if st.button("Send") and OPENAI_API_KEY and user_query:
                 ]
                 conv_history += history
 
-        print("output audio config: ", client.output_audio_config)
+        print("output audio config: ", output_audio_config)
         print("user_query: ", user_query)
         print("conv_history: ", conv_history)
-        audio_response = client.chat_completion_text_input(user_query, convo_history=conv_history)
+        audio_response = client.chat_completion_text_input(user_query, convo_history=conv_history,
+                                                           system_prompt=system_prompt,
+                                                           output_audio_config=output_audio_config)
         print("audio_response: ", audio_response)
 
     # Update latest audio and text (not storing audio in chat history)
     if audio_response and hasattr(audio_response, "transcript"):
         st.session_state.latest_text = audio_response.transcript
-        st.session_state.latest_audio = base64.b64decode(audio_response.data)
     else:
         st.warning("No audio transcript returned.")
         st.session_state.latest_text = ""
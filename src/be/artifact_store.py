@@ -0,0 +1,236 @@
+import base64
+import hashlib
+import hmac
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+_ARTIFACT_ID = re.compile(r"^[0-9a-f]{32}\.[a-z0-9]{1,5}$")
+_FRESH_MAX = 4096
+
+# shared single writer for ad-hoc output files (e.g. f_out_wav), so they stay off the request thread
+_file_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio-file-writer")
+
+
+def write_base64_async(path: str, data_base64: str):
+    """
+    Decode and write on the shared writer thread; pending writes finish
+    before the interpreter exits.
+    """
+    def write():
+        with open(path, "wb") as f:
+            f.write(base64.b64decode(data_base64))
+
+    return _file_writer.submit(write)
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for input and generated audio.
+
+    An artifact id is `<first 32 hex of HMAC-SHA256(secret, audio)>.<ext>`;
+    files live at `root/<id[:2]>/<id[2:4]>/<id>`, so identical audio is
+    stored once, but nobody without the secret can derive the id of a clip
+    they have (e.g. to confirm what someone said). The secret is `secret`,
+    or a random key kept in `root/.secret` so workers sharing `root` agree.
+    put() returns the id immediately and a background thread does the write;
+    until then the bytes are served from memory. The same thread evicts files
+    older than `max_age_s` and then the least recently stored ones above
+    `max_bytes`. discard() takes back an artifact of a cancelled turn, unless
+    its content is also stored for someone else.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 512 * 1024 * 1024, max_age_s: float = 7 * 86400,
+                 sweep_interval_s: float = 300.0, secret: Optional[bytes] = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.sweep_interval_s = sweep_interval_s
+        self._pending: Dict[str, bytes] = {}
+        # recently put ids -> whether their content is shared (put again, or already on disk)
+        self._fresh: "OrderedDict[str, bool]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self.stats_counters = {"stored": 0, "deduped": 0, "evicted": 0, "discarded": 0}
+        os.makedirs(root, exist_ok=True)
+        self._secret = secret or self._load_secret()
+        self._writer = threading.Thread(target=self._write_loop, name="artifact-writer", daemon=True)
+        self._writer.start()
+
+    def _load_secret(self) -> bytes:
+        path = os.path.join(self.root, ".secret")
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            # another worker created it; wait until it has been written
+            for _ in range(50):
+                with open(path, "rb") as f:
+                    secret = f.read()
+                if secret:
+                    return secret
+                time.sleep(0.01)
+            raise RuntimeError(f"Empty artifact secret at {path}")
+        secret = os.urandom(32)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secret)
+        return secret
+
+    @staticmethod
+    def valid_id(artifact_id: str) -> bool:
+        return bool(_ARTIFACT_ID.match(artifact_id or ""))
+
+    def path(self, artifact_id: str) -> str:
+        return os.path.join(self.root, artifact_id[:2], artifact_id[2:4], artifact_id)
+
+    def put(self, data: bytes, ext: str) -> Optional[str]:
+        if not data:
+            return None
+        artifact_id = f"{hmac.new(self._secret, data, hashlib.sha256).hexdigest()[:32]}.{ext.lower()}"
+        with self._lock:
+            self._fresh[artifact_id] = artifact_id in self._fresh
+            self._fresh.move_to_end(artifact_id)
+            while len(self._fresh) > _FRESH_MAX:
+                self._fresh.popitem(last=False)
+            if artifact_id not in self._pending:
+                self._pending[artifact_id] = data
+                self._queue.put(artifact_id)
+        return artifact_id
+
+    def discard(self, artifact_id: Optional[str]) -> bool:
+        """
+        Remove an artifact this process just put, e.g. partial output of a
+        cancelled turn; content that is shared or older is left alone.
+        :return: True if it was removed
+        """
+        with self._lock:
+            if not artifact_id or self._fresh.get(artifact_id, True):
+                return False
+            del self._fresh[artifact_id]
+            self._pending.pop(artifact_id, None)
+            # on the writer thread, so it runs after a write already in progress
+            self._queue.put(("remove", artifact_id))
+            self.stats_counters["discarded"] += 1
+        return True
+
+    def put_base64(self, data_base64: str, ext: str) -> Optional[str]:
+        if not data_base64:
+            return None
+        return self.put(base64.b64decode(data_base64), ext)
+
+    def read(self, artifact_id: str, start: int = 0, end: Optional[int] = None) -> Optional[Tuple[bytes, int]]:
+        """
+        :param end: inclusive end offset, None for the rest of the file
+        :return: (bytes in range, total size), or None if unknown or evicted
+        """
+        with self._lock:
+            data = self._pending.get(artifact_id)
+        if data is not None:
+            return data[start:None if end is None else end + 1], len(data)
+        path = self.path(artifact_id)
+        try:
+            with open(path, "rb") as f:
+                total = os.fstat(f.fileno()).st_size
+                f.seek(start)
+                length = total - start if end is None else end + 1 - start
+                return f.read(max(0, length)), total
+        except FileNotFoundError:
+            return None
+
+    def size(self, artifact_id: str) -> Optional[int]:
+        with self._lock:
+            data = self._pending.get(artifact_id)
+        if data is not None:
+            return len(data)
+        try:
+            return os.path.getsize(self.path(artifact_id))
+        except OSError:
+            return None
+
+    def _write_loop(self):
+        last_sweep = time.monotonic()
+        while True:
+            try:
+                artifact_id = self._queue.get(timeout=self.sweep_interval_s)
+            except queue.Empty:
+                artifact_id = None
+            if isinstance(artifact_id, tuple):
+                self._remove(artifact_id[1])
+            elif artifact_id is not None:
+                try:
+                    self._write(artifact_id)
+                except OSError as e:
+                    print("Artifact write failed:", artifact_id, e)
+                finally:
+                    with self._lock:
+                        self._pending.pop(artifact_id, None)
+            if time.monotonic() - last_sweep >= self.sweep_interval_s:
+                self.sweep()
+                last_sweep = time.monotonic()
+
+    def _write(self, artifact_id):
+        path = self.path(artifact_id)
+        if os.path.exists(path):
+            # already stored; refresh its age so eviction treats it as recent
+            os.utime(path)
+            self.stats_counters["deduped"] += 1
+            with self._lock:
+                if artifact_id in self._fresh:
+                    self._fresh[artifact_id] = True
+            return
+        with self._lock:
+            data = self._pending.get(artifact_id)
+        if data is None:
+            # discarded before it was written
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.stats_counters["stored"] += 1
+
+    def _remove(self, artifact_id):
+        with self._lock:
+            if artifact_id in self._pending:
+                # put again since it was discarded
+                return
+        try:
+            os.remove(self.path(artifact_id))
+        except OSError:
+            pass
+
+    def sweep(self):
+        now = time.time()
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not _ARTIFACT_ID.match(name):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if now - mtime <= self.max_age_s and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.stats_counters["evicted"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending = len(self._pending)
+        return dict(self.stats_counters, pending=pending)
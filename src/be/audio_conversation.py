@@ -0,0 +1,92 @@
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+
+def input_audio_message(audio_base64: str, audio_format: str = "wav") -> Dict:
+    """
+    User message carrying a clip, in the chat completions content-part format.
+    """
+    return {
+        "role": "user",
+        "content": [{
+            "type": "input_audio",
+            "input_audio": {"data": audio_base64, "format": audio_format},
+        }],
+    }
+
+
+@dataclass
+class AudioTurn:
+    """
+    One voice exchange, stored once. The clips themselves live in the
+    artifact store (by id); the conversation keeps only transcripts and ids.
+    """
+    user_transcript: str
+    assistant_transcript: str
+    user_artifact_id: Optional[str] = None
+    assistant_artifact_id: Optional[str] = None
+    # upstream id of the assistant's audio; the model can be pointed at it
+    # instead of re-reading the transcript until it expires
+    assistant_audio_id: Optional[str] = None
+    assistant_audio_expires_at: Optional[float] = None
+
+    def meta(self) -> Dict:
+        """
+        Fields for SessionStore.append_turn(meta=...).
+        """
+        return {
+            "user_artifact_id": self.user_artifact_id,
+            "assistant_artifact_id": self.assistant_artifact_id,
+            "assistant_audio_id": self.assistant_audio_id,
+            "assistant_audio_expires_at": self.assistant_audio_expires_at,
+        }
+
+    @classmethod
+    def from_stored(cls, turn: Dict) -> "AudioTurn":
+        meta = turn.get("meta") or {}
+        return cls(
+            user_transcript=turn["user"],
+            assistant_transcript=turn["assistant_text"],
+            user_artifact_id=meta.get("user_artifact_id"),
+            assistant_artifact_id=meta.get("assistant_artifact_id"),
+            assistant_audio_id=meta.get("assistant_audio_id"),
+            assistant_audio_expires_at=meta.get("assistant_audio_expires_at"),
+        )
+
+    def to_messages(self, now: float, margin_s: float = 60.0) -> List[Dict]:
+        messages = [{"role": "user", "content": self.user_transcript}]
+        if self.assistant_audio_id and (self.assistant_audio_expires_at or 0) - margin_s > now:
+            messages.append({"role": "assistant", "audio": {"id": self.assistant_audio_id}})
+        else:
+            messages.append({"role": "assistant", "content": self.assistant_transcript})
+        return messages
+
+
+class AudioConversation:
+    """
+    History for audio-native turns: earlier turns are sent as transcripts
+    (or upstream audio references), only the current clip as audio, so the
+    request size doesn't grow with the number of voice turns.
+    """
+
+    def __init__(self, turns: List[AudioTurn] = None, summary: str = ""):
+        self.turns = list(turns or [])
+        self.summary = summary
+
+    @classmethod
+    def from_session(cls, session_store, session_id: str, k: int = 10) -> "AudioConversation":
+        summary, turns = session_store.load_recent(session_id, k)
+        return cls([AudioTurn.from_stored(turn) for turn in turns], summary)
+
+    def append(self, turn: AudioTurn):
+        self.turns.append(turn)
+
+    def history_messages(self, now: Optional[float] = None) -> List[Dict]:
+        now = time.time() if now is None else now
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        for turn in self.turns:
+            messages += turn.to_messages(now)
+        return messages
@@ -0,0 +1,143 @@
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Optional
+
+# base64 maps 3 input bytes to 4 output chars; encoding whole 3-byte groups
+# per chunk keeps the concatenated output identical to a one-shot encode
+_GROUP = 3
+
+
+class AudioTooLargeError(ValueError):
+    pass
+
+
+class _Base64Encoder:
+    def __init__(self, sink):
+        self._sink = sink
+        self._carry = b""
+
+    def write(self, chunk: bytes):
+        data = self._carry + chunk
+        cut = len(data) - len(data) % _GROUP
+        self._carry = data[cut:]
+        if cut:
+            self._sink(base64.b64encode(data[:cut]).decode("ascii"))
+
+    def close(self):
+        if self._carry:
+            self._sink(base64.b64encode(self._carry).decode("ascii"))
+            self._carry = b""
+
+
+class AudioFetcher:
+    """
+    Streams audio from a URL into base64 with a size cap and timeouts.
+
+    With `cache_dir`, clips are kept on disk already base64-encoded next to
+    their ETag/Last-Modified, and later fetches send a conditional request:
+    a 304 costs one round trip and no body. If the revalidation request
+    itself fails, the cached copy is used.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = 25 * 1024 * 1024,
+                 connect_timeout: float = 5.0, read_timeout: float = 30.0, chunk_size: int = 64 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.timeout = (connect_timeout, read_timeout)
+        # a multiple of 3 so most chunks encode without carry
+        self.chunk_size = chunk_size - chunk_size % _GROUP
+        self._session = None
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"downloads": 0, "revalidated": 0, "stale_served": 0, "bytes": 0}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _http(self):
+        with self._lock:
+            if self._session is None:
+                import requests
+
+                self._session = requests.Session()
+            return self._session
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".b64"), os.path.join(self.cache_dir, key + ".json")
+
+    def _read_cached(self, data_path) -> str:
+        with open(data_path, encoding="ascii") as f:
+            return f.read()
+
+    def fetch_base64(self, url: str) -> str:
+        if not self.cache_dir:
+            parts = []
+            self._download(url, {}, parts.append)
+            return "".join(parts)
+
+        data_path, meta_path = self._paths(url)
+        meta = {}
+        if os.path.exists(data_path) and os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "w", encoding="ascii") as out:
+                try:
+                    response_headers = self._download(url, headers, out.write)
+                except AudioTooLargeError:
+                    raise
+                except Exception as e:
+                    if not meta:
+                        raise
+                    print(f"Audio fetch failed, using cached copy of {url}:", e)
+                    self.stats["stale_served"] += 1
+                    return self._read_cached(data_path)
+            if response_headers is None:
+                self.stats["revalidated"] += 1
+                return self._read_cached(data_path)
+            os.replace(tmp_path, data_path)
+            tmp_path = None
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"url": url,
+                           "etag": response_headers.get("ETag"),
+                           "last_modified": response_headers.get("Last-Modified")}, f)
+            return self._read_cached(data_path)
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _download(self, url, headers, sink):
+        """
+        Stream the body through the base64 encoder into `sink`.
+        :return: response headers, or None on 304 Not Modified
+        """
+        with self._http().get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+            declared = response.headers.get("Content-Length")
+            if declared and int(declared) > self.max_bytes:
+                raise AudioTooLargeError(f"{url} is {declared} bytes (limit {self.max_bytes})")
+
+            encoder = _Base64Encoder(sink)
+            received = 0
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                received += len(chunk)
+                if received > self.max_bytes:
+                    raise AudioTooLargeError(f"{url} exceeds {self.max_bytes} bytes")
+                encoder.write(chunk)
+            encoder.close()
+            self.stats["downloads"] += 1
+            self.stats["bytes"] += received
+            return response.headers
@@ -0,0 +1,155 @@
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional, Tuple
+
+# client-facing format -> mime type
+MIME_TYPES = {
+    "mp3": "audio/mpeg",
+    "opus": "audio/ogg",
+    "aac": "audio/aac",
+    "pcm16": "audio/L16;rate=24000;channels=1",
+    "wav": "audio/wav",
+}
+# formats gpt-4o-audio can return directly; everything else is transcoded from mp3
+UPSTREAM_CHAT_FORMATS = {"mp3", "opus", "pcm16", "wav"}
+# the TTS endpoint calls raw 16-bit pcm "pcm"
+TTS_FORMAT_NAMES = {"mp3": "mp3", "opus": "opus", "aac": "aac", "pcm16": "pcm", "wav": "wav"}
+# pydub/ffmpeg export arguments per format
+_EXPORT_ARGS = {
+    "mp3": {"format": "mp3"},
+    "opus": {"format": "ogg", "codec": "libopus"},
+    "aac": {"format": "adts", "codec": "aac"},
+    "wav": {"format": "wav"},
+}
+PCM16_RATE = 24000
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    format: str
+    bitrate: Optional[str] = None  # e.g. "32k"; None keeps the source bitrate
+    trim_silence: bool = False
+
+    @property
+    def mime_type(self) -> str:
+        return MIME_TYPES[self.format]
+
+    @property
+    def upstream_format(self) -> str:
+        """
+        Format to ask gpt-4o-audio for, so that we transcode only when we must.
+        """
+        return self.format if self.format in UPSTREAM_CHAT_FORMATS else "mp3"
+
+    @property
+    def tts_format(self) -> str:
+        return TTS_FORMAT_NAMES[self.format]
+
+    def needs_transcode(self, src_format: str) -> bool:
+        return src_format != self.format or self.bitrate is not None or self.trim_silence
+
+
+def negotiate(audio_format: Optional[str] = None, bitrate: Optional[str] = None,
+              trim_silence: bool = False) -> OutputFormat:
+    """
+    Resolve what the client asked for; unknown formats fall back to mp3.
+    """
+    fmt = (audio_format or "mp3").lower()
+    if fmt not in MIME_TYPES:
+        fmt = "mp3"
+    # pcm has no bitrate knob
+    if fmt in ("pcm16", "wav"):
+        bitrate = None
+    return OutputFormat(fmt, bitrate, trim_silence)
+
+
+def _load(audio_bytes: bytes, src_format: str):
+    from pydub import AudioSegment  # needs ffmpeg; only loaded when we actually transcode
+
+    if src_format == "pcm16":
+        return AudioSegment(audio_bytes, sample_width=2, frame_rate=PCM16_RATE, channels=1)
+    return AudioSegment.from_file(BytesIO(audio_bytes), format=src_format)
+
+
+def _trim(segment, threshold_db: float = -45.0, keep_ms: int = 80):
+    from pydub.silence import detect_leading_silence
+
+    start = max(0, detect_leading_silence(segment, silence_threshold=threshold_db) - keep_ms)
+    end = max(0, detect_leading_silence(segment.reverse(), silence_threshold=threshold_db) - keep_ms)
+    trimmed = segment[start:len(segment) - end]
+    return trimmed if len(trimmed) > 0 else segment
+
+
+def transcode(audio_bytes: bytes, src_format: str, target: OutputFormat, trim: bool = True) -> bytes:
+    segment = _load(audio_bytes, src_format)
+    if trim:
+        segment = _trim(segment)
+    if target.format == "pcm16":
+        return segment.set_frame_rate(PCM16_RATE).set_channels(1).set_sample_width(2).raw_data
+    buffer = BytesIO()
+    segment.export(buffer, bitrate=target.bitrate, **_EXPORT_ARGS[target.format])
+    return buffer.getvalue()
+
+
+class TranscodeCache:
+    """
+    Bounded LRU of transcoded variants keyed by (content hash, target).
+
+    Works on base64 text end to end: the key is a hash of the upstream
+    base64 string, so a cache hit costs neither a b64decode nor a re-encode,
+    and a miss decodes and encodes exactly once. Audio that fails to
+    transcode (no ffmpeg, undecodable input) is returned as it came.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def convert_base64(self, audio_base64: str, src_format: str, target: OutputFormat) -> Tuple[str, str]:
+        """
+        :return: (audio base64, the format it is in): `target.format`, or `src_format` when transcoding failed
+        """
+        if not audio_base64 or not target.needs_transcode(src_format):
+            return audio_base64, src_format
+
+        key = (hashlib.sha256(audio_base64.encode("ascii")).hexdigest(), src_format, target)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached, target.format
+            self.misses += 1
+
+        try:
+            converted = base64.b64encode(
+                transcode(base64.b64decode(audio_base64), src_format, target, trim=target.trim_silence)
+            ).decode("ascii")
+        except Exception as e:
+            print(f"Transcoding {src_format} to {target.format} failed, sending {src_format}:", e)
+            with self._lock:
+                self.failures += 1
+            return audio_base64, src_format
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = converted
+                self._size += len(converted)
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return converted, target.format
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses,
+                    "failures": self.failures}
@@ -0,0 +1,208 @@
+"""
+End-to-end cancellation of turns nobody is waiting for any more.
+
+Each turn gets a CancelToken. It is cancelled when a newer turn of the same
+session starts (TurnRegistry.begin) or when every client waiting for it has
+gone (TurnRegistry.leave; duplicates coalesced by the idempotency cache
+count as waiting). Upstream code checks it between steps: scheduler waits,
+retry attempts and streamed chunks stop, and a call already in flight is
+abandoned (see CancelToken.call). An abandoned call can't be aborted and
+still runs to completion upstream, so the scheduler slot it holds is only
+released once it returns (CancelToken.after_calls). Cleanup callbacks registered with
+on_cancel run once, e.g. to delete partial artifacts; a finished turn can
+no longer be cancelled.
+"""
+import asyncio
+import threading
+from typing import Callable, Dict, Optional
+
+
+class TurnCancelled(RuntimeError):
+    def __init__(self, reason: str = "cancelled"):
+        super().__init__(f"turn {reason}")
+        self.reason = reason
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.reason = None
+        self.finished = False
+        self.followers = 0
+        self._calls = 0  # call() threads still running, abandoned ones included
+        self._after_calls = []
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        """
+        :return: False if it was already cancelled or finished
+        """
+        with self._lock:
+            if self._event.is_set() or self.finished:
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print("Cancel callback failed:", e)
+        return True
+
+    def finish(self) -> bool:
+        """
+        The turn completed; later cancels are no-ops and cleanups are dropped.
+        :return: False if it had been cancelled first
+        """
+        with self._lock:
+            self.finished = True
+            self._callbacks = []
+            return not self._event.is_set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    # Event-compatible, so a token can be passed where a threading.Event is expected
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TurnCancelled(self.reason)
+
+    def on_cancel(self, callback: Callable):
+        """
+        Run `callback` on cancellation (right away if already cancelled).
+        """
+        with self._lock:
+            if self.finished:
+                return
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """
+        Run a blocking call that can't be interrupted (e.g. a non-streamed
+        upstream request) on its own thread and stop waiting for it as soon
+        as the token is cancelled; its eventual result is dropped.
+        """
+        self.raise_if_cancelled()
+        outcome = {}
+        done = threading.Event()
+
+        def run():
+            try:
+                outcome["result"] = fn(*args, **kwargs)
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                done.set()
+                callbacks = []
+                with self._lock:
+                    self._calls -= 1
+                    if not self._calls:
+                        callbacks, self._after_calls = self._after_calls, []
+                for callback in callbacks:
+                    callback()
+
+        self.on_cancel(done.set)
+        with self._lock:
+            self._calls += 1
+        threading.Thread(target=run, name="cancellable-call", daemon=True).start()
+        done.wait()
+        if "error" in outcome:
+            raise outcome["error"]
+        if "result" not in outcome:
+            raise TurnCancelled(self.reason)
+        return outcome["result"]
+
+    def after_calls(self, callback: Callable):
+        """
+        Run `callback` once no call() of this token is running any more (right
+        away if none is), e.g. to release the upstream slot an abandoned call
+        is still using.
+        """
+        with self._lock:
+            if self._calls:
+                self._after_calls.append(callback)
+                return
+        callback()
+
+
+def call_cancellable(cancel: Optional[CancelToken], fn: Callable, *args, **kwargs):
+    if cancel is None:
+        return fn(*args, **kwargs)
+    return cancel.call(fn, *args, **kwargs)
+
+
+class TurnRegistry:
+    """
+    The turn in progress per session; starting a new one supersedes (cancels)
+    the old one. Clients join() a turn while they wait for it.
+    """
+
+    def __init__(self):
+        self._active: Dict[str, CancelToken] = {}
+        self._lock = threading.Lock()
+        self.counters = {"started": 0, "superseded": 0, "disconnected": 0}
+
+    def begin(self, session_id: Optional[str]) -> CancelToken:
+        token = CancelToken()
+        previous = None
+        with self._lock:
+            self.counters["started"] += 1
+            if session_id:
+                previous = self._active.get(session_id)
+                self._active[session_id] = token
+        if previous is not None and previous.cancel("superseded"):
+            self._count("superseded")
+        return token
+
+    def end(self, session_id: Optional[str], token: CancelToken):
+        token.finish()
+        with self._lock:
+            if session_id and self._active.get(session_id) is token:
+                del self._active[session_id]
+
+    def join(self, token: CancelToken):
+        with self._lock:
+            token.followers += 1
+
+    def leave(self, token: CancelToken):
+        """
+        A waiting client went away; the last one to leave an unfinished turn cancels it.
+        """
+        with self._lock:
+            token.followers -= 1
+            abandoned = token.followers <= 0
+        if abandoned and token.cancel("disconnected"):
+            self._count("disconnected")
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self.counters, active=len(self._active))
+
+
+def watch_disconnect(request, on_disconnect: Callable, interval_s: float = 0.25) -> asyncio.Task:
+    """
+    Poll a non-streaming request for a client disconnect; cancel the
+    returned task when the response is ready.
+    """
+    async def watch():
+        while not await request.is_disconnected():
+            await asyncio.sleep(interval_s)
+        on_disconnect()
+
+    return asyncio.create_task(watch())
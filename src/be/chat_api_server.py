@@ -1,135 +1,1082 @@
-from fastapi import FastAPI
+import asyncio
+import base64
+import dataclasses
+import itertools
+import json
+import math
+import time
+from contextlib import asynccontextmanager, nullcontext
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from gpt4o_audio import GPT4oAudioClient
+from gpt4o_transcribe import GPT4oTranscribeClient
+from audio_conversation import AudioConversation, AudioTurn
+from session_store import create_session_store
+from rate_limiter import create_rate_limiter, estimate_tokens
+from crisis_triage import RISK_HIGH, RISK_LOW, get_triage, max_tier
+from model_router import DEFAULT_MODEL_TIERS, ModelRouter
+from speech_pipeline import SentenceSpeechPipeline
+from audio_format import MIME_TYPES, TranscodeCache, negotiate
+from prompt_registry import PromptRegistry
+from startup_profile import StartupTimer
+from traffic_recorder import TrafficRecorder, TrafficRecorderMiddleware
+from circuit_breaker import DegradedResponder, get_upstream_breaker, is_degraded_text
+from idempotency import IdempotencyCache, derive_key
+from artifact_store import ArtifactStore
+from priority_scheduler import PriorityScheduler
+from usage_accounting import DIMENSIONS, UsageAccountant, audio_seconds, prices_from_env
+from speculation import GenerationCancelled, SpeculativeGenerator
+from cancellation import CancelToken, TurnCancelled, TurnRegistry, watch_disconnect
+from safety_stage import Moderator, SafetyStage, withheld_text
+from engines import CompletionEngine, RealtimeEngine, REALTIME_URL as DEFAULT_REALTIME_URL, websocket_connector
 import os
 from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional, Tuple
 from dotenv import load_dotenv
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
 PUBLIC_DIR = BASE_DIR / "webapp" / "views"
+PROMPTS_DIR = Path(__file__).resolve().parent / "prompts"
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH")  # unset -> in-memory store (single worker only)
+SESSION_HISTORY_TURNS = int(os.getenv("SESSION_HISTORY_TURNS", "10"))
+ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH")  # share across workers; unset -> per process
+RATE_LIMIT_REQUESTS_PER_MIN = float(os.getenv("RATE_LIMIT_REQUESTS_PER_MIN", "20"))
+RATE_LIMIT_TOKENS_PER_MIN = float(os.getenv("RATE_LIMIT_TOKENS_PER_MIN", "20000"))
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"
+AUDIO_MODEL_TIERS = os.getenv("AUDIO_MODEL_TIERS", ",".join(DEFAULT_MODEL_TIERS)).split(",")  # cheapest first
+ROUTER_P95_TARGET_S = float(os.getenv("ROUTER_P95_TARGET_S", "6.0"))
+TTS_MODEL = os.getenv("TTS_MODEL", "gpt-4o-mini-tts")
+TRANSCODE_CACHE_MB = int(os.getenv("TRANSCODE_CACHE_MB", "64"))
+PROMPT_DB_PATH = os.getenv("PROMPT_DB_PATH")  # share published prompts across workers
+DEFAULT_PROMPT = os.getenv("DEFAULT_PROMPT", "counselor-ko")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # unset -> admin endpoints disabled
+WARMUP_UPSTREAM = os.getenv("WARMUP_UPSTREAM", "0") == "1"  # open the upstream connection before the first turn
+UPSTREAM_STUB = os.getenv("UPSTREAM_STUB", "0") == "1"  # offline stand-in upstream for load tests
+TRAFFIC_RECORD_PATH = os.getenv("TRAFFIC_RECORD_PATH")  # opt-in anonymized traffic recording (JSONL)
+TRAFFIC_RECORD_SALT = os.getenv("TRAFFIC_RECORD_SALT", "")  # unset: shared salt in <TRAFFIC_RECORD_PATH>.salt
+FALLBACK_AUDIO_DIR = os.getenv("FALLBACK_AUDIO_DIR")  # pre-rendered <lang>[_<voice>].<format> replies
+IDEMPOTENCY_TTL_S = float(os.getenv("IDEMPOTENCY_TTL_S", "30"))  # how long a finished turn is replayed to duplicates
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR")  # unset -> audio is only returned inline
+ARTIFACT_MAX_MB = int(os.getenv("ARTIFACT_MAX_MB", "512"))
+ARTIFACT_MAX_AGE_H = float(os.getenv("ARTIFACT_MAX_AGE_H", "168"))
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "0"))  # relevant earlier turns per prompt; 0 disables semantic memory (needs numpy)
+MEMORY_HISTORY_TURNS = int(os.getenv("MEMORY_HISTORY_TURNS", "4"))  # recent turns sent instead of SESSION_HISTORY_TURNS when memory is on
+MEMORY_EMBEDDER = os.getenv("MEMORY_EMBEDDER", "hashing")  # hashing (local) | openai
+MEMORY_EMBED_MODEL = os.getenv("MEMORY_EMBED_MODEL", "text-embedding-3-small")
+MEMORY_BACKFILL_TURNS = int(os.getenv("MEMORY_BACKFILL_TURNS", "200"))
+USAGE_FLUSH_PATH = os.getenv("USAGE_FLUSH_PATH")  # JSONL of usage deltas; report with usage_accounting.py
+USAGE_FLUSH_INTERVAL_S = float(os.getenv("USAGE_FLUSH_INTERVAL_S", "60"))
+USAGE_MAX_KEYS = int(os.getenv("USAGE_MAX_KEYS", "10000"))  # in-memory totals per dimension (most recently active)
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "16"))  # per worker; 0 disables the scheduler
+SCHEDULER_MAX_WAIT_S = float(os.getenv("SCHEDULER_MAX_WAIT_S", "10"))  # any turn waiting longer goes next
+PROFILING = os.getenv("PROFILING", "0") == "1"  # opt-in sampling profiler; nothing is installed otherwise
+PROFILE_DIR = os.getenv("PROFILE_DIR")  # with PROFILE_EVERY_S, periodic whole-process profiles go here
+PROFILE_EVERY_S = float(os.getenv("PROFILE_EVERY_S", "0"))
+PROFILE_WINDOW_S = float(os.getenv("PROFILE_WINDOW_S", "10"))
+ENGINE = os.getenv("ENGINE", "completion")  # completion (chat.completions) | realtime (persistent Realtime API sessions)
+REALTIME_URL = os.getenv("REALTIME_URL")  # e.g. ws://127.0.0.1:8765 for stub_realtime.py; unset -> OpenAI
+REALTIME_MODEL = os.getenv("REALTIME_MODEL", "gpt-4o-realtime-preview")
+REALTIME_MAX_SESSIONS = int(os.getenv("REALTIME_MAX_SESSIONS", "64"))  # pooled connections per worker
+SPECULATION = os.getenv("SPECULATION", "0") == "1"  # start replies on interim transcripts (POST /speculate)
+SPECULATION_THRESHOLD = float(os.getenv("SPECULATION_THRESHOLD", "0.85"))  # interim/final similarity to keep a reply
+MODERATION = os.getenv("MODERATION", "0") == "1"  # screen input and reply alongside generation (safety_stage)
+MODERATION_MODEL = os.getenv("MODERATION_MODEL", "omni-moderation-latest")
+MODERATION_TIMEOUT_S = float(os.getenv("MODERATION_TIMEOUT_S", "5"))
+MODERATION_FAIL_CLOSED = os.getenv("MODERATION_FAIL_CLOSED", "0") == "1"  # withhold replies when moderation errors
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup()
+    yield
+    shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+startup_timer = StartupTimer()
 gpt_client = None
+engine = None
+speculator = None
+safety = None
+transcriber = None
+session_store = None
+rate_limiter = None
+model_router = None
+speech_pipeline = None
+transcode_cache = TranscodeCache(max_bytes=TRANSCODE_CACHE_MB * 1024 * 1024)
+prompt_registry = None
+artifact_store = None
+semantic_memory = None
+upstream_scheduler = (PriorityScheduler(UPSTREAM_MAX_CONCURRENCY, max_wait_s=SCHEDULER_MAX_WAIT_S)
+                      if UPSTREAM_MAX_CONCURRENCY > 0 else None)
+usage_accountant = UsageAccountant(USAGE_FLUSH_PATH, flush_interval_s=USAGE_FLUSH_INTERVAL_S, prices=prices_from_env(),
+                                   max_keys=USAGE_MAX_KEYS)
+degraded_responder = DegradedResponder(FALLBACK_AUDIO_DIR)
+idempotency = IdempotencyCache(ttl_s=IDEMPOTENCY_TTL_S)
+turns = TurnRegistry()
+_turn_tokens = {}  # idempotency key -> CancelToken of the turn in flight
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=ALLOWED_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+if TRAFFIC_RECORD_PATH:
+    app.add_middleware(TrafficRecorderMiddleware,
+                       recorder=TrafficRecorder(TRAFFIC_RECORD_PATH, salt=TRAFFIC_RECORD_SALT))
+
+profile_store = None
+if PROFILING:
+    from profiling import PeriodicProfiler, ProfileStore, ProfilingMiddleware
+
+    profile_store = ProfileStore()
+    app.add_middleware(ProfilingMiddleware, store=profile_store, token=ADMIN_TOKEN)
+    if PROFILE_DIR and PROFILE_EVERY_S > 0:
+        PeriodicProfiler(PROFILE_DIR, every_s=PROFILE_EVERY_S, window_s=PROFILE_WINDOW_S)
+
 app.mount("/views", StaticFiles(directory=PUBLIC_DIR), name="views")
 
 class AudioRequest(BaseModel):
     audio_base64: str
-    system_prompt: str
+    prompt_id: Optional[str] = None  # content hash or prompt name; see /admin/prompts
+    system_prompt: Optional[str] = None  # legacy: full prompt text
     voice: str
+    session_id: Optional[str] = None
+    turn: Optional[int] = None  # client turn counter; dedupes retries without an Idempotency-Key
+    audio_format: Optional[str] = "mp3"  # mp3 | opus | aac | pcm16 | wav
+    bitrate: Optional[str] = None  # e.g. "32k"
+    trim_silence: bool = False
+    audio_delivery: Optional[str] = "inline"  # inline: audio_base64 | url: audio_url to GET /artifacts/{id}
 
 class TextRequest(BaseModel):
     text: str
-    system_prompt: str
+    prompt_id: Optional[str] = None  # content hash or prompt name; see /admin/prompts
+    system_prompt: Optional[str] = None  # legacy: full prompt text
     voice: str
+    session_id: Optional[str] = None
+    turn: Optional[int] = None  # client turn counter; dedupes retries without an Idempotency-Key
+    audio_format: Optional[str] = "mp3"  # mp3 | opus | aac | pcm16 | wav
+    bitrate: Optional[str] = None  # e.g. "32k"
+    trim_silence: bool = False
+    audio_delivery: Optional[str] = "inline"  # inline: audio_base64 | url: audio_url to GET /artifacts/{id}
+
+class SpeculateRequest(BaseModel):
+    text: str  # stable interim transcript
+    prompt_id: Optional[str] = None
+    system_prompt: Optional[str] = None
+    voice: Optional[str] = None
+    session_id: str
+
+class TriageRequest(BaseModel):
+    text: str
+    session_id: Optional[str] = None
+
+class PublishPromptRequest(BaseModel):
+    name: str
+    text: str
 
 @app.get("/")
 async def serve_ui():
     return FileResponse(PUBLIC_DIR / "index.html", media_type="text/html")
 
-@app.on_event("startup")
-def startup_event():
-    global gpt_client
-    gpt_client = GPT4oAudioClient(
-        api_key=OPENAI_API_KEY,
-        system_prompt="""당신은 자살 위험이 있는 청소년들을 위한 정서적 지원과 상담을 제공하는 전문 심리상담 챗봇입니다. 다음 지침을 항상 따르세요:
-
-        🎯 역할과 목적
-        당신의 주된 임무는 청소년들의 생명을 지키는 것입니다.
-        자살 충동을 느끼는 청소년에게 비판 없는 경청, 공감, 정서적 지지를 제공해야 합니다.
-        청소년이 자신의 감정을 표현하도록 유도하며, 위험한 상황에서는 안전한 선택을 유도해야 합니다.
-        필요 시 전문적인 도움(상담사, 24시간 긴급 센터 등)을 안내해야 합니다.
-
-        🧠 대화 스타일과 언어
-        부드럽고 따뜻한 말투를 사용합니다.
-        청소년이 이해하기 쉬운 친근하고 직설적인 언어를 사용합니다.
-        판단하지 않고, 항상 공감하는 자세를 유지합니다.
-        자살 충동에 대해 말하더라도 놀라지 말고, 차분한 태도를 유지합니다.
-
-        🛑 금지 사항
-        진단하거나 병명을 단정짓지 않습니다.
-        자살 방법이나 수단에 대한 구체적인 언급을 피합니다.
-        청소년의 감정을 가볍게 여기거나 부정하지 않습니다.
-        강압적이거나 명령하는 말투는 사용하지 않습니다.
-
-        🧭 기본 대화 흐름 가이드
-        감정 확인 및 공감
-        “그동안 정말 힘들었겠구나.”
-        “그런 감정을 느끼는 건 아주 자연스러운 일이야.”
-
-        자살 관련 위험도 탐색 (간접적)
-        “요즘 들어 삶이 너무 벅차다고 느끼는 순간이 있었니?”
-        “혹시, 모든 걸 그만두고 싶은 마음이 들 때가 있니?”
-
-        위험 판단 후 대응
-        중간 위험: “지금은 네가 혼자가 아니라는 걸 꼭 기억해줘.”
-        고위험: “정말 위급한 상황인 것 같아. 전문가와 이야기해 보는 게 도움이 될 수 있어. 내가 도와줄게.”
-
-        전문기관 연결
-        “혹시 지금 바로 상담할 수 있는 어른이나 선생님이 있니?”
-        “24시간 도움을 받을 수 있는 전화가 있어. 1393(자살 예방 상담 전화)에 연락해 볼 수 있어.”
-
-        정서적 지지와 희망 제시
-        “지금 이 순간을 함께 견뎌주는 사람이 있다는 걸 잊지 마.”
-        “오늘 너에게 말을 걸어준 건 정말 용기 있는 선택이야.”
-
-        🧷 추가 정보
-        대상 연령: 13~19세
-        고려 사항: 학교, 친구, 가족과의 갈등, 학업 스트레스, 자아정체성 문제, 외로움, 자존감 저하
-        모든 대화는 비밀 보장과 심리적 안전을 전제로 합니다.""",
-        output_audio_config={"voice": "shimmer", "format": "mp3"}
-    )
-    
+def startup():
+    """
+    Build everything the first request needs, timing each phase
+    (GET /metrics/startup), so no request pays for lazy initialization.
+    """
+    global gpt_client, session_store, rate_limiter, model_router, speech_pipeline, prompt_registry, artifact_store
+    global semantic_memory, transcriber, engine, speculator, safety
+    with startup_timer.phase("prompts"):
+        prompt_registry = PromptRegistry(PROMPT_DB_PATH)
+        prompt_registry.load_dir(PROMPTS_DIR)
+    with startup_timer.phase("stores"):
+        session_store = create_session_store(SESSION_DB_PATH)
+        rate_limiter = create_rate_limiter(RATE_LIMIT_DB_PATH,
+                                           requests_per_min=RATE_LIMIT_REQUESTS_PER_MIN,
+                                           tokens_per_min=RATE_LIMIT_TOKENS_PER_MIN)
+        if ARTIFACT_DIR:
+            artifact_store = ArtifactStore(ARTIFACT_DIR, max_bytes=ARTIFACT_MAX_MB * 1024 * 1024,
+                                           max_age_s=ARTIFACT_MAX_AGE_H * 3600)
+    with startup_timer.phase("triage"):
+        get_triage()
+    with startup_timer.phase("client"):
+        model_router = ModelRouter(AUDIO_MODEL_TIERS, p95_target_s=ROUTER_P95_TARGET_S)
+        openai_client = None
+        if UPSTREAM_STUB:
+            from stub_upstream import stub_from_env
+            openai_client = stub_from_env()
+        gpt_client = GPT4oAudioClient(
+            api_key=OPENAI_API_KEY,
+            system_prompt=prompt_registry.resolve(DEFAULT_PROMPT).text,
+            output_audio_config={"voice": "shimmer", "format": "mp3"},
+            router=model_router,
+            openai_client=openai_client,
+            fallback=degraded_responder,
+            usage=usage_accountant,
+            scheduler=upstream_scheduler,
+        )
+        speech_pipeline = SentenceSpeechPipeline(gpt_client.client, tts_model=TTS_MODEL, scheduler=upstream_scheduler)
+        gpt_client.speech = speech_pipeline
+        transcriber = GPT4oTranscribeClient(OPENAI_API_KEY, openai_client=gpt_client.client)
+        if ENGINE == "realtime":
+            if UPSTREAM_STUB and not REALTIME_URL:
+                from stub_realtime import connect_stub as connect
+            else:
+                connect = websocket_connector(REALTIME_URL or DEFAULT_REALTIME_URL, OPENAI_API_KEY, REALTIME_MODEL)
+            engine = RealtimeEngine(connect, model=REALTIME_MODEL, system_prompt=gpt_client.system_prompt,
+                                    max_sessions=REALTIME_MAX_SESSIONS, breaker=gpt_client.breaker,
+                                    usage=usage_accountant, scheduler=upstream_scheduler, fallback=degraded_responder)
+        else:
+            engine = CompletionEngine(gpt_client)
+        if SPECULATION:
+            speculator = SpeculativeGenerator(gpt_client.chat_completion_text_cancellable,
+                                              threshold=SPECULATION_THRESHOLD)
+        if MODERATION:
+            safety = SafetyStage(Moderator(gpt_client.client, MODERATION_MODEL), timeout_s=MODERATION_TIMEOUT_S,
+                                 fail_closed=MODERATION_FAIL_CLOSED)
+    if MEMORY_TOP_K > 0:
+        with startup_timer.phase("memory"):
+            # numpy is only imported when the memory is enabled
+            from semantic_memory import HashingEmbedder, OpenAIEmbedder, SemanticMemory
+
+            if MEMORY_EMBEDDER == "openai":
+                embedder = OpenAIEmbedder(gpt_client.client, model=MEMORY_EMBED_MODEL)
+            else:
+                embedder = HashingEmbedder()
+            semantic_memory = SemanticMemory(embedder, loader=_memory_backfill,
+                                             backfill_turns=MEMORY_BACKFILL_TURNS)
+            gpt_client.memory = semantic_memory
+            gpt_client.memory_top_k = MEMORY_TOP_K
+    if WARMUP_UPSTREAM:
+        with startup_timer.phase("upstream"):
+            try:
+                gpt_client.client.models.retrieve(AUDIO_MODEL_TIERS[-1])
+            except Exception as e:
+                print("Upstream warm-up failed:", e)
+    startup_timer.ready()
+    print("Startup:", startup_timer.report())
+
+
+def shutdown():
+    if engine is not None:
+        engine.close()
+    if session_store is not None:
+        session_store.close()
+    usage_accountant.flush()
+
+
+def _system_prompt(req) -> str:
+    """
+    Resolve the request's prompt to the registry's interned text.
+    """
+    if req.prompt_id:
+        prompt = prompt_registry.resolve(req.prompt_id)
+        if prompt is None:
+            raise HTTPException(status_code=404, detail=f"Unknown prompt_id: {req.prompt_id}")
+        return prompt.text
+    if req.system_prompt:
+        return req.system_prompt
+    return gpt_client.system_prompt
+
+
+def _require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN or token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+def _history_turns() -> int:
+    # retrieved turns cover the older conversation, so the recent window can be small
+    return MEMORY_HISTORY_TURNS if semantic_memory is not None else SESSION_HISTORY_TURNS
+
+
+def _session_history(session_id: Optional[str]):
+    if not session_id:
+        return []
+    return session_store.convo_history(session_id, _history_turns())
+
+
+def _upstream_slot(risk_tier: str, token: Optional[CancelToken] = None):
+    """
+    Wait for an upstream slot on the event loop, before run_in_threadpool, so
+    queued turns don't occupy pool threads; upstream calls made inside reuse it.
+    """
+    if upstream_scheduler is None:
+        return nullcontext()
+    return upstream_scheduler.slot_async(risk_tier, cancel=token)
+
+
+def _triage(session_id: Optional[str], text: str):
+    """
+    Local risk screen; records the tier in session state so later turns
+    (and the model router) can see it.
+    """
+    assessment = get_triage().assess(text)
+    if session_id:
+        previous = session_store.get_state(session_id).get("max_risk_tier", "low")
+        session_store.update_state(session_id,
+                                   risk_tier=assessment.tier,
+                                   max_risk_tier=max_tier(previous, assessment.tier))
+    return assessment
+
+
+def _safety_verdict(check, assessment, session_id: Optional[str]):
+    """
+    Wait for the turn's moderation (safety_stage). An input flagged for
+    self-harm escalates the turn, and the session, to high risk.
+    :return: (verdict, assessment), verdict None when moderation is off
+    """
+    if check is None:
+        return None, assessment
+    verdict = check.wait()
+    if verdict.crisis and assessment.tier != RISK_HIGH:
+        assessment = dataclasses.replace(assessment, tier=RISK_HIGH)
+        if session_id:
+            session_store.update_state(session_id, risk_tier=RISK_HIGH, max_risk_tier=RISK_HIGH)
+    return verdict, assessment
+
+
+def _client_ip(request: Request) -> Optional[str]:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+def _enforce_rate_limit(request: Request, session_id: Optional[str], est_tokens: int):
+    allowed, retry_after = rate_limiter.check(_client_ip(request), session_id, est_tokens)
+    if not allowed:
+        retry_after = 3600 if math.isinf(retry_after) else math.ceil(retry_after)
+        raise HTTPException(status_code=429, detail="Too many requests",
+                            headers={"Retry-After": str(retry_after)})
+
+
+def _record_turn(session_id: Optional[str], user_text: str, reply_text: str, meta: Optional[dict] = None):
+    # canned outage replies are not part of the conversation
+    if session_id and reply_text and not is_degraded_text(reply_text):
+        session_store.append_turn(session_id, user_text, reply_text, meta=meta)
+        if semantic_memory is not None:
+            semantic_memory.add_turn(session_id, user_text, reply_text)
+
+
+def _memory_backfill(session_id: str, k: int):
+    _, turns = session_store.load_recent(session_id, k)
+    return [(turn["created_at"], turn["user"], turn["assistant_text"]) for turn in turns]
+
+
+def _output_audio(reply_audio_base64: str, output_format, src_format: Optional[str] = None):
+    """
+    Upstream already returned `output_format.upstream_format` (or `src_format`,
+    e.g. pcm16 from the realtime engine); transcode (and trim) only when the
+    client asked for something it can't produce. Blocking (ffmpeg): call it
+    from the threadpool.
+    :return: (audio base64, its format)
+    """
+    return transcode_cache.convert_base64(reply_audio_base64, src_format or output_format.upstream_format,
+                                          output_format)
+
+
+def _turn_key(request: Request, req, idempotency_key: Optional[str]) -> Optional[str]:
+    return derive_key(request.url.path, idempotency_key, req.session_id, req.turn)
+
+
+def _audio_fields(audio: Tuple[str, str], audio_delivery: Optional[str] = "inline") -> dict:
+    """
+    Reply audio (base64, format) for a response body: stored as an artifact
+    when the store is enabled, returned inline unless the client asked for a
+    URL. The format is the one actually sent, which is not the requested one
+    when transcoding failed.
+    """
+    audio_base64, fmt = audio
+    audio_id = artifact_store.put_base64(audio_base64, fmt) if artifact_store else None
+    fields = {"audio_format": fmt, "mime_type": MIME_TYPES[fmt]}
+    if audio_id and audio_delivery == "url":
+        return {"audio_id": audio_id, "audio_url": f"/artifacts/{audio_id}", **fields}
+    fields["audio_base64"] = audio_base64
+    if audio_id:
+        fields.update(audio_id=audio_id, audio_url=f"/artifacts/{audio_id}")
+    return fields
+
+
+def _parse_range(header: str, total: int):
+    """
+    Single `bytes=start-end` range (suffix `bytes=-n` included) as inclusive
+    offsets, or None when the header is absent, malformed or multi-range (the
+    whole body is served). Raises ValueError when the range can't be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    if not (start or end) or not (start or "0").isdigit() or not (end or "0").isdigit():
+        return None
+    if start == "":
+        start, end = max(0, total - int(end)), total - 1
+    else:
+        start, end = int(start), min(int(end), total - 1) if end else total - 1
+    if start > end:
+        raise ValueError("unsatisfiable range")
+    return start, end
+
+
+def _ndjson(event: dict) -> bytes:
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _discard_on_cancel(token: CancelToken, *artifact_ids):
+    if artifact_store is not None:
+        token.on_cancel(lambda: [artifact_store.discard(artifact_id) for artifact_id in artifact_ids])
+
+
+def _commit_turn(token: CancelToken):
+    """
+    Past this point the turn's result is kept even if its client goes away.
+    """
+    if not token.finish():
+        raise TurnCancelled(token.reason)
+
+
+async def _run_turn(request: Request, session_id: Optional[str], key: Optional[str], turn):
+    """
+    Run `turn(token)` through the idempotency cache. Coalesced duplicates wait
+    on the same CancelToken, which is cancelled when a newer turn of the
+    session starts or every waiting client has disconnected (then 499).
+    """
+    token = _turn_tokens.get(key) if key else None
+    if token is None and idempotency.is_known(key):
+        # completed and cached
+        return await idempotency.run(key, lambda: turn(CancelToken()))
+    owner = token is None
+    if owner:
+        token = turns.begin(session_id)
+        if key:
+            _turn_tokens[key] = token
+
+    async def run():
+        try:
+            return await turn(token)
+        finally:
+            if owner:
+                turns.end(session_id, token)
+                _turn_tokens.pop(key, None)
+
+    turns.join(token)
+    watcher = watch_disconnect(request, lambda: turns.leave(token))
+    try:
+        return await idempotency.run(key, run)
+    except TurnCancelled as e:
+        raise HTTPException(status_code=499, detail=f"Turn {e.reason}")
+    finally:
+        watcher.cancel()
+        if not watcher.done():
+            turns.leave(token)
+
+
+async def _follow(events, token: Optional[CancelToken]):
+    """
+    Stream blocking `events` off the event loop; a client leaving early
+    leaves the turn (see TurnRegistry.leave).
+    """
+    if token is not None:
+        turns.join(token)
+    try:
+        async for event in iterate_in_threadpool(events):
+            yield event
+    except TurnCancelled:
+        # raised by an uncoalesced stream after its `cancelled` event
+        pass
+    finally:
+        if token is not None:
+            turns.leave(token)
+
+
+@app.post("/admin/prompts")
+async def publish_prompt(req: PublishPromptRequest, x_admin_token: Optional[str] = Header(None)):
+    _require_admin(x_admin_token)
+    prompt = prompt_registry.publish(req.name, req.text)
+    return {"prompt_id": prompt.prompt_id, "name": prompt.name, "version": prompt.version}
+
+@app.get("/admin/prompts")
+async def list_prompts(x_admin_token: Optional[str] = Header(None)):
+    _require_admin(x_admin_token)
+    return [
+        {"prompt_id": p.prompt_id, "name": p.name, "version": p.version, "chars": len(p.text)}
+        for p in prompt_registry.list()
+    ]
+
+def _require_profiling(token: Optional[str]):
+    _require_admin(token)
+    if profile_store is None:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (PROFILING=1)")
+
+@app.post("/admin/profile")
+def profile_process(seconds: float = 5.0, x_admin_token: Optional[str] = Header(None)):
+    """
+    Sample the whole worker for `seconds` (max 60) and keep the profile.
+    """
+    _require_profiling(x_admin_token)
+    from profiling import profile_for
+
+    sampler = profile_for(min(max(seconds, 0.1), 60.0))
+    profile_id = profile_store.add(sampler, f"process {seconds:g}s")
+    return dict(sampler.summary(), profile_id=profile_id)
+
+@app.get("/admin/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    _require_profiling(x_admin_token)
+    return profile_store.list()
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "summary", x_admin_token: Optional[str] = Header(None)):
+    """
+    `format=folded` returns flamegraph.pl / speedscope input.
+    """
+    _require_profiling(x_admin_token)
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Unknown profile")
+    if format == "folded":
+        return PlainTextResponse(profile["folded"])
+    return {key: value for key, value in profile.items() if key != "folded"}
+
+@app.get("/metrics/startup")
+async def startup_metrics():
+    return startup_timer.report()
+
+@app.get("/metrics/upstream")
+async def upstream_metrics():
+    return {
+        "circuit_breaker": get_upstream_breaker().snapshot(),
+        "audio_salvage": gpt_client.salvage_stats() if gpt_client is not None else None,
+    }
+
+@app.get("/metrics/engine")
+async def engine_metrics():
+    return engine.stats() if engine is not None else {}
+
+@app.get("/metrics/turns")
+async def turn_metrics():
+    """
+    Turns started, superseded by a newer turn of the session, and abandoned by disconnected clients.
+    """
+    return turns.stats()
+
+@app.get("/metrics/safety")
+async def safety_metrics():
+    """
+    Flagged inputs and replies, withheld replies, and the latency moderation
+    added to turns (`added_*`) next to what screening serially would have cost (`serial_avg_ms`).
+    """
+    return safety.stats() if safety is not None else {"enabled": False}
+
+@app.get("/metrics/speculation")
+async def speculation_metrics():
+    return speculator.stats() if speculator is not None else {"enabled": False}
+
+@app.get("/metrics/scheduler")
+async def scheduler_metrics():
+    """
+    Per-risk-tier queue depth, admissions, starvation promotions and wait percentiles.
+    """
+    return upstream_scheduler.snapshot() if upstream_scheduler else {"enabled": False}
+
+@app.get("/metrics/router")
+async def router_metrics():
+    """
+    Per-model call counts, error counts, p50/p95 latency and routing decisions.
+    """
+    return model_router.snapshot()
+
+@app.get("/metrics/audio")
+async def audio_metrics():
+    return {
+        "transcode_cache": transcode_cache.stats(),
+        "artifacts": artifact_store.stats() if artifact_store else None,
+    }
+
+@app.get("/usage")
+async def usage_report(by: str = "session", top: int = 20, sort: str = "cost_usd",
+                       x_admin_token: Optional[str] = Header(None)):
+    """
+    Top sessions / prompt versions / voices / models by estimated cost (or
+    any other counter). Prompt keys are prompt_ids from the registry.
+    """
+    _require_admin(x_admin_token)
+    if by not in DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"by must be one of {', '.join(DIMENSIONS)}")
+    return usage_accountant.report(by, top, sort)
+
+@app.get("/usage/{dimension}/{key}")
+async def usage_detail(dimension: str, key: str, x_admin_token: Optional[str] = Header(None)):
+    _require_admin(x_admin_token)
+    row = usage_accountant.get(dimension, key) if dimension in DIMENSIONS else None
+    if row is None:
+        raise HTTPException(status_code=404, detail="No usage recorded")
+    return row
+
+@app.get("/metrics/memory")
+async def memory_metrics():
+    return semantic_memory.stats() if semantic_memory else {"enabled": False}
+
+@app.get("/artifacts/{artifact_id}")
+def get_artifact(artifact_id: str, request: Request):
+    """
+    Stored audio by id, with single-range support for seeking and resumed
+    downloads. Artifacts are immutable, so clients may cache them until they
+    would be evicted; shared caches must not, since they are someone's voice.
+    """
+    if artifact_store is None or not ArtifactStore.valid_id(artifact_id):
+        raise HTTPException(status_code=404, detail="Unknown artifact")
+    total = artifact_store.size(artifact_id)
+    if total is None:
+        raise HTTPException(status_code=404, detail="Unknown artifact")
+
+    ext = artifact_id.rsplit(".", 1)[1]
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"private, max-age={int(ARTIFACT_MAX_AGE_H * 3600)}, immutable",
+        "ETag": f'"{artifact_id}"',
+    }
+    media_type = MIME_TYPES.get(ext, "application/octet-stream")
+    try:
+        byte_range = _parse_range(request.headers.get("range"), total)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{total}"})
+    start, end = byte_range or (0, total - 1)
+    result = artifact_store.read(artifact_id, start, end)
+    if result is None:
+        # evicted since the size check
+        raise HTTPException(status_code=404, detail="Unknown artifact")
+    data, _ = result
+    if byte_range is None:
+        return Response(data, media_type=media_type, headers=headers)
+    headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    return Response(data, status_code=206, media_type=media_type, headers=headers)
+
+@app.get("/metrics/idempotency")
+async def idempotency_metrics():
+    return idempotency.stats()
+
+@app.post("/triage")
+async def triage(req: TriageRequest):
+    """
+    Microsecond-scale local risk check. Clients call this alongside /chat-text
+    so a high-risk message gets the scripted safety reply immediately.
+    """
+    assessment = _triage(req.session_id, req.text)
+    return {
+        "risk_tier": assessment.tier,
+        "score": assessment.score,
+        "safety_reply": assessment.safety_reply if assessment.tier == RISK_HIGH else "",
+    }
 
 @app.post("/chat-audio")
-async def chat_audio(req: AudioRequest):
+async def chat_audio(req: AudioRequest, request: Request, idempotency_key: Optional[str] = Header(None)):
+    """
+    Duplicates of a turn (same Idempotency-Key, or same session and turn)
+    share one upstream call and its result.
+    """
+    key = _turn_key(request, req, idempotency_key)
+    return await _run_turn(request, req.session_id, key, lambda token: _chat_audio_turn(req, request, token))
+
+async def _chat_audio_turn(req: AudioRequest, request: Request, token: CancelToken):
     if gpt_client is None:
         raise RuntimeError("GPT client has not been initialized.")
-    gpt_client.system_prompt = req.system_prompt
-    gpt_client.output_audio_config = {"voice": req.voice, "format": "mp3"}
+    system_prompt = _system_prompt(req)
+    _enforce_rate_limit(request, req.session_id,
+                        estimate_tokens(system_prompt, audio_base64_len=len(req.audio_base64)))
+    output_format = negotiate(req.audio_format, req.bitrate, req.trim_silence)
+
+    # 입력 음성 보관 (비동기 저장)
+    input_audio_id = artifact_store.put_base64(req.audio_base64, "wav") if artifact_store else None
+    _discard_on_cancel(token, input_audio_id)
 
-    # 음성 인식 → 텍스트
-    user_text = gpt_client.transcribe_audio(req.audio_base64)
+    # 음성 인식 → 텍스트 (위험도 판단, 라우팅, 대화 기록용)
+    # the clip isn't triaged yet: queue at the tier of the session's last turn
+    last_tier = session_store.get_state(req.session_id).get("risk_tier", RISK_LOW) if req.session_id else RISK_LOW
+    async with _upstream_slot(last_tier, token):
+        started = time.perf_counter()
+        user_text = await run_in_threadpool(token.call, transcriber.transcribe_base64, req.audio_base64, "wav")
+    usage_accountant.record("gpt-4o-transcribe", session_id=req.session_id, system_prompt=system_prompt,
+                            voice=req.voice, input_audio_s=audio_seconds(req.audio_base64, "wav"),
+                            latency_s=time.perf_counter() - started)
+    assessment = _triage(req.session_id, user_text)
+    # 입력 검사는 응답 생성과 동시에 진행
+    check = safety.begin(user_text) if safety is not None else None
 
     # GPT 응답 생성 → 텍스트 + 음성
-    reply_text, reply_audio_base64 = gpt_client.chat_and_speak(user_text)
+    # 현재 발화만 음성으로 보내고, 이전 턴은 전사문(또는 업스트림 오디오 참조)으로 보냄
+    conversation = (AudioConversation.from_session(session_store, req.session_id, _history_turns())
+                    if req.session_id else None)
+    async with _upstream_slot(assessment.tier, token):
+        reply = await run_in_threadpool(
+            engine.audio_turn,
+            req.audio_base64, conversation, transcript=user_text, risk_tier=assessment.tier,
+            output_audio_config={"voice": req.voice, "format": output_format.upstream_format},
+            system_prompt=system_prompt, session_id=req.session_id, cancel=token)
+    token.raise_if_cancelled()
+    if check is not None:
+        # text and audio arrive together, so the reply can only be screened now
+        check.output(reply.transcript)
+    verdict, assessment = await run_in_threadpool(_safety_verdict, check, assessment, req.session_id)
+    if verdict is not None and not verdict.allowed:
+        reply = SimpleNamespace(transcript=withheld_text(user_text), data="", format=reply.format, id=None,
+                                expires_at=None)
+    reply_text = reply.transcript
+    audio_fields = _audio_fields(
+        await run_in_threadpool(_output_audio, reply.data, output_format, reply.format), req.audio_delivery)
+    _discard_on_cancel(token, audio_fields.get("audio_id"))
+    _commit_turn(token)
+    turn = AudioTurn(user_text, reply_text,
+                     user_artifact_id=input_audio_id,
+                     assistant_artifact_id=audio_fields.get("audio_id"),
+                     assistant_audio_id=reply.id,
+                     assistant_audio_expires_at=reply.expires_at)
+    _record_turn(req.session_id, user_text, reply_text, meta=turn.meta())
 
     return {
         "user_text": user_text,
         "text": reply_text,
-        "audio_base64": reply_audio_base64
+        **audio_fields,
+        "input_audio_id": input_audio_id,
+        "risk_tier": assessment.tier,
+        "safety_reply": assessment.safety_reply if assessment.tier == RISK_HIGH else "",
+        **({"moderation": verdict.to_dict()} if verdict is not None else {}),
     }
 
 @app.post("/chat-text")
-async def chat_text(req: TextRequest):
+async def chat_text(req: TextRequest, request: Request, idempotency_key: Optional[str] = Header(None)):
+    key = _turn_key(request, req, idempotency_key)
+    return await _run_turn(request, req.session_id, key, lambda token: _chat_text_turn(req, request, token))
+
+async def _chat_text_turn(req: TextRequest, request: Request, token: CancelToken):
     if gpt_client is None:
         raise RuntimeError("GPT client has not been initialized.")
-    gpt_client.system_prompt = req.system_prompt
-    gpt_client.output_audio_config = {"voice": req.voice, "format": "mp3"}
+    system_prompt = _system_prompt(req)
+    _enforce_rate_limit(request, req.session_id, estimate_tokens(system_prompt + req.text))
+    assessment = _triage(req.session_id, req.text)
+    output_format = negotiate(req.audio_format, req.bitrate, req.trim_silence)
+    check = safety.begin(req.text) if safety is not None else None
 
-    reply_text, reply_audio_base64 = gpt_client.chat_and_speak(req.text)
+    async with _upstream_slot(assessment.tier, token):
+        reply = await run_in_threadpool(
+            engine.text_turn,
+            req.text, convo_history=_session_history(req.session_id), risk_tier=assessment.tier,
+            output_audio_config={"voice": req.voice, "format": output_format.upstream_format},
+            system_prompt=system_prompt, session_id=req.session_id, cancel=token)
+    token.raise_if_cancelled()
+    if check is not None:
+        check.output(reply.transcript)
+    verdict, assessment = await run_in_threadpool(_safety_verdict, check, assessment, req.session_id)
+    if verdict is not None and not verdict.allowed:
+        reply = SimpleNamespace(transcript=withheld_text(req.text), data="", format=reply.format)
+    reply_text = reply.transcript
+    audio_fields = {}
+    if reply_text:
+        audio_fields = _audio_fields(
+            await run_in_threadpool(_output_audio, reply.data, output_format, reply.format), req.audio_delivery)
+        _discard_on_cancel(token, audio_fields.get("audio_id"))
+    _commit_turn(token)
+    _record_turn(req.session_id, req.text, reply_text)
 
+    safety_reply = assessment.safety_reply if assessment.tier == RISK_HIGH else ""
+    moderation = {"moderation": verdict.to_dict()} if verdict is not None else {}
     if not reply_text:
         return {
             "text": "",
-            "audio_base64": ""
+            "audio_base64": "",
+            "risk_tier": assessment.tier,
+            "safety_reply": safety_reply,
+            **moderation,
         }
 
     return {
         "user_text": req.text,
         "text": reply_text,
-        "audio_base64": reply_audio_base64
+        **audio_fields,
+        "risk_tier": assessment.tier,
+        "safety_reply": safety_reply,
+        **moderation,
     }
+
+@app.post("/speculate")
+async def speculate(req: SpeculateRequest, request: Request):
+    """
+    Start generating the reply to an interim transcript. The next
+    /chat-text-stream turn of the session with the same prompt uses it when
+    its final text is similar enough (SPECULATION_THRESHOLD) and no negation
+    changed, and its triage tier is low. Rate limited like a turn; the
+    upstream tokens are recorded against the session.
+    """
+    if speculator is None:
+        return {"status": "disabled"}
+    if not req.session_id.strip():
+        raise HTTPException(status_code=400, detail="session_id is required")
+    system_prompt = _system_prompt(req)
+    _enforce_rate_limit(request, req.session_id, estimate_tokens(system_prompt + req.text))
+    # lowest priority: speculation must not delay committed turns
+    return speculator.start((req.session_id, system_prompt), req.text,
+                            convo_history=_session_history(req.session_id), system_prompt=system_prompt,
+                            session_id=req.session_id, risk_tier="low")
+
+@app.post("/chat-text-stream")
+async def chat_text_stream(req: TextRequest, request: Request, idempotency_key: Optional[str] = Header(None)):
+    """
+    Same turn as /chat-text, but the reply text is generated first and voiced
+    sentence by sentence with concurrent TTS calls. Streams NDJSON events:
+    `safety` (high risk only, sent before any upstream call), `text`, one
+    `audio` per sentence in order, then `done`. Duplicates of the turn replay
+    the same event stream. A turn superseded by a newer one of the session, or
+    left by all its clients, before its `text` event stops with `cancelled`;
+    after it the turn is recorded and its audio completes. With MODERATION=1 the
+    `text` event waits for the moderation verdict (and carries it); a flagged
+    reply is replaced by a text-only one.
+    """
+    if gpt_client is None:
+        raise RuntimeError("GPT client has not been initialized.")
+    key = _turn_key(request, req, idempotency_key)
+    if idempotency.is_known(key):
+        # already generated or generating; not charged again
+        return StreamingResponse(_follow(idempotency.stream(key, None), _turn_tokens.get(key)),
+                                 media_type="application/x-ndjson")
+    system_prompt = _system_prompt(req)
+    _enforce_rate_limit(request, req.session_id, estimate_tokens(system_prompt + req.text))
+    assessment = _triage(req.session_id, req.text)
+    output_format = negotiate(req.audio_format, req.bitrate, req.trim_silence)
+    history = _session_history(req.session_id)
+    token = turns.begin(req.session_id)
+    if key:
+        _turn_tokens[key] = token
+
+    def events():
+        try:
+            yield from turn_events()
+        except (GenerationCancelled, TurnCancelled):
+            print(f"Streamed turn {token.reason}, stopping.")
+            yield _ndjson({"type": "cancelled", "reason": token.reason})
+            # not a result: a retry of the turn runs again
+            raise TurnCancelled(token.reason)
+        finally:
+            turns.end(req.session_id, token)
+            _turn_tokens.pop(key, None)
+
+    def turn_events():
+        if assessment.tier == RISK_HIGH:
+            yield _ndjson({"type": "safety", "risk_tier": assessment.tier, "safety_reply": assessment.safety_reply})
+        check = safety.begin(req.text) if safety is not None else None
+
+        try:
+            reply_text = None
+            if speculator is not None and req.session_id:
+                if assessment.tier == RISK_LOW:
+                    reply_text = speculator.claim((req.session_id, system_prompt), req.text)
+                else:
+                    # generated without the risk context; this turn gets a fresh reply
+                    speculator.discard((req.session_id, system_prompt))
+            if reply_text is None:
+                reply_text, _ = gpt_client.chat_completion_text_cancellable(req.text, token, convo_history=history,
+                                                                            system_prompt=system_prompt,
+                                                                            session_id=req.session_id,
+                                                                            risk_tier=assessment.tier)
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            print("Text generation failed, serving degraded reply:", e)
+            degraded = degraded_responder.respond(req.text, req.voice, output_format.format)
+            # the canned reply needs no screening, but a flagged input still escalates the turn
+            verdict, screened = _safety_verdict(check, assessment, req.session_id)
+            if screened.tier != assessment.tier:
+                yield _ndjson({"type": "safety", "risk_tier": screened.tier, "safety_reply": screened.safety_reply})
+            yield _ndjson({"type": "text", "user_text": req.text, "text": degraded.transcript,
+                           "risk_tier": screened.tier, "degraded": True,
+                           **({"moderation": verdict.to_dict()} if verdict is not None else {})})
+            if degraded.data:
+                yield _ndjson({"type": "audio", "index": 0, "text": degraded.transcript,
+                               "audio_base64": degraded.data, "mime_type": output_format.mime_type})
+            yield _ndjson({"type": "done"})
+            return
+        token.raise_if_cancelled()
+
+        # the TTS endpoint speaks every client format natively
+        speech = speech_pipeline.stream(reply_text, req.voice, output_format.tts_format, assessment.tier)
+        try:
+            sentences, screened, moderation = speech, assessment, {}
+            if check is not None:
+                # the reply is screened while its first sentence is being voiced
+                check.output(reply_text)
+                first = next(speech, None)
+                verdict, screened = _safety_verdict(check, assessment, req.session_id)
+                moderation = {"moderation": verdict.to_dict()}
+                if screened.tier != assessment.tier:
+                    yield _ndjson({"type": "safety", "risk_tier": screened.tier,
+                                   "safety_reply": screened.safety_reply})
+                if verdict.allowed:
+                    sentences = itertools.chain([first] if first is not None else [], speech)
+                else:
+                    reply_text, sentences = withheld_text(req.text), []
+            # kept from here on: a later cancel must not discard audio of a recorded turn
+            _commit_turn(token)
+            _record_turn(req.session_id, req.text, reply_text)
+            yield _ndjson({"type": "text", "user_text": req.text, "text": reply_text, "risk_tier": screened.tier,
+                           **moderation})
+
+            # the turn is committed; closing `speech` still stops TTS calls not yet started
+            for index, sentence, audio in sentences:
+                audio_base64 = base64.b64encode(audio).decode("ascii")
+                usage_accountant.record(TTS_MODEL, session_id=req.session_id, system_prompt=system_prompt,
+                                        voice=req.voice,
+                                        output_audio_s=audio_seconds(audio_base64, output_format.format))
+                audio_fields = _audio_fields(
+                    transcode_cache.convert_base64(audio_base64, output_format.format, output_format),
+                    req.audio_delivery)
+                yield _ndjson({
+                    "type": "audio",
+                    "index": index,
+                    "text": sentence,
+                    **audio_fields,
+                })
+        finally:
+            speech.close()
+        yield _ndjson({"type": "done"})
+
+    return StreamingResponse(_follow(idempotency.stream(key, events), token), media_type="application/x-ndjson")
+
+@app.websocket("/realtime")
+async def realtime_relay(websocket: WebSocket, voice: str = "shimmer", session_id: Optional[str] = None,
+                         prompt_id: Optional[str] = None):
+    """
+    Full-duplex voice over the realtime engine (ENGINE=realtime). The client
+    sends binary frames of 24 kHz mono pcm16 and JSON control messages:
+    `{"type": "interrupt", "played_ms": n}` after stopping playback, or
+    `{"type": "text", "text": ...}`. Turn ends are detected upstream (server
+    VAD). The server sends JSON events: `speech_started` (stop playback),
+    `user_text` with the risk tier, `safety` (high risk), `text` and `audio`
+    (pcm16) deltas of the reply, then `done`. With MODERATION=1 the deltas
+    are held back until the whole reply has passed the output check, then
+    sent at once; a flagged reply is replaced by a text-only one.
+    """
+    if not isinstance(engine, RealtimeEngine):
+        await websocket.close(code=1008, reason="Set ENGINE=realtime")
+        return
+    prompt = prompt_registry.resolve(prompt_id) if prompt_id else None
+    if prompt_id and prompt is None:
+        await websocket.close(code=1008, reason=f"Unknown prompt_id: {prompt_id}")
+        return
+    system_prompt = prompt.text if prompt else gpt_client.system_prompt
+    client_ip = websocket.client.host if websocket.client else None
+    allowed, _ = rate_limiter.check(client_ip, session_id, estimate_tokens(system_prompt))
+    if not allowed:
+        await websocket.close(code=1013, reason="Too many requests")
+        return
+
+    await websocket.accept()
+    conversation = (AudioConversation.from_session(session_store, session_id, _history_turns())
+                    if session_id else None)
+    try:
+        session = await run_in_threadpool(engine.open_stream, session_id, voice, system_prompt, conversation)
+    except Exception as e:
+        print("Realtime session failed to open:", e)
+        await websocket.send_json({"type": "error", "message": "Upstream unavailable"})
+        await websocket.close(code=1011)
+        return
+
+    async def from_client():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                await run_in_threadpool(session.append_audio, message["bytes"])
+                continue
+            control = json.loads(message.get("text") or "{}")
+            if control.get("type") == "interrupt":
+                await run_in_threadpool(session.interrupt, control.get("played_ms"))
+            elif control.get("type") == "text" and control.get("text"):
+                await to_user_text(control["text"])
+                await run_in_threadpool(session.send_text, control["text"], True)
+
+    turn = {"user_text": "", "reply": [], "held": [], "check": None, "assessment": None}
+
+    async def to_user_text(text):
+        # the reply may already be under way; the safety reply is sent alongside it
+        turn["user_text"] = text
+        assessment = turn["assessment"] = _triage(session_id, text)
+        if safety is not None:
+            turn["check"] = safety.begin(text)
+        await websocket.send_json({"type": "user_text", "text": text, "risk_tier": assessment.tier})
+        if assessment.tier == RISK_HIGH:
+            await websocket.send_json({"type": "safety", "risk_tier": assessment.tier,
+                                       "safety_reply": assessment.safety_reply})
+
+    async def to_client():
+        while not session.closed:
+            event = await run_in_threadpool(session.next_event, 1.0)
+            if event is None:
+                continue
+            kind = event["type"]
+            if kind == "input_audio_buffer.speech_started":
+                await websocket.send_json({"type": "speech_started"})
+            elif kind == "conversation.item.input_audio_transcription.completed":
+                await to_user_text(event.get("transcript", ""))
+            elif kind == "response.audio_transcript.delta":
+                turn["reply"].append(event.get("delta", ""))
+                await to_reply({"type": "text", "delta": event.get("delta", "")})
+            elif kind == "response.audio.delta":
+                await to_reply({"type": "audio", "audio_base64": event.get("delta", ""),
+                                "mime_type": MIME_TYPES["pcm16"]})
+            elif kind == "response.done":
+                status = (event.get("response") or {}).get("status")
+                reply_text = "".join(turn["reply"])
+                held, moderation = turn["held"], {}
+                if safety is not None and status == "completed":
+                    reply_text, held, moderation = await screen_reply(reply_text, held)
+                if status == "completed" and turn["user_text"]:
+                    _record_turn(session_id, turn["user_text"], reply_text)
+                for message in held if status == "completed" else []:
+                    await websocket.send_json(message)
+                turn.update(reply=[], held=[], check=None, assessment=None)
+                await websocket.send_json({"type": "done", "status": status, "text": reply_text, **moderation})
+            elif kind == "error":
+                await websocket.send_json({"type": "error", "message": (event.get("error") or {}).get("message", "")})
+
+    async def to_reply(message):
+        if safety is None:
+            await websocket.send_json(message)
+        else:
+            # released on response.done, once the reply has been screened
+            turn["held"].append(message)
+
+    async def screen_reply(reply_text, held):
+        """
+        :return: (reply text, messages to send, moderation fields) for the finished reply
+        """
+        # no transcript yet (it can trail the reply): screen the reply alone
+        check = turn["check"] or safety.begin("")
+        check.output(reply_text)
+        assessment = turn["assessment"] or get_triage().assess("")
+        verdict, screened = await run_in_threadpool(_safety_verdict, check, assessment, session_id)
+        if screened.tier != assessment.tier:
+            await websocket.send_json({"type": "safety", "risk_tier": screened.tier,
+                                       "safety_reply": screened.safety_reply})
+        if not verdict.allowed:
+            reply_text = withheld_text(turn["user_text"])
+            held = [{"type": "text", "delta": reply_text}]
+        return reply_text, held, {"moderation": verdict.to_dict()}
+
+    tasks = [asyncio.create_task(from_client()), asyncio.create_task(to_client())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        session.close()
@@ -0,0 +1,172 @@
+import base64
+import os
+import re
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Process-wide breaker in front of the upstream API.
+
+    Closed: calls go through; outcomes are kept for `window_s` seconds.
+    Opens when, with at least `min_calls` in the window, the error rate or the
+    slow-call rate (latency over `slow_call_s`) crosses its threshold.
+    Open: calls fail fast for `open_s` seconds.
+    Half-open: up to `half_open_calls` probes go through; a success closes the
+    breaker, a failure opens it again. A probe that ends without an outcome
+    (e.g. its turn was cancelled) is given back with release(); one that never
+    reports expires after `open_s`.
+    """
+
+    def __init__(self, window_s: float = 30.0, min_calls: int = 5, error_rate: float = 0.5,
+                 slow_call_s: float = 15.0, slow_rate: float = 0.8, open_s: float = 20.0, half_open_calls: int = 1):
+        self.window_s = window_s
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_s = slow_call_s
+        self.slow_rate = slow_rate
+        self.open_s = open_s
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self._calls = deque()  # (timestamp, ok, slow)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.opened = 0
+
+    def _trim(self, now):
+        while self._calls and now - self._calls[0][0] > self.window_s:
+            self._calls.popleft()
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.open_s:
+                self.state, self._probes = HALF_OPEN, 0
+            if self.state == HALF_OPEN and self._probes >= self.half_open_calls and \
+                    now - self._probe_at >= self.open_s:
+                # the probes never reported back
+                self._probes = 0
+            if self.state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                self._probe_at = now
+                return True
+            if self.state == CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self):
+        """
+        A call let through by allow() ended without reaching upstream or
+        without an outcome; a half-open probe is handed back.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record(self, ok: bool, latency_s: float = 0.0):
+        with self._lock:
+            now = time.monotonic()
+            slow = latency_s >= self.slow_call_s
+            if self.state == HALF_OPEN:
+                if ok and not slow:
+                    self.state = CLOSED
+                    self._calls.clear()
+                else:
+                    self._open(now)
+                return
+            self._calls.append((now, ok, slow))
+            self._trim(now)
+            total = len(self._calls)
+            if self.state == CLOSED and total >= self.min_calls:
+                errors = sum(1 for _, call_ok, _ in self._calls if not call_ok)
+                slows = sum(1 for _, _, call_slow in self._calls if call_slow)
+                if errors / total >= self.error_rate or slows / total >= self.slow_rate:
+                    self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self.opened += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"state": self.state, "opened": self.opened, "rejected": self.rejected,
+                    "window_calls": len(self._calls)}
+
+
+_upstream_breaker = CircuitBreaker(
+    error_rate=float(os.getenv("BREAKER_ERROR_RATE", "0.5")),
+    slow_call_s=float(os.getenv("BREAKER_SLOW_CALL_S", "15")),
+    open_s=float(os.getenv("BREAKER_OPEN_S", "20")),
+)
+
+
+def get_upstream_breaker() -> CircuitBreaker:
+    return _upstream_breaker
+
+
+_HANGUL = re.compile(r"[가-힣]")
+
+# Pre-approved supportive replies for when the model can't be reached.
+FALLBACK_TEXT = {
+    "ko": ("지금 연결이 잠시 불안정해서 바로 대답하기가 어려워. 그래도 네 이야기를 계속 듣고 싶어. "
+           "조금 뒤에 다시 말해줄래? 지금 많이 힘들다면 1393(자살 예방 상담 전화)에 24시간 연락할 수 있어."),
+    "en": ("I'm having trouble connecting right now, but I still want to hear from you. "
+           "Could you try again in a moment? If things feel really hard right now, you can call 1393 any time, "
+           "24 hours a day."),
+}
+
+
+def is_degraded_text(text: str) -> bool:
+    return text in FALLBACK_TEXT.values()
+
+
+class DegradedResponder:
+    """
+    Canned reply shaped like a model audio response (transcript/data).
+
+    Audio comes from pre-rendered files in `audio_dir` named
+    `<lang>_<voice>.<format>` or `<lang>.<format>`; without a file the reply
+    is text only.
+    """
+
+    def __init__(self, audio_dir: Optional[str] = None):
+        self.audio_dir = audio_dir
+        self._audio: Dict[tuple, str] = {}
+        self._lock = threading.Lock()
+
+    def _load_audio(self, lang, voice, fmt) -> str:
+        key = (lang, voice, fmt)
+        with self._lock:
+            if key not in self._audio:
+                data = ""
+                for name in (f"{lang}_{voice}.{fmt}", f"{lang}.{fmt}"):
+                    path = os.path.join(self.audio_dir, name) if self.audio_dir else None
+                    if path and os.path.exists(path):
+                        with open(path, "rb") as f:
+                            data = base64.b64encode(f.read()).decode("ascii")
+                        break
+                self._audio[key] = data
+            return self._audio[key]
+
+    def respond(self, user_text: str = "", voice: str = "shimmer", fmt: str = "mp3"):
+        lang = "ko" if _HANGUL.search(user_text or "") else "en"
+        return SimpleNamespace(transcript=FALLBACK_TEXT[lang], data=self._load_audio(lang, voice, fmt),
+                               degraded=True)
@@ -0,0 +1,187 @@
+import math
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+RISK_LOW = "low"
+RISK_MEDIUM = "medium"
+RISK_HIGH = "high"
+RISK_ORDER = {RISK_LOW: 0, RISK_MEDIUM: 1, RISK_HIGH: 2}
+
+# (phrase, weight). Hangul phrases are matched after lowercasing and removing all
+# whitespace, so Korean spacing variations ("죽고 싶어" / "죽고싶어") match the same entry.
+# Latin phrases are matched as whole words ("end it" does not match "spend it").
+RISK_PHRASES: List[Tuple[str, float]] = [
+    # explicit intent
+    ("자살", 3.0), ("자살하고싶", 2.0), ("죽고싶", 4.0), ("죽을래", 3.0), ("죽어버리", 4.0),
+    ("목숨을끊", 4.0), ("생을마감", 4.0), ("스스로목숨", 4.0), ("뛰어내리", 3.0), ("유서", 3.5),
+    ("suicide", 3.0), ("kill myself", 4.0), ("end my life", 4.0), ("want to die", 4.0),
+    ("take my own life", 4.0), ("suicide note", 3.5),
+    # plan / means / timing
+    ("방법을찾", 1.5), ("약을모", 2.5), ("오늘밤", 1.0), ("마지막으로", 1.0), ("작별", 1.5),
+    ("how to die", 2.5), ("tonight", 1.0), ("goodbye forever", 2.5), ("said goodbye", 1.5),
+    # self-harm
+    ("자해", 2.0), ("자해했", 2.0), ("자해하고싶", 2.0), ("손목을", 2.0), ("self harm", 2.0),
+    ("cut myself", 2.5), ("hurt myself", 2.0),
+    # hopelessness / burden
+    ("사라지고싶", 2.0), ("없어지고싶", 2.0), ("살기싫", 2.5), ("살이유", 1.5), ("희망이없", 1.5),
+    ("다끝내고싶", 2.5), ("그만두고싶", 1.0), ("짐이되", 1.5), ("없는게나", 2.0),
+    ("disappear", 1.5), ("no point in living", 2.5), ("hopeless", 1.5), ("better off without me", 2.5),
+    ("end it", 1.5), ("give up on life", 2.0), ("a burden", 1.0),
+    # distress (weak signals)
+    ("너무힘들", 0.7), ("외로워", 0.5), ("우울", 0.7), ("아무도없", 0.8), ("괴롭", 0.5),
+    ("overwhelmed", 0.5), ("depressed", 0.7), ("lonely", 0.5), ("no one cares", 0.8),
+]
+
+# Statements of intent or of self-harm: a match is high risk whatever else the message says.
+INTENT_PHRASES = {
+    "자살하고싶", "죽고싶", "죽어버리", "목숨을끊", "생을마감", "스스로목숨", "자해했", "자해하고싶",
+    "kill myself", "end my life", "want to die", "take my own life", "cut myself",
+}
+
+# Phrases that soften a match ("자살 예방", "not suicidal"). Topic words (homework,
+# a movie) are deliberately absent: the stress they name is itself a risk factor.
+DAMPING_PHRASES: List[Tuple[str, float]] = [
+    ("예방", -1.5), ("친구가", -0.5),
+    ("not suicidal", -3.0), ("prevention", -1.5),
+    ("농담", -1.5), ("jk", -0.5), ("kidding", -1.0),
+]
+
+# Scripted replies taken from the counselor system prompt (startup_event).
+SAFETY_REPLIES: Dict[str, Dict[str, str]] = {
+    "ko": {
+        RISK_HIGH: ("정말 위급한 상황인 것 같아. 전문가와 이야기해 보는 게 도움이 될 수 있어. 내가 도와줄게. "
+                    "24시간 도움을 받을 수 있는 전화가 있어. 1393(자살 예방 상담 전화)에 연락해 볼 수 있어."),
+        RISK_MEDIUM: "지금은 네가 혼자가 아니라는 걸 꼭 기억해줘.",
+    },
+    "en": {
+        RISK_HIGH: ("This sounds really serious, and I'm glad you told me. Talking to a professional can help, "
+                    "and I'll help you get there. You can call 1393, the 24-hour suicide prevention line, "
+                    "or your local emergency number right now."),
+        RISK_MEDIUM: "Please remember that you are not alone right now.",
+    },
+}
+
+_WHITESPACE = re.compile(r"\s+")
+_NON_WORD = re.compile(r"[^0-9a-z가-힣]+")
+_HANGUL = re.compile(r"[가-힣]")
+
+
+class PhraseAutomaton:
+    """
+    Aho-Corasick automaton: one pass over the text finds every phrase, so
+    cost is linear in the message length regardless of lexicon size.
+    """
+
+    def __init__(self, phrases: List[Tuple[str, float]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, float]]] = [[]]
+        for phrase, weight in phrases:
+            self._add(phrase, weight)
+        self._build()
+
+    def _add(self, phrase, weight):
+        node = 0
+        for ch in phrase:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((phrase, weight))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text: str) -> List[Tuple[str, float]]:
+        node = 0
+        found = []
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            if self._out[node]:
+                found.extend(self._out[node])
+        return found
+
+
+@dataclass
+class RiskAssessment:
+    tier: str
+    score: float
+    matches: List[str] = field(default_factory=list)
+    language: str = "ko"
+
+    @property
+    def safety_reply(self) -> str:
+        return SAFETY_REPLIES[self.language].get(self.tier, "")
+
+
+class CrisisTriage:
+    """
+    Local, CPU-only risk screen that runs before the LLM call.
+
+    Score is a logistic model over the matched phrase weights: each distinct
+    phrase counts once, several independent signals add up, damping phrases
+    subtract. Damping never lowers a statement of intent (INTENT_PHRASES)
+    below high. It is deliberately tuned for recall; the LLM still does the
+    nuanced assessment.
+    """
+
+    def __init__(self, phrases=RISK_PHRASES, damping=DAMPING_PHRASES, intent=INTENT_PHRASES,
+                 bias: float = -2.5, medium_threshold: float = 0.35, high_threshold: float = 0.75):
+        lexicon = list(phrases) + list(damping)
+        # Hangul is matched with spacing removed; Latin phrases are padded to match whole words only
+        self.automaton = PhraseAutomaton([(p, w) for p, w in lexicon if _HANGUL.search(p)])
+        self.word_automaton = PhraseAutomaton([(f" {p} ", w) for p, w in lexicon if not _HANGUL.search(p)])
+        self.intent = set(intent)
+        self.bias = bias
+        self.medium_threshold = medium_threshold
+        self.high_threshold = high_threshold
+
+    def assess(self, text: str) -> RiskAssessment:
+        language = "ko" if _HANGUL.search(text or "") else "en"
+        lowered = (text or "").lower()
+        matched = dict(self.automaton.find(_WHITESPACE.sub("", lowered)))
+        matched.update((p.strip(), w) for p, w in self.word_automaton.find(f" {_NON_WORD.sub(' ', lowered)} "))
+        positive = [w for w in matched.values() if w > 0]
+        # co-occurring independent signals are stronger than any one phrase
+        z = self.bias + sum(matched.values()) + 0.5 * max(0, len(positive) - 1)
+        score = 1.0 / (1.0 + math.exp(-z))
+        if self.intent.intersection(matched):
+            score = max(score, self.high_threshold)
+        if score >= self.high_threshold:
+            tier = RISK_HIGH
+        elif score >= self.medium_threshold:
+            tier = RISK_MEDIUM
+        else:
+            tier = RISK_LOW
+        return RiskAssessment(tier=tier, score=round(score, 4), matches=sorted(matched), language=language)
+
+
+def max_tier(a: str, b: str) -> str:
+    return a if RISK_ORDER.get(a, 0) >= RISK_ORDER.get(b, 0) else b
+
+
+_default_triage = None
+
+
+def get_triage() -> CrisisTriage:
+    global _default_triage
+    if _default_triage is None:
+        _default_triage = CrisisTriage()
+    return _default_triage
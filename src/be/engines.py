@@ -0,0 +1,540 @@
+"""
+Upstream engines behind one interface, chosen with ENGINE=completion|realtime.
+
+CompletionEngine is the request/response chat.completions path
+(GPT4oAudioClient). RealtimeEngine keeps one persistent Realtime API
+websocket per conversation session: the connection and the conversation
+live upstream between turns, so a turn sends only its own audio, and the
+reply streams back as it is generated. Sessions from open_stream() use
+server-side VAD and can be interrupted mid-reply.
+
+Turns return the reply as an object with `transcript`, `data` (base64
+audio), `format` (the format `data` is in), `id` and `expires_at`.
+"""
+import base64
+import io
+import json
+import queue
+import threading
+import time
+import wave
+from collections import OrderedDict
+from contextlib import nullcontext
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+
+from audio_format import PCM16_RATE, OutputFormat, transcode
+from cancellation import TurnCancelled
+from circuit_breaker import get_upstream_breaker
+
+REALTIME_URL = "wss://api.openai.com/v1/realtime"
+_APPEND_CHUNK = 2 * PCM16_RATE  # bytes of pcm16 per input_audio_buffer.append (1 s)
+_CANCEL_POLL_S = 0.1
+_CANCEL_SETTLE_S = 2.0  # how long a cancelled response gets to wind down before the connection is dropped
+
+
+class RealtimeError(RuntimeError):
+    pass
+
+
+def to_pcm16(audio_bytes: bytes, src_format: str = "wav") -> bytes:
+    """
+    24 kHz mono 16-bit pcm, the Realtime API's input format. wav that
+    already matches is unpacked with the stdlib; anything else goes through pydub.
+    """
+    if src_format == "pcm16":
+        return audio_bytes
+    if src_format == "wav":
+        try:
+            with wave.open(io.BytesIO(audio_bytes)) as f:
+                if (f.getframerate(), f.getnchannels(), f.getsampwidth()) == (PCM16_RATE, 1, 2):
+                    return f.readframes(f.getnframes())
+        except (wave.Error, EOFError):
+            pass
+    return transcode(audio_bytes, src_format, OutputFormat("pcm16"), trim=False)
+
+
+def _reply(audio, fmt: str):
+    return SimpleNamespace(transcript=getattr(audio, "transcript", "") or "", data=getattr(audio, "data", "") or "",
+                           format=fmt, id=getattr(audio, "id", None), expires_at=getattr(audio, "expires_at", None),
+                           degraded=getattr(audio, "degraded", False))
+
+
+def _chat_usage(usage: Optional[Dict]):
+    """
+    Realtime `response.done` usage in the shape of chat.completions usage (for UsageAccountant).
+    """
+    if not usage:
+        return None
+    in_details = usage.get("input_token_details") or {}
+    out_details = usage.get("output_token_details") or {}
+    return SimpleNamespace(
+        prompt_tokens=usage.get("input_tokens", 0),
+        completion_tokens=usage.get("output_tokens", 0),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=in_details.get("cached_tokens", 0),
+                                              audio_tokens=in_details.get("audio_tokens", 0)),
+        completion_tokens_details=SimpleNamespace(audio_tokens=out_details.get("audio_tokens", 0)),
+    )
+
+
+def _pairs(convo_history: List[Dict]) -> List[Tuple[str, str]]:
+    """
+    (user, assistant) transcripts from chat messages; audio references are skipped.
+    """
+    pairs, user = [], None
+    for message in convo_history:
+        content = message.get("content")
+        if not isinstance(content, str):
+            continue
+        if message["role"] == "user":
+            user = content
+        elif message["role"] == "assistant" and user is not None:
+            pairs.append((user, content))
+            user = None
+    return pairs
+
+
+class CompletionEngine:
+    name = "completion"
+
+    def __init__(self, gpt_client):
+        self.gpt_client = gpt_client
+
+    def audio_turn(self, audio_base64, conversation=None, transcript="", risk_tier="low", output_audio_config=None,
+                   system_prompt=None, session_id=None, cancel=None):
+        audio_config = output_audio_config or self.gpt_client.output_audio_config
+        audio = self.gpt_client.chat_completion_audio_turn(
+            audio_base64, conversation, transcript=transcript, risk_tier=risk_tier,
+            output_audio_config=audio_config, system_prompt=system_prompt, session_id=session_id, cancel=cancel)
+        return _reply(audio, audio_config.get("format", "mp3"))
+
+    def text_turn(self, user_text, convo_history: List = [], risk_tier="low", output_audio_config=None,
+                  system_prompt=None, session_id=None, cancel=None):
+        audio_config = output_audio_config or self.gpt_client.output_audio_config
+        audio = self.gpt_client.chat_completion_text_input(
+            user_text, convo_history=convo_history, risk_tier=risk_tier, output_audio_config=audio_config,
+            system_prompt=system_prompt, session_id=session_id, cancel=cancel)
+        return _reply(audio, audio_config.get("format", "mp3"))
+
+    def stats(self) -> Dict:
+        return {"engine": self.name}
+
+    def close(self):
+        pass
+
+
+class RealtimeSession:
+    """
+    One Realtime API connection. A reader thread queues server events and
+    tracks the response in progress; turns on a session are serialized by `lock`.
+
+    :param connection: object with send(str), recv() -> str and close(), e.g. a
+        websockets sync client connection or stub_realtime.StubConnection
+    :param vad: server-side turn detection; without it the caller commits the audio buffer
+    :param on_done: called from the reader thread with each `response.done` payload and its latency
+    :param on_close: called once when the session is closed
+    """
+
+    def __init__(self, connection, voice: str, instructions: str, vad: bool = False,
+                 transcribe_model: Optional[str] = None, on_done: Optional[Callable] = None,
+                 on_close: Optional[Callable] = None):
+        self.connection = connection
+        self.voice = voice
+        self.instructions = instructions
+        self.on_done = on_done
+        self.on_close = on_close
+        self.lock = threading.Lock()
+        self.events = queue.Queue()
+        self.closed = False
+        self.last_used = time.monotonic()
+        self.response_id = None  # response being generated
+        self.response_started = None
+        self.audio_item_id = None  # assistant item whose audio the client is playing
+        self._send({"type": "session.update", "session": {
+            "modalities": ["text", "audio"],
+            "voice": voice,
+            "instructions": instructions,
+            "input_audio_format": "pcm16",
+            "output_audio_format": "pcm16",
+            "turn_detection": {"type": "server_vad", "silence_duration_ms": 500} if vad else None,
+            "input_audio_transcription": {"model": transcribe_model} if transcribe_model else None,
+        }})
+        threading.Thread(target=self._read, name="realtime-reader", daemon=True).start()
+
+    def _send(self, event: Dict):
+        if self.closed:
+            raise RealtimeError("Realtime session closed")
+        try:
+            self.connection.send(json.dumps(event, ensure_ascii=False))
+        except Exception as e:
+            self.closed = True
+            raise RealtimeError(f"Realtime send failed: {e}") from e
+
+    def _read(self):
+        try:
+            while True:
+                event = json.loads(self.connection.recv())
+                kind = event.get("type")
+                if kind == "response.created":
+                    self.response_id = event["response"]["id"]
+                    self.response_started = time.perf_counter()
+                elif kind == "response.output_item.added":
+                    self.audio_item_id = event["item"]["id"]
+                elif kind == "response.done":
+                    self.response_id = None
+                    if self.on_done is not None:
+                        self.on_done(event.get("response") or {}, time.perf_counter() - (self.response_started or 0))
+                self.events.put(event)
+        except Exception as e:
+            if not self.closed:
+                print("Realtime connection closed:", e)
+        self.closed = True
+        self.events.put({"type": "session.closed"})
+
+    def set_instructions(self, instructions: str):
+        if instructions != self.instructions:
+            self.instructions = instructions
+            self._send({"type": "session.update", "session": {"instructions": instructions}})
+
+    def seed(self, history: List[Tuple[str, str]]):
+        """
+        Replay earlier turns as text items, for a connection opened mid-conversation.
+        """
+        for user, assistant in history:
+            self._send({"type": "conversation.item.create", "item": {
+                "type": "message", "role": "user", "content": [{"type": "input_text", "text": user}]}})
+            self._send({"type": "conversation.item.create", "item": {
+                "type": "message", "role": "assistant", "content": [{"type": "text", "text": assistant}]}})
+
+    def append_audio(self, pcm16: bytes):
+        for start in range(0, len(pcm16), _APPEND_CHUNK):
+            chunk = base64.b64encode(pcm16[start:start + _APPEND_CHUNK]).decode("ascii")
+            self._send({"type": "input_audio_buffer.append", "audio": chunk})
+
+    def commit(self):
+        self._send({"type": "input_audio_buffer.commit"})
+
+    def send_text(self, text: str, respond: bool = False):
+        self._send({"type": "conversation.item.create", "item": {
+            "type": "message", "role": "user", "content": [{"type": "input_text", "text": text}]}})
+        if respond:
+            self.respond()
+
+    def respond(self):
+        self._send({"type": "response.create"})
+
+    def interrupt(self, played_ms: Optional[int] = None):
+        """
+        Stop the reply in progress; with `played_ms`, also cut the assistant's
+        last item to what the user actually heard, so the model's context matches.
+        """
+        if self.response_id is not None:
+            self._send({"type": "response.cancel"})
+        if played_ms is not None and self.audio_item_id is not None:
+            self._send({"type": "conversation.item.truncate", "item_id": self.audio_item_id,
+                        "content_index": 0, "audio_end_ms": int(played_ms)})
+
+    def next_event(self, timeout: Optional[float] = None) -> Optional[Dict]:
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self):
+        while self.next_event(0) is not None:
+            pass
+
+    def collect(self, timeout_s: float, cancel=None) -> Tuple[str, bytes, Dict]:
+        """
+        Wait for the current response; returns (transcript, pcm16 audio, response.done payload).
+        :param cancel: optional cancellation.CancelToken; once cancelled the response is
+            stopped (and cut from the conversation) and TurnCancelled is raised
+        """
+        deadline = time.monotonic() + timeout_s
+        transcript, audio = [], []
+        while True:
+            if cancel is not None and cancel.cancelled:
+                self._abandon()
+                raise TurnCancelled(cancel.reason)
+            remaining = max(0.0, deadline - time.monotonic())
+            event = self.next_event(remaining if cancel is None else min(remaining, _CANCEL_POLL_S))
+            if event is None:
+                if time.monotonic() < deadline:
+                    continue
+                self.interrupt()
+                raise TimeoutError(f"No realtime response within {timeout_s}s")
+            kind = event["type"]
+            if kind == "response.audio_transcript.delta":
+                transcript.append(event.get("delta", ""))
+            elif kind == "response.audio.delta":
+                audio.append(base64.b64decode(event.get("delta", "")))
+            elif kind == "response.done":
+                response = event.get("response") or {}
+                if response.get("status") not in ("completed", None):
+                    raise RealtimeError(f"Realtime response {response.get('status')}: "
+                                        f"{response.get('status_details')}")
+                return "".join(transcript), b"".join(audio), response
+            elif kind == "error":
+                raise RealtimeError((event.get("error") or {}).get("message", "realtime error"))
+            elif kind == "session.closed":
+                raise RealtimeError("Realtime session closed")
+
+    def _abandon(self):
+        """
+        Cancel the response in progress and wait for it to wind down, so the
+        connection is clean for the next turn; it is closed if it doesn't.
+        """
+        try:
+            # nobody heard any of it
+            self.interrupt(played_ms=0)
+            deadline = time.monotonic() + _CANCEL_SETTLE_S
+            while time.monotonic() < deadline:
+                event = self.next_event(deadline - time.monotonic())
+                if event is not None and event["type"] == "response.done":
+                    return
+        except RealtimeError:
+            pass
+        self.close()
+
+    def close(self):
+        if self.on_close is not None and not self.closed:
+            self.on_close()
+        self.closed = True
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+
+
+def websocket_connector(url: str, api_key: Optional[str], model: str) -> Callable:
+    """
+    Connection factory for RealtimeEngine over websockets (imported on first connect).
+    """
+    def connect():
+        from websockets.sync.client import connect as ws_connect
+
+        headers = {"OpenAI-Beta": "realtime=v1"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        return ws_connect(f"{url}?model={model}", additional_headers=headers, max_size=None)
+    return connect
+
+
+class RealtimeEngine:
+    """
+    :param connect: zero-argument factory returning a new connection (see websocket_connector)
+    :param max_sessions: pooled connections per worker (LRU); idle ones are closed after `idle_s`
+    """
+    name = "realtime"
+
+    def __init__(self, connect: Callable, model: str = "gpt-4o-realtime-preview", system_prompt: str = "",
+                 voice: str = "shimmer", max_sessions: int = 64, idle_s: float = 600.0, turn_timeout_s: float = 30.0,
+                 max_retry: int = 2, transcribe_model: str = "gpt-4o-transcribe", breaker=None, usage=None,
+                 scheduler=None, fallback=None):
+        self.connect = connect
+        self.model = model
+        self.system_prompt = system_prompt
+        self.voice = voice
+        self.max_sessions = max_sessions
+        self.idle_s = idle_s
+        self.turn_timeout_s = turn_timeout_s
+        self.max_retry = max_retry
+        self.transcribe_model = transcribe_model
+        self.breaker = breaker or get_upstream_breaker()
+        self.usage = usage
+        self.scheduler = scheduler
+        self.fallback = fallback
+        self._sessions: "OrderedDict[str, RealtimeSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"connects": 0, "reuses": 0, "turns": 0, "failures": 0, "cancelled": 0, "streams": 0}
+
+    @staticmethod
+    def _instructions(system_prompt: str, summary: str = "") -> str:
+        if summary:
+            return f"{system_prompt}\n\nSummary of the earlier conversation: {summary}"
+        return system_prompt
+
+    def _open(self, voice, instructions, history, vad=False, on_done=None, on_close=None) -> RealtimeSession:
+        session = RealtimeSession(self.connect(), voice, instructions, vad=vad,
+                                  transcribe_model=self.transcribe_model if vad else None, on_done=on_done,
+                                  on_close=on_close)
+        session.seed(history)
+        self.counters["connects"] += 1
+        return session
+
+    def _session(self, session_id, voice, instructions, history) -> RealtimeSession:
+        stale = []
+        with self._lock:
+            now = time.monotonic()
+            for sid, pooled in list(self._sessions.items()):
+                if pooled.closed or now - pooled.last_used > self.idle_s:
+                    stale.append(self._sessions.pop(sid))
+            session = self._sessions.get(session_id) if session_id else None
+            if session is not None and session.voice != voice:
+                # the voice can't change once the assistant has spoken on a connection
+                stale.append(self._sessions.pop(session_id))
+                session = None
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                self.counters["reuses"] += 1
+        for pooled in stale:
+            pooled.close()
+        if session is None:
+            session = self._open(voice, instructions, history)
+            if session_id:
+                with self._lock:
+                    self._sessions[session_id] = session
+                    while len(self._sessions) > self.max_sessions:
+                        _, evicted = self._sessions.popitem(last=False)
+                        stale.append(evicted)
+                for pooled in stale:
+                    pooled.close()
+        session.last_used = time.monotonic()
+        return session
+
+    def _drop(self, session_id, session):
+        with self._lock:
+            if session_id and self._sessions.get(session_id) is session:
+                del self._sessions[session_id]
+        if session is not None:
+            session.close()
+
+    def _slot(self, risk_tier, cancel=None):
+        return self.scheduler.slot(risk_tier, cancel=cancel) if self.scheduler is not None else nullcontext()
+
+    def _record_usage(self, response, started, session_id, system_prompt, voice, input_pcm=b"", output_pcm=b"",
+                      ok=True):
+        if self.usage is None:
+            return
+        self.usage.record(self.model, _chat_usage((response or {}).get("usage")), session_id=session_id,
+                          system_prompt=system_prompt or self.system_prompt, voice=voice,
+                          input_audio_s=len(input_pcm) / (2 * PCM16_RATE),
+                          output_audio_s=len(output_pcm) / (2 * PCM16_RATE),
+                          latency_s=time.perf_counter() - started, ok=ok)
+
+    def _turn(self, send: Callable, user_text, history, summary, risk_tier, audio_config, system_prompt,
+              session_id, input_pcm=b"", cancel=None):
+        voice = audio_config.get("voice", self.voice)
+        instructions = self._instructions(system_prompt or self.system_prompt, summary)
+        self.counters["turns"] += 1
+        for attempt in range(self.max_retry):
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            if not self.breaker.allow():
+                print("⛔ Upstream circuit open, failing fast.")
+                break
+            session = None
+            started = time.perf_counter()
+            try:
+                with self._slot(risk_tier, cancel):
+                    started = time.perf_counter()
+                    session = self._session(session_id, voice, instructions, history)
+                    with session.lock:
+                        if cancel is not None:
+                            cancel.raise_if_cancelled()
+                        session.drain()
+                        session.set_instructions(instructions)
+                        send(session)
+                        session.respond()
+                        transcript, pcm16, response = session.collect(self.turn_timeout_s, cancel)
+            except TurnCancelled:
+                self.counters["cancelled"] += 1
+                # no outcome to report; a half-open probe goes back
+                self.breaker.release()
+                if session is not None and (session.closed or not session_id):
+                    self._drop(session_id, session)
+                raise
+            except Exception as e:
+                print(f"Realtime turn failed (attempt {attempt + 1} of {self.max_retry}):", e)
+                self.counters["failures"] += 1
+                self.breaker.record(False, time.perf_counter() - started)
+                self._record_usage(None, started, session_id, system_prompt, voice, ok=False)
+                # the next attempt reconnects and replays the history
+                self._drop(session_id, session)
+                continue
+            self.breaker.record(True, time.perf_counter() - started)
+            self._record_usage(response, started, session_id, system_prompt, voice, input_pcm, pcm16)
+            if not session_id:
+                session.close()
+            return SimpleNamespace(transcript=transcript, data=base64.b64encode(pcm16).decode("ascii"),
+                                   format="pcm16", id=None, expires_at=None, degraded=False)
+
+        print("❌ Failed to get a realtime response.")
+        fmt = audio_config.get("format", "mp3")
+        if self.fallback is None:
+            return _reply(None, fmt)
+        return _reply(self.fallback.respond(user_text, voice=voice, fmt=fmt), fmt)
+
+    def audio_turn(self, audio_base64, conversation=None, transcript="", risk_tier="low", output_audio_config=None,
+                   system_prompt=None, session_id=None, cancel=None):
+        """
+        :param conversation: audio_conversation.AudioConversation; only replayed when a
+            new connection has to be opened for the session
+        """
+        pcm16 = to_pcm16(base64.b64decode(audio_base64))
+        history = [(turn.user_transcript, turn.assistant_transcript) for turn in conversation.turns] \
+            if conversation is not None else []
+        summary = conversation.summary if conversation is not None else ""
+
+        def send(session):
+            session.append_audio(pcm16)
+            session.commit()
+
+        return self._turn(send, transcript, history, summary, risk_tier,
+                          output_audio_config or {"voice": self.voice, "format": "pcm16"},
+                          system_prompt, session_id, input_pcm=pcm16, cancel=cancel)
+
+    def text_turn(self, user_text, convo_history: List = [], risk_tier="low", output_audio_config=None,
+                  system_prompt=None, session_id=None, cancel=None):
+        return self._turn(lambda session: session.send_text(user_text), user_text, _pairs(convo_history), "",
+                          risk_tier, output_audio_config or {"voice": self.voice, "format": "pcm16"},
+                          system_prompt, session_id, cancel=cancel)
+
+    def open_stream(self, session_id=None, voice=None, system_prompt=None, conversation=None) -> RealtimeSession:
+        """
+        Dedicated full-duplex session: server VAD decides when the user has
+        finished, input is transcribed upstream, and replies can be interrupted.
+        Not pooled; close it when the client goes away.
+        """
+        if not self.breaker.allow():
+            raise RealtimeError("Upstream circuit open")
+        voice = voice or self.voice
+        history = [(turn.user_transcript, turn.assistant_transcript) for turn in conversation.turns] \
+            if conversation is not None else []
+        instructions = self._instructions(system_prompt or self.system_prompt,
+                                          conversation.summary if conversation is not None else "")
+
+        replied = threading.Event()
+
+        def on_done(response, latency_s):
+            replied.set()
+            # an interrupted reply is a healthy upstream
+            self.breaker.record(response.get("status") in ("completed", "cancelled"), latency_s)
+            if self.usage is not None:
+                self.usage.record(self.model, _chat_usage(response.get("usage")), session_id=session_id,
+                                  system_prompt=system_prompt or self.system_prompt, voice=voice,
+                                  latency_s=latency_s, ok=response.get("status") != "failed")
+
+        def on_close():
+            # closed before any reply: no outcome for the breaker, give its probe back
+            if not replied.is_set():
+                self.breaker.release()
+
+        self.counters["streams"] += 1
+        try:
+            return self._open(voice, instructions, history, vad=True, on_done=on_done, on_close=on_close)
+        except Exception:
+            self.breaker.record(False)
+            raise
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pooled = len(self._sessions)
+        return dict(self.counters, engine=self.name, model=self.model, pooled_sessions=pooled)
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
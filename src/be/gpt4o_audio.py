@@ -1,24 +1,71 @@
-from openai import OpenAI
-from dotenv import load_dotenv
 import os
 import base64
-import requests
 from typing import List, Dict
 import json
+import time
+import threading
+from contextlib import nullcontext
+from types import SimpleNamespace
+from circuit_breaker import CircuitOpenError, get_upstream_breaker
+from audio_fetch import AudioFetcher
+from artifact_store import write_base64_async
+from usage_accounting import audio_seconds
+from audio_format import TTS_FORMAT_NAMES
+from speculation import GenerationCancelled
+from cancellation import CancelToken, TurnCancelled, call_cancellable
+from audio_conversation import AudioConversation, input_audio_message
 
 
 class GPT4oAudioClient:
-    def __init__(self, api_key, system_prompt, output_audio_config, model="gpt-4o-audio-preview", input_audio_format="wav", max_retry=3):
+    def __init__(self, api_key, system_prompt, output_audio_config, model="gpt-4o-audio-preview", input_audio_format="wav", max_retry=3, router=None, text_model="gpt-4o-mini", openai_client=None,
+                 breaker=None, fallback=None, audio_fetcher=None, memory=None, memory_top_k=3, usage=None,
+                 scheduler=None, speech=None):
         """
         Initialize the client with the provided API key.
+        :param router: optional ModelRouter; when set, the model is chosen per turn instead of `model`
+        :param text_model: model used by chat_completion_text_cancellable (text first, speech synthesized separately)
+        :param openai_client: prebuilt client to use instead (e.g. stub_upstream.StubOpenAI)
+        :param breaker: CircuitBreaker guarding upstream calls; defaults to the process-wide one
+        :param fallback: DegradedResponder used when upstream is unavailable; None returns an empty dict
+        :param audio_fetcher: AudioFetcher for URL input; defaults to one configured by
+            AUDIO_FETCH_CACHE_DIR / AUDIO_FETCH_MAX_MB
+        :param memory: optional semantic_memory.SemanticMemory; relevant earlier turns of the
+            session are added ahead of convo_history
+        :param memory_top_k: how many earlier turns to retrieve
+        :param usage: optional usage_accounting.UsageAccountant; every upstream call is recorded
+        :param scheduler: optional priority_scheduler.PriorityScheduler; upstream calls wait for a
+            slot there, ordered by the turn's risk tier
+        :param speech: optional speech_pipeline.SentenceSpeechPipeline; a reply that comes back with
+            text but no audio is voiced with it instead of being regenerated
         """
-        self.client = OpenAI(api_key=api_key)
+        if openai_client is None:
+            # imported here so importing this module (Streamlit reruns, server cold start) stays cheap
+            from openai import OpenAI
+
+            openai_client = OpenAI(api_key=api_key)
+        self.client = openai_client
         self.system_prompt = system_prompt
         self.output_audio_config = output_audio_config
         self.model = model
         self.input_audio_format = input_audio_format
         self.chat_history = []
         self.max_retry = max_retry
+        self.router = router
+        self.text_model = text_model
+        self.breaker = breaker or get_upstream_breaker()
+        self.fallback = fallback
+        self.audio_fetcher = audio_fetcher or AudioFetcher(
+            cache_dir=os.getenv("AUDIO_FETCH_CACHE_DIR"),
+            max_bytes=int(float(os.getenv("AUDIO_FETCH_MAX_MB", "25")) * 1024 * 1024),
+        )
+        self.memory = memory
+        self.memory_top_k = memory_top_k
+        self.usage = usage
+        self.scheduler = scheduler
+        self.speech = speech
+        self._salvage = {"responses": 0, "missing_audio": 0, "salvaged": 0, "salvage_failed": 0,
+                         "salvage_latency_s": 0.0}
+        self._salvage_lock = threading.Lock()
 
 
     def _gen_convo_history_turn(self, user_query: str, ai_response: str):
@@ -27,43 +74,89 @@ class GPT4oAudioClient:
             {"role": "assistant", "content": ai_response.strip()}
         ]
 
-    def _create_message_with_convo_history(self, user_data, data_type="text", convo_history:List = []) -> List[Dict]:
+    def _create_message_with_convo_history(self, user_data, data_type="text", convo_history:List = [],
+                                           system_prompt=None, session_id=None, query_text=None) -> List[Dict]:
         """
         :param user_data: current user's query
         :param data_type: "text" or "audio"
+        :param system_prompt: per-call override of self.system_prompt
+        :param session_id: with a semantic memory, earlier turns of this session relevant to
+            user_data are included before convo_history (which is assumed to be the latest turns)
+        :param query_text: what to search the memory with for audio user_data (its transcript)
         :return: list of dictionary
         """
-        messages = [{"role": "system", "content": self.system_prompt}]
+        messages = [{"role": "system", "content": system_prompt or self.system_prompt}]
         messages += self.chat_history
+        query = user_data if data_type == "text" else query_text
+        if self.memory is not None and session_id and query:
+            for turn in self.memory.search(session_id, query, k=self.memory_top_k,
+                                           exclude_last=len(convo_history) // 2):
+                messages += self._gen_convo_history_turn(turn["user"], turn["assistant"])
         if   data_type == "text":
             messages += convo_history + [{"role": "user", "content": user_data}]
         elif data_type == "audio":
-            messages += convo_history + [{
-                "role": "user",
-                "content": "...",
-                "type": "input_audio",
-                "input_audio": {
-                    "data": user_data,
-                    "format": self.input_audio_format
-                }
-            }]
+            messages += convo_history + [input_audio_message(user_data, self.input_audio_format)]
 
         return messages
 
-    def chat_completion_text_input(self, user_query, f_out_wav=None, convo_history: List = []):
+    def chat_completion_text_input(self, user_query, f_out_wav=None, convo_history: List = [], risk_tier="low",
+                                   output_audio_config=None, system_prompt=None, session_id=None, cancel=None):
         """
         Calls GPT-4o audio chat with retries if audio is missing.
         On retry, it shortens context and prompts for a briefer response.
+        With a router, each retry moves on to the next model in the routing decision.
+        :param output_audio_config: per-call override of self.output_audio_config
+        :param cancel: optional cancellation.CancelToken; once cancelled, no further
+            attempt is made and TurnCancelled is raised
         """
+        audio_config = output_audio_config or self.output_audio_config
         original_messages = self._create_message_with_convo_history(
-            user_query, data_type="text", convo_history=convo_history
+            user_query, data_type="text", convo_history=convo_history, system_prompt=system_prompt,
+            session_id=session_id
         )
         print("Messages for chat_completion_text_input:", json.dumps(original_messages, indent=4))
+        prompt_chars = sum(len(str(msg.get("content", ""))) for msg in original_messages)
+        return self._audio_completion(original_messages, user_query, prompt_chars, risk_tier, audio_config,
+                                      system_prompt, session_id, f_out_wav, cancel)
+
+    def chat_completion_audio_turn(self, audio_base64, conversation: AudioConversation = None, transcript="",
+                                   risk_tier="low", output_audio_config=None, system_prompt=None,
+                                   session_id=None, f_out_wav=None, cancel=None):
+        """
+        Audio-native turn: the current clip is sent as audio, earlier turns of
+        `conversation` as transcripts or upstream audio references.
+        :param transcript: transcript of the clip if known; used for routing and the degraded reply
+        :return: the response's audio (id, transcript, data, expires_at), as chat_completion_text_input
+        """
+        audio_config = output_audio_config or self.output_audio_config
+        history = conversation.history_messages() if conversation is not None else []
+        original_messages = self._create_message_with_convo_history(
+            audio_base64, data_type="audio", convo_history=history, system_prompt=system_prompt,
+            session_id=session_id, query_text=transcript
+        )
+        prompt_chars = sum(len(str(msg.get("content", ""))) for msg in original_messages[:-1]) + len(transcript)
+        return self._audio_completion(original_messages, transcript, prompt_chars, risk_tier, audio_config,
+                                      system_prompt, session_id, f_out_wav, cancel)
+
+    def _audio_completion(self, original_messages, user_query, prompt_chars, risk_tier, audio_config,
+                          system_prompt, session_id, f_out_wav, cancel=None):
+        candidates = [self.model]
+        if self.router is not None:
+            decision = self.router.route(user_query, prompt_chars=prompt_chars, risk_tier=risk_tier)
+            candidates = decision.candidates
+            print(f"🧭 Routed to {decision.model} ({decision.reason}, complexity={decision.complexity})")
 
         attempt = 0
         last_message = None
 
         while attempt < self.max_retry:
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            if not self.breaker.allow():
+                print("⛔ Upstream circuit open, failing fast.")
+                break
+            model = candidates[attempt % len(candidates)]
+            started = time.perf_counter()
             try:
                 print(f"🔁 Attempt {attempt + 1} of {self.max_retry}")
 
@@ -80,12 +173,20 @@ class GPT4oAudioClient:
                         {"role": "user", "content": "Please answer briefly (under 10 words), kindly and supportively."}
                     ]
 
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    modalities=["text", "audio"],
-                    audio=self.output_audio_config,
-                    messages=messages,
-                )
+                with self._upstream_slot(risk_tier, cancel):
+                    # queueing time is not upstream latency
+                    started = time.perf_counter()
+                    response = call_cancellable(
+                        cancel,
+                        self.client.chat.completions.create,
+                        model=model,
+                        modalities=["text", "audio"],
+                        audio=audio_config,
+                        messages=messages,
+                    )
+                # any well-formed answer means upstream is healthy, even without audio
+                self.breaker.record(bool(response and response.choices), time.perf_counter() - started)
+                self._record_usage(model, response, started, session_id, system_prompt, audio_config)
 
                 if not response or not response.choices:
                     raise ValueError("Invalid response or no choices")
@@ -94,33 +195,195 @@ class GPT4oAudioClient:
                 print("GPT response message:", last_message)
 
                 # Check if audio was returned
+                self._count("responses")
                 if hasattr(last_message, "audio") and last_message.audio and getattr(last_message.audio, "data", None):
+                    self._record_route(model, started, ok=True)
                     if f_out_wav:
-                        wav_bytes = base64.b64decode(last_message.audio.data)
-                        with open(f_out_wav, "wb") as f:
-                            f.write(wav_bytes)
+                        write_base64_async(f_out_wav, last_message.audio.data)
                     return last_message.audio
 
+                self._count("missing_audio")
+                self._record_route(model, started, ok=False)
+                # the text is fine: voice it rather than regenerate a shorter answer
+                if cancel is not None:
+                    cancel.raise_if_cancelled()
+                salvaged = self._salvage_audio(last_message, audio_config, session_id, system_prompt)
+                if salvaged is not None:
+                    if f_out_wav:
+                        write_base64_async(f_out_wav, salvaged.data)
+                    return salvaged
+
                 print("⚠️ No audio in response. Retrying...")
                 attempt += 1
 
+            except TurnCancelled:
+                # nobody is waiting for the reply any more; not an upstream failure
+                print("🚫 Turn cancelled, dropping the upstream call.")
+                self._record_route(model, started, ok=False)
+                self.breaker.release()
+                raise
             except (AttributeError, ValueError) as e:
                 print(f"{type(e).__name__} caught:", e)
+                self._record_route(model, started, ok=False)
                 attempt += 1
             except Exception as e:
                 print("Unexpected error:", e)
+                self.breaker.record(False, time.perf_counter() - started)
+                self._record_route(model, started, ok=False)
+                self._record_usage(model, None, started, session_id, system_prompt, audio_config, ok=False)
+                # upstream errors are worth retrying only on a different model
+                if len(candidates) > 1 and attempt + 1 < len(candidates):
+                    attempt += 1
+                    continue
                 break
 
         print("❌ Failed to get audio response after max retries.")
-        return dict()
+        return self._degraded_response(user_query, audio_config)
 
+    def _count(self, name, value=1):
+        with self._salvage_lock:
+            self._salvage[name] += value
+
+    def _salvage_audio(self, message, audio_config, session_id, system_prompt):
+        """
+        Synthesize audio for a reply that has text but no audio data.
+        :return: audio-like object (transcript, data), or None when there is
+            nothing to salvage or TTS failed
+        """
+        audio = getattr(message, "audio", None)
+        text = (getattr(audio, "transcript", None) or getattr(message, "content", None) or "").strip()
+        if self.speech is None or not text:
+            return None
+        fmt = audio_config.get("format", "mp3")
+        voice = audio_config.get("voice", "shimmer")
+        started = time.perf_counter()
+        try:
+            data = self.speech.synthesize_all(text, voice, TTS_FORMAT_NAMES.get(fmt, fmt))
+        except Exception as e:
+            print("Audio salvage failed:", e)
+            self._count("salvage_failed")
+            return None
+        data_base64 = base64.b64encode(data).decode("ascii")
+        self._count("salvaged")
+        self._count("salvage_latency_s", time.perf_counter() - started)
+        print(f"🩹 Salvaged reply audio with TTS in {time.perf_counter() - started:.2f}s")
+        if self.usage is not None:
+            self.usage.record(self.speech.tts_model, session_id=session_id,
+                              system_prompt=system_prompt or self.system_prompt, voice=voice,
+                              output_audio_s=audio_seconds(data_base64, fmt),
+                              latency_s=time.perf_counter() - started)
+        return SimpleNamespace(id=None, transcript=text, data=data_base64, expires_at=None, salvaged=True)
+
+    def salvage_stats(self):
+        with self._salvage_lock:
+            stats = dict(self._salvage)
+        stats["missing_audio_rate"] = round(stats["missing_audio"] / stats["responses"], 4) if stats["responses"] else 0.0
+        stats["salvage_rate"] = round(stats["salvaged"] / stats["missing_audio"], 4) if stats["missing_audio"] else 0.0
+        stats["salvage_latency_avg_s"] = round(stats.pop("salvage_latency_s") / stats["salvaged"], 3) \
+            if stats["salvaged"] else None
+        return stats
+
+    def _degraded_response(self, user_query, audio_config):
+        if self.fallback is None:
+            return dict()
+        return self.fallback.respond(user_query, voice=audio_config.get("voice", "shimmer"),
+                                     fmt=audio_config.get("format", "mp3"))
+
+
+    def chat_completion_text_cancellable(self, user_query, cancel, convo_history: List = [], system_prompt=None,
+                                         session_id=None, risk_tier="low"):
+        """
+        Generate only the reply text, so speech can be synthesized sentence by
+        sentence (see speech_pipeline.SentenceSpeechPipeline). The reply is streamed
+        so it can be abandoned mid-reply: once `cancel` (a threading.Event or
+        CancelToken) is set, the stream is closed and GenerationCancelled is raised
+        with the tokens spent so far. Raises CircuitOpenError when upstream is known to be down.
+        :return: (reply text, total tokens)
+        """
+        messages = self._create_message_with_convo_history(
+            user_query, data_type="text", convo_history=convo_history, system_prompt=system_prompt,
+            session_id=session_id
+        )
+        if not self.breaker.allow():
+            raise CircuitOpenError("Upstream circuit open")
+        # estimate for when the stream is cut before it reports usage
+        prompt_tokens = sum(len(str(msg.get("content", ""))) for msg in messages) // 3
+        parts, usage, stream = [], None, None
+        started = time.perf_counter()
+        try:
+            with self._upstream_slot(risk_tier, cancel):
+                if cancel.is_set():
+                    raise GenerationCancelled(0)
+                started = time.perf_counter()
+                stream = self.client.chat.completions.create(
+                    model=self.text_model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                try:
+                    for chunk in stream:
+                        if cancel.is_set():
+                            raise GenerationCancelled(prompt_tokens + len(parts))
+                        if chunk.choices:
+                            parts.append(chunk.choices[0].delta.content or "")
+                        if getattr(chunk, "usage", None) is not None:
+                            usage = chunk.usage
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close is not None:
+                        close()
+        except TurnCancelled:
+            # cancelled while waiting for a slot
+            self.breaker.release()
+            raise GenerationCancelled(0)
+        except GenerationCancelled as e:
+            if stream is None:
+                # never reached upstream
+                self.breaker.release()
+                raise
+            # abandoned on purpose; upstream was fine
+            self.breaker.record(True, time.perf_counter() - started)
+            if self.usage is not None and e.tokens:
+                self.usage.record(self.text_model, session_id=session_id,
+                                  system_prompt=system_prompt or self.system_prompt,
+                                  latency_s=time.perf_counter() - started,
+                                  extra={"text_in_tokens": prompt_tokens, "text_out_tokens": len(parts)})
+            raise
+        except Exception:
+            self.breaker.record(False, time.perf_counter() - started)
+            self._record_usage(self.text_model, None, started, session_id, system_prompt, ok=False)
+            raise
+        self.breaker.record(True, time.perf_counter() - started)
+        self._record_usage(self.text_model, SimpleNamespace(usage=usage), started, session_id, system_prompt)
+        tokens = getattr(usage, "total_tokens", 0) or prompt_tokens + len(parts)
+        return "".join(parts).strip(), tokens
+
+    def _upstream_slot(self, risk_tier, cancel=None):
+        if self.scheduler is None:
+            return nullcontext()
+        # a plain threading.Event (speculation) is only checked once admitted
+        return self.scheduler.slot(risk_tier, cancel=cancel if isinstance(cancel, CancelToken) else None)
+
+    def _record_usage(self, model, response, started, session_id, system_prompt, audio_config=None, ok=True):
+        if self.usage is None:
+            return
+        output_audio_s = 0.0
+        if audio_config and response is not None and response.choices:
+            audio = getattr(response.choices[0].message, "audio", None)
+            output_audio_s = audio_seconds(getattr(audio, "data", None), audio_config.get("format", "mp3"))
+        self.usage.record(model, getattr(response, "usage", None), session_id=session_id,
+                          system_prompt=system_prompt or self.system_prompt,
+                          voice=audio_config.get("voice") if audio_config else None,
+                          output_audio_s=output_audio_s, latency_s=time.perf_counter() - started, ok=ok)
+
+    def _record_route(self, model, started, ok):
+        if self.router is not None:
+            self.router.record(model, time.perf_counter() - started, ok)
 
     def chat_completion_audio_input(self, url, f_out_wav=None):
-        # Fetch the audio file and convert it to a base64 encoded string
-        response = requests.get(url)
-        response.raise_for_status()
-        wav_data = response.content
-        encoded_string = base64.b64encode(wav_data).decode('utf-8')
+        # Stream the audio file into a base64 string (size-capped, cached on disk when configured)
+        encoded_string = self.audio_fetcher.fetch_base64(url)
 
         response = self.client.chat.completions.create(
             model=self.model,
@@ -151,14 +414,15 @@ class GPT4oAudioClient:
 
         # save wav output
         if f_out_wav:
-            wav_bytes = base64.b64decode(response.choices[0].message.audio.data)
-            with open(f_out_wav, "wb") as f:
-                f.write(wav_bytes)
+            write_base64_async(f_out_wav, response.choices[0].message.audio.data)
 
         return response.choices[0].message.audio
 
-    def chat_and_speak(self, user_text: str) -> tuple[str, str]:
-        response = self.chat_completion_text_input(user_text)
+    def chat_and_speak(self, user_text: str, convo_history: List = [], risk_tier="low",
+                       output_audio_config=None, system_prompt=None, session_id=None) -> tuple[str, str]:
+        response = self.chat_completion_text_input(user_text, convo_history=convo_history, risk_tier=risk_tier,
+                                                   output_audio_config=output_audio_config,
+                                                   system_prompt=system_prompt, session_id=session_id)
         transcript = response.transcript if hasattr(response, "transcript") else ""
         audio_data = response.data if hasattr(response, "data") else ""
         return transcript, audio_data
@@ -175,6 +439,8 @@ def test_text_input():
     f_out_wav = "out_wav_text_input.wav"
 
 
+    from dotenv import load_dotenv
+
     load_dotenv()
     OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
     if OPENAI_API_KEY is None:
@@ -198,6 +464,8 @@ def test_audio_input():
     f_out_wav = "out_wav_audio_input.wav"
 
 
+    from dotenv import load_dotenv
+
     load_dotenv()
     OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
     if OPENAI_API_KEY is None:
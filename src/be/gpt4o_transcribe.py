@@ -1,12 +1,44 @@
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+
+def fingerprint_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
 
-from openai import OpenAI
 
 class GPT4oTranscribeClient:
-    def __init__(self, api_key, model="gpt-4o-transcribe"):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, api_key, model="gpt-4o-transcribe", cache_size=256, openai_client=None):
+        """
+        :param cache_size: transcripts kept per client, keyed by audio content hash
+        :param openai_client: prebuilt client to use instead (e.g. stub_upstream.StubOpenAI)
+        """
+        if openai_client is None:
+            from openai import OpenAI
+
+            openai_client = OpenAI(api_key=api_key)
+        self.client = openai_client
         self.model = model
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def transcribe(self, audio_file_obj, fingerprint=None):
+        """
+        :param fingerprint: content hash of the clip if already known; otherwise
+            the file contents are hashed. The same clip is only sent upstream once.
+        """
+        if fingerprint is None:
+            position = audio_file_obj.tell()
+            fingerprint = fingerprint_bytes(audio_file_obj.read())
+            audio_file_obj.seek(position)
+        with self._lock:
+            if fingerprint in self._cache:
+                self._cache.move_to_end(fingerprint)
+                return self._cache[fingerprint]
 
-    def transcribe(self, audio_file_obj):
         transcription = self.client.audio.transcriptions.create(
             model=self.model,
             file=audio_file_obj,
@@ -14,5 +46,14 @@ class GPT4oTranscribeClient:
         )
         print(type(transcription))
         print(transcription)
+        with self._lock:
+            self._cache[fingerprint] = transcription
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
         return transcription
 
+    def transcribe_base64(self, audio_base64, audio_format="wav"):
+        audio_bytes = base64.b64decode(audio_base64)
+        audio_file_obj = BytesIO(audio_bytes)
+        audio_file_obj.name = f"input_audio.{audio_format}"
+        return self.transcribe(audio_file_obj, fingerprint=fingerprint_bytes(audio_bytes))
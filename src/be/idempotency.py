@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+def derive_key(scope: str, idempotency_key: Optional[str] = None, session_id: Optional[str] = None,
+               turn: Optional[int] = None) -> Optional[str]:
+    """
+    Key identifying one conversational turn.
+
+    An explicit Idempotency-Key header wins; otherwise the session id plus the
+    client's turn number. Requests without either are never deduplicated: the
+    same text sent twice in a session is two turns (a user can say "yes" again).
+    """
+    if idempotency_key:
+        return f"{scope}:{session_id or ''}:key:{idempotency_key}"
+    if session_id and turn is not None:
+        return f"{scope}:{session_id}:turn:{turn}"
+    return None
+
+
+class _EventLog:
+    """
+    Events of one streamed turn, produced by a single background thread and
+    replayed to every client that asked for the same turn.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.cond = threading.Condition()
+
+    def produce(self, make_events) -> bool:
+        try:
+            for event in make_events():
+                with self.cond:
+                    self.events.append(event)
+                    self.cond.notify_all()
+            return True
+        except Exception as e:
+            print("Coalesced stream failed:", e)
+            return False
+        finally:
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+
+    def follow(self):
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.events) and not self.done:
+                    self.cond.wait()
+                pending = self.events[index:]
+                finished = self.done
+            for event in pending:
+                yield event
+            index += len(pending)
+            if finished and index >= len(self.events):
+                return
+
+
+class IdempotencyCache:
+    """
+    Per-process coalescing of duplicate turns.
+
+    While a turn is in flight, duplicates wait on the same upstream call;
+    once it completes, its result is replayed for `ttl_s` seconds. Failures
+    (including HTTP errors such as 429) are not cached, so a retry after an
+    error runs again.
+    """
+
+    def __init__(self, ttl_s: float = 30.0, max_entries: int = 2048):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._done: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, result)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._streams: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, _EventLog), by completion
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    def _cached(self, key):
+        entry = self._done.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._done[key]
+            return None
+        return entry
+
+    def _store(self, key, result):
+        self._done[key] = (time.monotonic() + self.ttl_s, result)
+        self._done.move_to_end(key)
+        while len(self._done) > self.max_entries:
+            self._done.popitem(last=False)
+
+    async def run(self, key: Optional[str], fn):
+        """
+        :param fn: zero-argument coroutine function producing the response
+        """
+        if key is None:
+            return await fn()
+        entry = self._cached(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[1]
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fn()
+        except BaseException as e:
+            future.set_exception(e)
+            # waiters re-raise it; mark retrieved so an unobserved failure isn't logged
+            future.exception()
+            raise
+        else:
+            self._store(key, result)
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def is_known(self, key: Optional[str]) -> bool:
+        """
+        True when the turn is in flight or cached, i.e. a new request for it
+        won't reach upstream.
+        """
+        if key is None:
+            return False
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is not None and (not stream[1].done or stream[0] >= time.monotonic()):
+                return True
+        return key in self._inflight or self._cached(key) is not None
+
+    def stream(self, key: Optional[str], make_events):
+        """
+        Iterator over the events of `make_events()`, shared by all duplicates of
+        the turn. The generator runs in its own thread, so a client that
+        disconnects doesn't cut the turn short for the others.
+        """
+        if key is None:
+            return make_events()
+        now = time.monotonic()
+        with self._lock:
+            for stale in [k for k, (expires_at, log) in self._streams.items() if log.done and expires_at < now]:
+                del self._streams[stale]
+            entry = self._streams.get(key)
+            if entry is not None:
+                if entry[1].done:
+                    self.hits += 1
+                else:
+                    self.coalesced += 1
+                return entry[1].follow()
+            if make_events is None:
+                # expired between is_known() and here
+                return iter(())
+            self.misses += 1
+            log = _EventLog()
+            self._streams[key] = (now + self.ttl_s, log)
+        threading.Thread(target=self._produce, args=(key, log, make_events),
+                         name="idempotent-stream", daemon=True).start()
+        return log.follow()
+
+    def _produce(self, key, log, make_events):
+        ok = log.produce(make_events)
+        with self._lock:
+            if not ok:
+                # a cut-short stream is not a result; let a retry run again
+                self._streams.pop(key, None)
+            elif key in self._streams:
+                # the TTL starts when the turn completes
+                self._streams[key] = (time.monotonic() + self.ttl_s, log)
+                self._streams.move_to_end(key)
+                # finished logs hold whole replies (audio included); keep at most max_entries
+                finished = [k for k, (_, done_log) in self._streams.items() if done_log.done]
+                for stale in finished[:max(0, len(finished) - self.max_entries)]:
+                    del self._streams[stale]
+
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "cached": len(self._done) + len(self._streams),
+            "in_flight": len(self._inflight),
+        }
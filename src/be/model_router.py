@@ -0,0 +1,142 @@
+import re
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+DEFAULT_MODEL_TIERS = ["gpt-4o-mini-audio-preview", "gpt-4o-audio-preview"]
+
+_QUESTION = re.compile(r"[?？]|왜|어떻게|무엇|뭘|how|why|what", re.IGNORECASE)
+
+
+@dataclass
+class RoutingDecision:
+    model: str
+    candidates: List[str]  # model first, then fallbacks in order
+    complexity: float
+    reason: str
+
+
+@dataclass
+class _ModelStats:
+    latencies: deque = field(default_factory=lambda: deque(maxlen=100))  # (monotonic time, latency)
+    calls: int = 0
+    errors: int = 0
+    consecutive_errors: int = 0
+    cooldown_until: float = 0.0
+
+    def expire(self, before: float):
+        while self.latencies and self.latencies[0][0] < before:
+            self.latencies.popleft()
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(latency for _, latency in self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ModelRouter:
+    """
+    Picks an audio model per turn.
+
+    Tiers are ordered cheapest -> most capable. A turn goes to the cheapest
+    tier whose complexity ceiling covers it, high-risk turns always go to the
+    top tier, and any tier whose recent p95 latency is over target or that is
+    cooling down after repeated errors is skipped (but kept as a last-resort
+    fallback). Latency samples older than `window_s` are forgotten, so a
+    skipped tier gets traffic again once its slow samples have aged out.
+    """
+
+    def __init__(self, tiers: List[str] = None, complexity_ceilings: List[float] = None,
+                 p95_target_s: float = 6.0, error_threshold: int = 3, cooldown_s: float = 30.0,
+                 window_s: float = 120.0):
+        self.tiers = list(tiers or DEFAULT_MODEL_TIERS)
+        # the top tier always accepts everything
+        ceilings = list(complexity_ceilings or [0.35 * (i + 1) for i in range(len(self.tiers) - 1)])
+        self.complexity_ceilings = ceilings[:len(self.tiers) - 1] + [1.0]
+        self.p95_target_s = p95_target_s
+        self.error_threshold = error_threshold
+        self.cooldown_s = cooldown_s
+        self.window_s = window_s
+        self._stats: Dict[str, _ModelStats] = {model: _ModelStats() for model in self.tiers}
+        self._decisions = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def estimate_complexity(user_text: str, prompt_chars: int = 0) -> float:
+        """
+        0..1 heuristic: short acknowledgements score low, long questions with
+        a lot of context score high.
+        """
+        text = user_text or ""
+        score = min(len(text) / 200, 0.5)
+        score += 0.15 * min(len(_QUESTION.findall(text)), 2)
+        score += min(prompt_chars / 20000, 0.2)
+        return round(min(score, 1.0), 3)
+
+    def _healthy(self, model: str, now: float) -> bool:
+        stats = self._stats[model]
+        if stats.cooldown_until > now:
+            return False
+        stats.expire(now - self.window_s)
+        p95 = stats.percentile(0.95)
+        return p95 is None or len(stats.latencies) < 5 or p95 <= self.p95_target_s
+
+    def route(self, user_text: str, prompt_chars: int = 0, risk_tier: str = "low") -> RoutingDecision:
+        complexity = self.estimate_complexity(user_text, prompt_chars)
+        if risk_tier == "high":
+            preferred, reason = len(self.tiers) - 1, "risk"
+        else:
+            preferred = next(i for i, ceiling in enumerate(self.complexity_ceilings) if complexity <= ceiling)
+            reason = "complexity"
+
+        # preferred tier, then the more capable ones, then the cheaper ones
+        order = [self.tiers[i] for i in range(preferred, len(self.tiers))]
+        order += [self.tiers[i] for i in range(preferred - 1, -1, -1)]
+
+        with self._lock:
+            now = time.monotonic()
+            healthy = [m for m in order if self._healthy(m, now)]
+            candidates = healthy + [m for m in order if m not in healthy]
+            if candidates[0] != order[0]:
+                reason = "fallback"
+            self._decisions[(candidates[0], reason)] += 1
+        return RoutingDecision(model=candidates[0], candidates=candidates, complexity=complexity, reason=reason)
+
+    def record(self, model: str, latency_s: float, ok: bool):
+        with self._lock:
+            stats = self._stats.setdefault(model, _ModelStats())
+            stats.calls += 1
+            stats.latencies.append((time.monotonic(), latency_s))
+            if ok:
+                stats.consecutive_errors = 0
+            else:
+                stats.errors += 1
+                stats.consecutive_errors += 1
+                if stats.consecutive_errors >= self.error_threshold:
+                    stats.cooldown_until = time.monotonic() + self.cooldown_s
+                    stats.consecutive_errors = 0
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "p95_target_s": self.p95_target_s,
+                "window_s": self.window_s,
+                "models": {
+                    model: {
+                        "calls": stats.calls,
+                        "errors": stats.errors,
+                        "healthy": self._healthy(model, now),
+                        "p50_s": stats.percentile(0.5),
+                        "p95_s": stats.percentile(0.95),
+                    }
+                    for model, stats in self._stats.items()
+                },
+                "decisions": [
+                    {"model": model, "reason": reason, "count": count}
+                    for (model, reason), count in sorted(self._decisions.items())
+                ],
+            }
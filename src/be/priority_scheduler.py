@@ -0,0 +1,229 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+from cancellation import TurnCancelled
+from crisis_triage import RISK_HIGH, RISK_LOW, RISK_MEDIUM
+
+DEFAULT_WEIGHTS = {RISK_HIGH: 8.0, RISK_MEDIUM: 3.0, RISK_LOW: 1.0}
+
+# set while a slot admitted with slot_async() is held; nested slot() calls of the
+# same turn (run_in_threadpool copies the context) run in it instead of queueing again
+_holding = contextvars.ContextVar("upstream_slot_held", default=False)
+
+
+class _Waiter:
+    __slots__ = ("tier", "enqueued_at", "event", "loop", "future", "admitted")
+
+    def __init__(self, tier, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.tier = tier
+        self.enqueued_at = time.monotonic()
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+        self.admitted = False
+
+    def wake(self):
+        """
+        Thread-safe: admitted or cancelled.
+        """
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class PriorityScheduler:
+    """
+    Admission control for upstream calls: at most `max_concurrency` run at
+    once, and waiting calls are admitted by weighted-fair (stride) scheduling
+    over per-risk-tier FIFO queues. With the default weights a high-risk turn
+    gets 8 slots for every low-risk one under contention, and an idle tier
+    can't bank credit while it has nothing queued.
+
+    Starvation protection: a waiter older than `max_wait_s` is admitted next
+    regardless of tier (oldest first).
+
+    Request handlers wait with slot_async() on the event loop, before handing
+    the call to the thread pool: a blocking wait there would tie up a pool
+    thread per queued call, and once the pool is full of queued low-risk
+    turns a high-risk one could not even get in line.
+    """
+
+    def __init__(self, max_concurrency: int = 16, weights: Dict[str, float] = None, max_wait_s: float = 10.0,
+                 window: int = 512):
+        self.max_concurrency = max_concurrency
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.max_wait_s = max_wait_s
+        self._queues = {tier: deque() for tier in self.weights}
+        self._pass = {tier: 0.0 for tier in self.weights}
+        self._virtual_time = 0.0
+        self._running = 0
+        self._lock = threading.Lock()
+        self._waits = {tier: deque(maxlen=window) for tier in self.weights}
+        self._counters = {tier: {"admitted": 0, "queued": 0, "promoted": 0, "timed_out": 0, "cancelled": 0}
+                          for tier in self.weights}
+
+    def _tier(self, tier):
+        return tier if tier in self.weights else RISK_LOW
+
+    def _pick_locked(self) -> Optional[_Waiter]:
+        heads = [queue[0] for queue in self._queues.values() if queue]
+        if not heads:
+            return None
+        oldest = min(heads, key=lambda waiter: waiter.enqueued_at)
+        if time.monotonic() - oldest.enqueued_at >= self.max_wait_s:
+            self._counters[oldest.tier]["promoted"] += 1
+            tier = oldest.tier
+        else:
+            tier = min((waiter.tier for waiter in heads), key=lambda t: (self._pass[t], -self.weights[t]))
+        self._virtual_time = self._pass[tier]
+        self._pass[tier] += 1.0 / self.weights[tier]
+        return self._queues[tier].popleft()
+
+    def _admit_locked(self, waiter: _Waiter):
+        self._running += 1
+        self._counters[waiter.tier]["admitted"] += 1
+        self._waits[waiter.tier].append(time.monotonic() - waiter.enqueued_at)
+        waiter.admitted = True
+        waiter.wake()
+
+    def _enqueue(self, waiter: _Waiter) -> bool:
+        """
+        :return: True if admitted right away
+        """
+        with self._lock:
+            if self._running < self.max_concurrency and not any(self._queues.values()):
+                self._admit_locked(waiter)
+                return True
+            queue = self._queues[waiter.tier]
+            if not queue:
+                # a tier returning from idle starts at the current virtual time
+                self._pass[waiter.tier] = max(self._pass[waiter.tier], self._virtual_time)
+            queue.append(waiter)
+            self._counters[waiter.tier]["queued"] += 1
+        return False
+
+    def _leave(self, waiter: _Waiter, cancel, timeout):
+        """
+        After the wait ended: return if admitted, else leave the queue and raise.
+        """
+        with self._lock:
+            if waiter.admitted:
+                return
+            self._queues[waiter.tier].remove(waiter)
+            cancelled = cancel is not None and cancel.cancelled
+            self._counters[waiter.tier]["cancelled" if cancelled else "timed_out"] += 1
+        if cancelled:
+            raise TurnCancelled(cancel.reason)
+        raise TimeoutError(f"No upstream slot within {timeout}s ({waiter.tier} priority)")
+
+    def acquire(self, tier: str = RISK_LOW, timeout: Optional[float] = None, cancel=None):
+        """
+        :param cancel: optional cancellation.CancelToken; a cancelled turn leaves
+            the queue and raises TurnCancelled
+        """
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        waiter = _Waiter(self._tier(tier))
+        if self._enqueue(waiter):
+            return
+        if cancel is not None:
+            cancel.on_cancel(waiter.wake)
+        waiter.event.wait(timeout)
+        self._leave(waiter, cancel, timeout)
+
+    async def acquire_async(self, tier: str = RISK_LOW, timeout: Optional[float] = None, cancel=None):
+        """
+        acquire() for the event loop: waits without holding a thread.
+        """
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        waiter = _Waiter(self._tier(tier), asyncio.get_running_loop())
+        if self._enqueue(waiter):
+            return
+        if cancel is not None:
+            cancel.on_cancel(waiter.wake)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # the request task itself was cancelled: hand back a slot granted meanwhile
+            try:
+                self._leave(waiter, cancel, timeout)
+            except (TurnCancelled, TimeoutError):
+                pass
+            else:
+                self.release()
+            raise
+        self._leave(waiter, cancel, timeout)
+
+    def release(self):
+        with self._lock:
+            self._running -= 1
+            while self._running < self.max_concurrency:
+                waiter = self._pick_locked()
+                if waiter is None:
+                    break
+                self._admit_locked(waiter)
+
+    def _release_after(self, cancel):
+        """
+        Release a slot, but only once the turn's abandoned upstream calls have
+        returned: they keep running upstream, and releasing early would let
+        more than max_concurrency calls be in flight.
+        """
+        if cancel is None:
+            self.release()
+        else:
+            cancel.after_calls(self.release)
+
+    @contextmanager
+    def slot(self, tier: str = RISK_LOW, timeout: Optional[float] = None, cancel=None):
+        if _holding.get():
+            # part of a turn that already holds a slot
+            yield
+            return
+        self.acquire(tier, timeout, cancel)
+        try:
+            yield
+        finally:
+            self._release_after(cancel)
+
+    @asynccontextmanager
+    async def slot_async(self, tier: str = RISK_LOW, timeout: Optional[float] = None, cancel=None):
+        """
+        Hold a slot for the block, e.g. around run_in_threadpool(upstream call);
+        slot() calls made inside it (in that context) don't take another.
+        """
+        await self.acquire_async(tier, timeout, cancel)
+        held = _holding.set(True)
+        try:
+            yield
+        finally:
+            _holding.reset(held)
+            self._release_after(cancel)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            tiers = {}
+            for tier, waits in self._waits.items():
+                ordered = sorted(waits)
+                tiers[tier] = dict(
+                    self._counters[tier],
+                    weight=self.weights[tier],
+                    waiting=len(self._queues[tier]),
+                    wait_p50_s=round(ordered[len(ordered) // 2], 4) if ordered else None,
+                    wait_p95_s=round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 4) if ordered else None,
+                    wait_max_s=round(ordered[-1], 4) if ordered else None,
+                )
+            return {"running": self._running, "max_concurrency": self.max_concurrency, "tiers": tiers}
@@ -0,0 +1,212 @@
+"""
+Opt-in sampling profiler.
+
+A Sampler thread snapshots every thread's stack with sys._current_frames()
+at a fixed interval and counts identical stacks; threads parked in a wait
+(idle pool workers, the event loop in select()) are only counted as idle. Output is the folded
+format ("root;caller;callee count" per line) read by flamegraph.pl and
+speedscope:
+
+    flamegraph.pl profile.folded > profile.svg
+
+Nothing here runs unless a Sampler is started; the server only installs
+ProfilingMiddleware and the periodic profiler when PROFILING=1.
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Dict, Optional
+
+
+# (file, function) of leaf frames where a thread sits parked: pool workers
+# waiting for work, the event loop in select(), sleeping background loops
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES
+
+
+class Sampler:
+    """
+    :param include_idle: also count threads parked in a wait (see _IDLE_LEAVES);
+        off by default, since idle pool and background threads otherwise
+        dominate the top frames. Skipped samples are counted in `idle`.
+    """
+
+    def __init__(self, interval_s: float = 0.005, max_depth: int = 128, include_idle: bool = False):
+        self.interval_s = interval_s
+        self.max_depth = max_depth
+        self.include_idle = include_idle
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self.started_at = None
+        self.duration_s = 0.0
+
+    def _sample(self, own_ident):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            if not self.include_idle and _is_idle(frame):
+                self.idle += 1
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            self._sample(own_ident)
+
+    def start(self) -> "Sampler":
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "Sampler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration_s = time.perf_counter() - self.started_at
+        return self
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 15) -> Dict:
+        """
+        Leaf frames by sample share, a quick answer to "where did the time go".
+        """
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        busy = sum(leaves.values())
+        return {
+            "samples": self.samples,
+            "duration_s": round(self.duration_s, 3),
+            "idle_share": round(self.idle / (busy + self.idle), 4) if busy + self.idle else None,
+            "top_frames": [{"frame": frame, "share": round(count / total, 4)} for frame, count in leaves.most_common(top)],
+        }
+
+
+def profile_for(seconds: float, interval_s: float = 0.005) -> Sampler:
+    sampler = Sampler(interval_s).start()
+    time.sleep(seconds)
+    return sampler.stop()
+
+
+class ProfileStore:
+    """
+    Last `max_profiles` finished profiles, by id.
+    """
+
+    def __init__(self, max_profiles: int = 32):
+        self.max_profiles = max_profiles
+        self._profiles: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, sampler: Sampler, label: str, profile_id: Optional[str] = None) -> str:
+        profile_id = profile_id or uuid.uuid4().hex[:12]
+        with self._lock:
+            self._profiles[profile_id] = {"label": label, "folded": sampler.folded(), **sampler.summary()}
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            return [{"profile_id": pid, "label": p["label"], "samples": p["samples"], "duration_s": p["duration_s"]}
+                    for pid, p in self._profiles.items()]
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware: a request carrying `X-Profile: <admin token>` is
+    sampled from arrival until its response (streamed or not) completes, and
+    the response gets an `X-Profile-Id` header for GET /admin/profiles/{id}.
+
+    Samples cover every busy thread in the process (the event loop and the
+    threadpool running the turn; parked threads are skipped), so profile a
+    request when the worker is otherwise quiet for a clean attribution.
+    """
+
+    def __init__(self, app, store: ProfileStore, token: Optional[str], interval_s: float = 0.002):
+        self.app = app
+        self.store = store
+        self.token = token.encode() if token else None
+        self.interval_s = interval_s
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.token is None or dict(scope["headers"]).get(b"x-profile") != self.token:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:12]
+        sampler = Sampler(self.interval_s).start()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            self.store.add(sampler, f'{scope["method"]} {scope["path"]}', profile_id)
+
+
+class PeriodicProfiler:
+    """
+    Every `every_s` seconds, sample the whole process for `window_s` seconds
+    and write `<out_dir>/profile-<unix time>.folded`.
+    """
+
+    def __init__(self, out_dir: str, every_s: float = 600.0, window_s: float = 10.0, interval_s: float = 0.01):
+        self.out_dir = out_dir
+        self.every_s = every_s
+        self.window_s = window_s
+        self.interval_s = interval_s
+        os.makedirs(out_dir, exist_ok=True)
+        threading.Thread(target=self._run, name="periodic-profiler", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.every_s)
+            sampler = profile_for(self.window_s, self.interval_s)
+            path = os.path.join(self.out_dir, f"profile-{int(time.time())}.folded")
+            try:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(sampler.folded())
+            except OSError as e:
+                print("Periodic profile write failed:", e)
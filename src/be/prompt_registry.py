@@ -0,0 +1,177 @@
+import hashlib
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+@dataclass(frozen=True)
+class PromptVersion:
+    prompt_id: str  # content hash
+    name: str
+    version: int
+    text: str
+    created_at: float
+
+
+def prompt_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class PromptRegistry:
+    """
+    System prompts stored once, addressed by content hash.
+
+    Clients send a `prompt_id` (the hash, or a name for its latest version)
+    instead of the full text. Every request resolves to the same interned
+    string, so the upstream prompt prefix stays byte-identical and cacheable.
+    With a db_path, publishes are shared by all workers through SQLite; a
+    name's latest version is cached for `latest_ttl_s`, so resolving a name
+    usually costs no query and another worker's publish shows up within it.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS prompts (
+        prompt_id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        UNIQUE (name, version)
+    );
+    CREATE TABLE IF NOT EXISTS latest (
+        name TEXT PRIMARY KEY,
+        prompt_id TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    """
+    _COLUMNS = "prompt_id, name, version, text, created_at"
+
+    def __init__(self, db_path: Optional[str] = None, latest_ttl_s: float = 5.0):
+        self.latest_ttl_s = latest_ttl_s
+        self._by_id: Dict[str, PromptVersion] = {}
+        self._latest: Dict[str, str] = {}  # name -> prompt_id
+        self._latest_checked: Dict[str, float] = {}  # name -> when _latest was read from the db
+        self._lock = threading.Lock()
+        self._conn = None
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5.0)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(self.SCHEMA)
+            self._conn.commit()
+            for row in self._conn.execute(f"SELECT {self._COLUMNS} FROM prompts ORDER BY name, version"):
+                prompt = self._remember(PromptVersion(*row))
+                self._latest[prompt.name] = prompt.prompt_id
+            # a republished older version (rollback) outranks the highest version number
+            for name, prompt_id in self._conn.execute("SELECT name, prompt_id FROM latest"):
+                if prompt_id in self._by_id:
+                    self._latest[name] = prompt_id
+            now = time.monotonic()
+            self._latest_checked = {name: now for name in self._latest}
+
+    def _remember(self, prompt: PromptVersion) -> PromptVersion:
+        prompt = PromptVersion(prompt.prompt_id, prompt.name, prompt.version, sys.intern(prompt.text), prompt.created_at)
+        return self._by_id.setdefault(prompt.prompt_id, prompt)
+
+    def _set_latest_locked(self, name: str, prompt_id: str):
+        self._latest[name] = prompt_id
+        self._latest_checked[name] = time.monotonic()
+
+    def publish(self, name: str, text: str) -> PromptVersion:
+        """
+        Publish `text` as the latest version of `name`. Text that was published
+        before is not stored again: its existing version becomes the latest
+        (e.g. rolling back to an earlier prompt).
+        """
+        prompt_id = prompt_hash(text)
+        with self._lock:
+            if self._conn is None:
+                prompt = self._by_id.get(prompt_id)
+                if prompt is None:
+                    version = max((p.version for p in self._by_id.values() if p.name == name), default=0) + 1
+                    prompt = self._remember(PromptVersion(prompt_id, name, version, text, time.time()))
+                self._set_latest_locked(name, prompt_id)
+                return prompt
+
+            # IMMEDIATE: workers publishing at once take turns instead of racing for the same version
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(f"SELECT {self._COLUMNS} FROM prompts WHERE prompt_id = ?",
+                                         (prompt_id,)).fetchone()
+                if row:
+                    prompt = PromptVersion(*row)
+                else:
+                    version = self._conn.execute(
+                        "SELECT COALESCE(MAX(version), 0) FROM prompts WHERE name = ?", (name,)
+                    ).fetchone()[0] + 1
+                    prompt = PromptVersion(prompt_id, name, version, text, time.time())
+                    self._conn.execute(
+                        f"INSERT INTO prompts ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                        (prompt.prompt_id, prompt.name, prompt.version, prompt.text, prompt.created_at),
+                    )
+                self._conn.execute(
+                    "INSERT INTO latest (name, prompt_id, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET prompt_id = excluded.prompt_id, updated_at = excluded.updated_at",
+                    (name, prompt_id, time.time()),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            prompt = self._remember(prompt)
+            self._set_latest_locked(name, prompt_id)
+            return prompt
+
+    def _latest_from_db_locked(self, name: str) -> Optional[PromptVersion]:
+        row = self._conn.execute(
+            f"SELECT {self._COLUMNS} FROM prompts WHERE prompt_id = (SELECT prompt_id FROM latest WHERE name = ?)",
+            (name,),
+        ).fetchone() or self._conn.execute(
+            # published before the latest table existed
+            f"SELECT {self._COLUMNS} FROM prompts WHERE name = ? ORDER BY version DESC LIMIT 1", (name,)
+        ).fetchone()
+        if row is None:
+            return None
+        prompt = self._remember(PromptVersion(*row))
+        self._set_latest_locked(name, prompt.prompt_id)
+        return prompt
+
+    def resolve(self, ref: str) -> Optional[PromptVersion]:
+        """
+        :param ref: a prompt_id, or a prompt name (resolves to its latest version)
+        """
+        with self._lock:
+            prompt = self._by_id.get(ref)
+            if prompt is not None:
+                # ids are content hashes, never reassigned
+                return prompt
+            if self._conn is None:
+                return self._by_id.get(self._latest.get(ref))
+            if time.monotonic() - self._latest_checked.get(ref, float("-inf")) < self.latest_ttl_s:
+                return self._by_id.get(self._latest.get(ref))
+            prompt = self._latest_from_db_locked(ref)
+            if prompt is None:
+                # an id published by another worker since we loaded
+                row = self._conn.execute(f"SELECT {self._COLUMNS} FROM prompts WHERE prompt_id = ?",
+                                         (ref,)).fetchone()
+                prompt = self._remember(PromptVersion(*row)) if row else None
+            return prompt
+
+    def list(self) -> List[PromptVersion]:
+        with self._lock:
+            return sorted(self._by_id.values(), key=lambda p: (p.name, p.version))
+
+    def load_dir(self, directory) -> List[PromptVersion]:
+        """
+        Publish every `<name>.txt` in a directory (the bundled default prompts).
+        Text already published is left as it is, so a restart does not roll back
+        a newer version published through the admin API.
+        """
+        prompts = []
+        for path in sorted(Path(directory).glob("*.txt")):
+            text = path.read_text(encoding="utf-8").rstrip()
+            prompts.append(self.resolve(prompt_hash(text)) or self.publish(path.stem, text))
+        return prompts
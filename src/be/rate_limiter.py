@@ -0,0 +1,190 @@
+import math
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+
+@dataclass
+class Limit:
+    """
+    Token bucket: holds up to `capacity` units and refills at `refill_per_sec`.
+    """
+    name: str
+    capacity: float
+    refill_per_sec: float
+
+
+def _refill(tokens: float, updated_at: float, now: float, limit: Limit) -> float:
+    return min(limit.capacity, tokens + max(0.0, now - updated_at) * limit.refill_per_sec)
+
+
+def _retry_after(tokens: float, cost: float, limit: Limit) -> float:
+    if cost > limit.capacity or limit.refill_per_sec <= 0:
+        return math.inf
+    return (cost - tokens) / limit.refill_per_sec
+
+
+def _full_after(limit: Limit) -> float:
+    """
+    Idle time after which any bucket of `limit` is full again, i.e. no different from a missing one.
+    """
+    return limit.capacity / limit.refill_per_sec if limit.refill_per_sec > 0 else math.inf
+
+
+class InMemoryBucketBackend:
+    """
+    Process-local buckets; use as a stand-in for tests or single-worker runs.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take_many(self, charges: List[Tuple[str, float, Limit]], now: float) -> Tuple[bool, float]:
+        """
+        Atomically charge every (key, cost, limit). Nothing is consumed unless
+        all buckets can pay.
+        :return: (allowed, retry_after_seconds)
+        """
+        with self._lock:
+            levels = []
+            retry_after = 0.0
+            for key, cost, limit in charges:
+                tokens, updated_at = self._buckets.get(key, (limit.capacity, now))
+                tokens = _refill(tokens, updated_at, now, limit)
+                levels.append(tokens)
+                if tokens < cost:
+                    retry_after = max(retry_after, _retry_after(tokens, cost, limit))
+            if retry_after > 0:
+                return False, retry_after
+            for (key, cost, _), tokens in zip(charges, levels):
+                self._buckets[key] = (tokens - cost, now)
+            return True, 0.0
+
+    def prune(self, idle_before: float) -> int:
+        """
+        Drop buckets last charged before `idle_before`.
+        """
+        with self._lock:
+            stale = [key for key, (_, updated_at) in self._buckets.items() if updated_at < idle_before]
+            for key in stale:
+                del self._buckets[key]
+        return len(stale)
+
+
+class SQLiteBucketBackend:
+    """
+    Buckets in a shared SQLite file (WAL) so every worker process on the host
+    enforces the same budget. One indexed row per key, one short IMMEDIATE
+    transaction per check.
+    """
+
+    def __init__(self, db_path: str):
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_buckets_updated ON buckets (updated_at)")
+        self._lock = threading.Lock()
+
+    def take_many(self, charges, now):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                levels = []
+                retry_after = 0.0
+                for key, cost, limit in charges:
+                    row = self._conn.execute(
+                        "SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)
+                    ).fetchone()
+                    tokens = _refill(row[0], row[1], now, limit) if row else limit.capacity
+                    levels.append(tokens)
+                    if tokens < cost:
+                        retry_after = max(retry_after, _retry_after(tokens, cost, limit))
+                if retry_after == 0:
+                    self._conn.executemany(
+                        "INSERT INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                        [(key, tokens - cost, now) for (key, cost, _), tokens in zip(charges, levels)],
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return retry_after == 0, retry_after
+
+    def prune(self, idle_before: float) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM buckets WHERE updated_at < ?", (idle_before,)).rowcount
+
+
+def estimate_tokens(text: str = "", audio_base64_len: int = 0, expected_output_tokens: int = 300) -> int:
+    """
+    Rough upstream token cost of a turn, good enough for budgeting.
+    Text: ~1 token per 3 characters (Korean is denser than English).
+    Audio in: base64 -> bytes, 16 kHz 16-bit wav is ~32 KB/s, ~10 tokens/s.
+    """
+    audio_seconds = (audio_base64_len * 3 / 4) / 32000
+    return int(len(text) / 3 + audio_seconds * 10 + expected_output_tokens)
+
+
+class RateLimiter:
+    """
+    :param prune_interval_s: how often buckets idle long enough to be full again are deleted
+    """
+
+    def __init__(self, backend, request_limit: Limit, token_limit: Limit, prune_interval_s: float = 60.0):
+        self.backend = backend
+        self.request_limit = request_limit
+        self.token_limit = token_limit
+        self.prune_interval_s = prune_interval_s
+        self.idle_s = max(_full_after(request_limit), _full_after(token_limit))
+        self._next_prune = time.time() + prune_interval_s
+        self._prune_lock = threading.Lock()
+
+    def _maybe_prune(self, now: float):
+        if now < self._next_prune or math.isinf(self.idle_s) or not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_prune = now + self.prune_interval_s
+            self.backend.prune(now - self.idle_s)
+        except sqlite3.Error as e:
+            print("Rate limit bucket pruning failed:", e)
+        finally:
+            self._prune_lock.release()
+
+    def check(self, ip: Optional[str], session_id: Optional[str], est_tokens: int) -> Tuple[bool, float]:
+        """
+        Charge one request and `est_tokens` tokens to both the caller's IP and
+        session buckets.
+        :return: (allowed, retry_after_seconds)
+        """
+        charges = []
+        for scope, ident in (("ip", ip), ("session", session_id)):
+            if not ident:
+                continue
+            charges.append((f"req:{scope}:{ident}", 1, self.request_limit))
+            charges.append((f"tok:{scope}:{ident}", est_tokens, self.token_limit))
+        if not charges:
+            return True, 0.0
+        now = time.time()
+        self._maybe_prune(now)
+        return self.backend.take_many(charges, now)
+
+
+def create_rate_limiter(db_path: Optional[str] = None, requests_per_min: float = 20,
+                        tokens_per_min: float = 20000, burst: float = 2.0) -> RateLimiter:
+    """
+    :param db_path: shared SQLite file (RATE_LIMIT_DB_PATH); in-memory when unset
+    :param burst: bucket capacity as a multiple of the per-minute rate
+    """
+    backend = SQLiteBucketBackend(db_path) if db_path else InMemoryBucketBackend()
+    return RateLimiter(
+        backend,
+        request_limit=Limit("requests", requests_per_min * burst, requests_per_min / 60),
+        token_limit=Limit("tokens", tokens_per_min * burst, tokens_per_min / 60),
+    )
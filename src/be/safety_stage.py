@@ -0,0 +1,182 @@
+"""
+Moderation that runs alongside generation instead of in front of it.
+
+A turn's SafetyCheck screens the user's input while the reply is being
+generated, and the reply text while it is being voiced (streamed turns) or
+right after it arrives (audio turns, where text and audio come together).
+The reply is released only once both checks are back; wait() measures how
+long that held it, which is what the safety layer adds to a turn.
+"""
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+_HANGUL = re.compile(r"[가-힣]")
+
+# input categories that call for the scripted crisis reply (crisis_triage.SAFETY_REPLIES)
+CRISIS_CATEGORIES = {"self_harm", "self_harm_intent", "self_harm_instructions"}
+
+WITHHELD_TEXT = {
+    "ko": "그 얘기에는 내가 대답하기 어려워. 대신 지금 네 마음이 어떤지 조금 더 들려줄래?",
+    "en": "That's not something I can answer. Could you tell me a bit more about how you're feeling right now?",
+}
+
+
+def withheld_text(user_text: str = "") -> str:
+    return WITHHELD_TEXT["ko" if _HANGUL.search(user_text or "") else "en"]
+
+
+@dataclass
+class ModerationResult:
+    flagged: bool = False
+    categories: List[str] = field(default_factory=list)
+    latency_s: float = 0.0
+    error: Optional[str] = None
+
+
+class Moderator:
+    """
+    OpenAI moderation endpoint (free of charge); stub_upstream.StubOpenAI
+    answers it locally with a term list, for tests and load runs.
+    """
+
+    def __init__(self, openai_client, model: str = "omni-moderation-latest"):
+        self.client = openai_client
+        self.model = model
+
+    def check(self, text: str) -> ModerationResult:
+        started = time.perf_counter()
+        response = self.client.moderations.create(model=self.model, input=text)
+        result = response.results[0]
+        categories = result.categories
+        hits = categories.model_dump() if hasattr(categories, "model_dump") else vars(categories)
+        return ModerationResult(flagged=bool(result.flagged),
+                                categories=sorted(name for name, hit in hits.items() if hit),
+                                latency_s=time.perf_counter() - started)
+
+
+@dataclass
+class SafetyVerdict:
+    input: ModerationResult
+    output: ModerationResult
+    added_s: float
+    allowed: bool
+
+    @property
+    def crisis(self) -> bool:
+        return bool(CRISIS_CATEGORIES.intersection(self.input.categories))
+
+    def to_dict(self) -> Dict:
+        return {
+            "allowed": self.allowed,
+            "input_flagged": self.input.flagged,
+            "output_flagged": self.output.flagged,
+            "categories": sorted(set(self.input.categories) | set(self.output.categories)),
+            "added_ms": round(self.added_s * 1000, 1),
+        }
+
+
+class SafetyCheck:
+    """
+    One turn: begun with the user's text, given the reply with output(), then wait().
+    """
+
+    def __init__(self, stage: "SafetyStage", user_text: str):
+        self.stage = stage
+        self._input = stage._submit(user_text)
+        self._output = None
+
+    def output(self, reply_text: str):
+        """
+        Start screening the reply; the caller goes on (e.g. synthesizing speech) meanwhile.
+        """
+        self._output = self.stage._submit(reply_text)
+
+    def wait(self) -> SafetyVerdict:
+        """
+        Block until both checks are back, at most `timeout_s` in all. A flagged
+        reply is not allowed; a flagged input only escalates (see SafetyVerdict.crisis).
+        """
+        started = time.perf_counter()
+        deadline = started + self.stage.timeout_s
+        input_result = self.stage._result(self._input, deadline)
+        output_result = (self.stage._result(self._output, deadline) if self._output is not None
+                         else ModerationResult())
+        added_s = time.perf_counter() - started
+        allowed = not output_result.flagged
+        if self.stage.fail_closed and (input_result.error or output_result.error):
+            allowed = False
+        verdict = SafetyVerdict(input_result, output_result, added_s, allowed)
+        self.stage._record(verdict)
+        return verdict
+
+
+class SafetyStage:
+    """
+    :param timeout_s: how long wait() holds a reply; checks not back by then count as errors
+    :param fail_closed: withhold replies whose checks errored (default: release them)
+    """
+
+    def __init__(self, moderator: Moderator, max_workers: int = 8, timeout_s: float = 5.0, fail_closed: bool = False,
+                 window: int = 1000):
+        self.moderator = moderator
+        self.timeout_s = timeout_s
+        self.fail_closed = fail_closed
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="moderation")
+        self._lock = threading.Lock()
+        self._added = deque(maxlen=window)
+        self._serial = deque(maxlen=window)
+        self.counters = {"turns": 0, "input_flagged": 0, "output_flagged": 0, "withheld": 0, "errors": 0}
+
+    def begin(self, user_text: str) -> SafetyCheck:
+        return SafetyCheck(self, user_text)
+
+    def _submit(self, text: str):
+        return self._executor.submit(self._check, text)
+
+    def _check(self, text: str) -> ModerationResult:
+        if not (text or "").strip():
+            return ModerationResult()
+        started = time.perf_counter()
+        try:
+            return self.moderator.check(text)
+        except Exception as e:
+            print("Moderation failed:", e)
+            return ModerationResult(latency_s=time.perf_counter() - started, error=str(e))
+
+    def _result(self, future, deadline: float) -> ModerationResult:
+        """
+        :param deadline: time.perf_counter() value after which the check counts as timed out
+        """
+        try:
+            return future.result(max(0.0, deadline - time.perf_counter()))
+        except FutureTimeout:
+            return ModerationResult(latency_s=self.timeout_s, error="timeout")
+
+    def _record(self, verdict: SafetyVerdict):
+        with self._lock:
+            self.counters["turns"] += 1
+            self.counters["input_flagged"] += verdict.input.flagged
+            self.counters["output_flagged"] += verdict.output.flagged
+            self.counters["withheld"] += not verdict.allowed
+            self.counters["errors"] += bool(verdict.input.error) + bool(verdict.output.error)
+            self._added.append(verdict.added_s)
+            # what screening in front of and behind generation would have cost instead
+            self._serial.append(verdict.input.latency_s + verdict.output.latency_s)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            added, serial = sorted(self._added), list(self._serial)
+            stats = dict(self.counters, model=self.moderator.model, fail_closed=self.fail_closed)
+        stats.update(
+            added_p50_ms=round(added[len(added) // 2] * 1000, 1) if added else None,
+            added_p95_ms=round(added[min(len(added) - 1, int(0.95 * len(added)))] * 1000, 1) if added else None,
+            added_avg_ms=round(sum(added) / len(added) * 1000, 1) if added else None,
+            serial_avg_ms=round(sum(serial) / len(serial) * 1000, 1) if serial else None,
+        )
+        return stats
@@ -0,0 +1,223 @@
+"""
+Per-session semantic memory of past turns.
+
+Each finished turn is embedded on a background thread and appended to a
+float32 matrix for its session; at prompt-build time the current message is
+embedded and the top-k most similar earlier turns are found with one
+matrix-vector product. GPT4oAudioClient includes those turns ahead of the
+recent history window, so early disclosures survive truncation.
+
+With a loader (the session store), a session's index mirrors the store:
+it is backfilled on first touch and caught up after every turn, in the
+background, so turns recorded by other workers are found too. Searches
+never read the store; an index that lags by a turn only misses that turn,
+which the recent window holds anyway.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    """
+    Local embedder: word and character-trigram features hashed into `dim`
+    buckets. Trigrams matter for Korean, where particles attach to words.
+    No network, ~microseconds per turn; weaker than a learned embedding.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _features(self, text: str):
+        for word in _TOKEN.findall(text.lower()):
+            yield "w:" + word
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                yield "c:" + padded[i:i + 3]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                out[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        return out
+
+
+class OpenAIEmbedder:
+    def __init__(self, openai_client, model: str = "text-embedding-3-small", dim: int = 512):
+        self.client = openai_client
+        self.model = model
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        response = self.client.embeddings.create(model=self.model, input=texts, dimensions=self.dim)
+        return np.asarray([item.embedding for item in response.data], dtype=np.float32)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class SessionIndex:
+    """
+    Unit-normalized turn vectors in a preallocated float32 matrix that
+    doubles when full, plus the turn texts they came from.
+    """
+
+    def __init__(self, dim: int, capacity: int = 16):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.turns: List[Tuple[str, str]] = []
+        # created_at of the stored turns indexed; another worker's turn can be
+        # committed after a newer one of ours, so this is a set, not a high-water mark
+        self.stored = set()
+        # held while catching up with the store, so a turn is not indexed twice
+        self.sync_lock = threading.Lock()
+        self.backfilled = False
+
+    def __len__(self):
+        return len(self.turns)
+
+    def add(self, vectors: np.ndarray, turns: List[Tuple[str, str]]):
+        needed = len(self.turns) + len(turns)
+        if needed > len(self.vectors):
+            grown = np.zeros((max(needed, 2 * len(self.vectors)), self.vectors.shape[1]), dtype=np.float32)
+            grown[:len(self.turns)] = self.vectors[:len(self.turns)]
+            self.vectors = grown
+        self.vectors[len(self.turns):needed] = _normalize(vectors)
+        self.turns.extend(turns)
+
+    def search(self, query: np.ndarray, k: int, exclude_last: int = 0, min_score: float = 0.0):
+        """
+        :param exclude_last: skip the newest turns (already sent as recent history)
+        :return: [(turn number, score)] in conversation order
+        """
+        n = len(self.turns) - exclude_last
+        if n <= 0 or k <= 0:
+            return []
+        scores = self.vectors[:n] @ _normalize(query[None, :])[0]
+        if n > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(n)
+        return [(int(i), float(scores[i])) for i in sorted(top) if scores[i] > min_score]
+
+
+class SemanticMemory:
+    """
+    :param loader: optional `(session_id, k) -> [(created_at, user, assistant)]`, the
+        session's k most recent stored turns oldest first; the index is caught up from it
+    :param backfill_turns: stored turns indexed when a session is first touched
+    :param catch_up_turns: stored turns checked after each turn (ours plus any of other workers)
+    """
+
+    def __init__(self, embedder, loader: Optional[Callable] = None, max_sessions: int = 1000,
+                 min_score: float = 0.15, backfill_turns: int = 200, catch_up_turns: int = 8):
+        self.embedder = embedder
+        self.loader = loader
+        self.backfill_turns = backfill_turns
+        self.catch_up_turns = catch_up_turns
+        self.max_sessions = max_sessions
+        self.min_score = min_score
+        self._sessions: "OrderedDict[str, SessionIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        # one worker keeps each session's turns in order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-memory")
+
+    @staticmethod
+    def _turn_text(user: str, assistant: str) -> str:
+        return f"{user}\n{assistant}"
+
+    def _session(self, session_id: str) -> SessionIndex:
+        with self._lock:
+            index = self._sessions.get(session_id)
+            if index is None:
+                index = self._sessions[session_id] = SessionIndex(self.embedder.dim)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(session_id)
+            return index
+
+    def _index(self, index: SessionIndex, turns: List[Tuple[str, str]]):
+        if not turns:
+            return
+        vectors = self.embedder.embed([self._turn_text(user, assistant) for user, assistant in turns])
+        with self._lock:
+            index.add(vectors, turns)
+
+    def _sync(self, session_id: str):
+        """
+        Index the stored turns of the session not indexed yet.
+        """
+        index = self._session(session_id)
+        with index.sync_lock:
+            k = self.catch_up_turns if index.backfilled else self.backfill_turns
+            stored = [turn for turn in self.loader(session_id, k) if turn[0] not in index.stored]
+            index.backfilled = True
+            if not stored:
+                return
+            self._index(index, [(user, assistant) for _, user, assistant in stored])
+            index.stored.update(created_at for created_at, _, _ in stored)
+
+    def add_turn(self, session_id: str, user: str, assistant: str):
+        """
+        Embed and index a finished turn in the background (with a loader: the
+        turn has been stored, so the session is caught up from the store).
+        """
+        if self.loader is not None:
+            self._executor.submit(self._guarded, self._sync, session_id)
+        else:
+            self._executor.submit(self._guarded, self._add, session_id, (user, assistant))
+
+    def _add(self, session_id: str, turn: Tuple[str, str]):
+        index = self._session(session_id)
+        self._index(index, [turn])
+
+    @staticmethod
+    def _guarded(fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            print("Semantic memory indexing failed:", e)
+
+    def search(self, session_id: str, query: str, k: int = 3, exclude_last: int = 0) -> List[Dict]:
+        """
+        Most relevant earlier turns for `query`, oldest first, as
+        {"user", "assistant", "score"} dicts.
+        :param exclude_last: how many of the newest stored turns the prompt already has
+        """
+        with self._lock:
+            index = self._sessions.get(session_id)
+            if index is not None:
+                self._sessions.move_to_end(session_id)
+        if index is None:
+            if self.loader is not None:
+                # first touch in this process (e.g. after a restart): backfill in the background
+                self._executor.submit(self._guarded, self._sync, session_id)
+            return []
+        if len(index) <= exclude_last:
+            return []
+        query_vector = self.embedder.embed([query])[0]
+        with self._lock:
+            hits = index.search(query_vector, k, exclude_last, self.min_score)
+            turns = [index.turns[i] for i, _ in hits]
+        return [{"user": user, "assistant": assistant, "score": round(score, 3)}
+                for (user, assistant), (_, score) in zip(turns, hits)]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "turns": sum(len(index) for index in self._sessions.values()),
+                "bytes": sum(index.vectors.nbytes for index in self._sessions.values()),
+            }
@@ -0,0 +1,260 @@
+import abc
+import json
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, List, Optional, Tuple
+
+
+class SessionStore(abc.ABC):
+    """
+    Append-only conversation log keyed by session id.
+
+    Each turn is one (user, assistant) pair. Readers only ever ask for the
+    most recent K turns plus a rolling summary, so the cost of a turn does
+    not grow with the length of the session.
+    """
+
+    @abc.abstractmethod
+    def append_turn(self, session_id: str, user_text: str, assistant_text: str, meta: Optional[Dict] = None):
+        """
+        Record one finished turn.
+        """
+
+    @abc.abstractmethod
+    def load_recent(self, session_id: str, k: int = 10) -> Tuple[str, List[Dict]]:
+        """
+        :return: (summary, turns) with turns ordered oldest -> newest
+        """
+
+    @abc.abstractmethod
+    def set_summary(self, session_id: str, summary: str):
+        """
+        Replace the rolling summary of the turns before the recent window.
+        """
+
+    @abc.abstractmethod
+    def get_state(self, session_id: str) -> Dict:
+        """
+        Per-session fields set with update_state (e.g. the triage tier).
+        """
+
+    @abc.abstractmethod
+    def update_state(self, session_id: str, **fields):
+        """
+        Merge `fields` into the session state.
+        """
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def convo_history(self, session_id: str, k: int = 10) -> List[Dict]:
+        """
+        Build the `convo_history` list GPT4oAudioClient expects from the
+        stored summary and the last k turns.
+        """
+        summary, turns = self.load_recent(session_id, k)
+        messages = []
+        if summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        for turn in turns:
+            messages += [
+                {"role": "user", "content": turn["user"]},
+                {"role": "assistant", "content": turn["assistant_text"]},
+            ]
+        return messages
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Process-local store. Keeps at most `max_turns` turns per session since
+    callers never read further back than the recent window.
+    """
+
+    def __init__(self, max_turns: int = 200):
+        self.max_turns = max_turns
+        self._turns = defaultdict(lambda: deque(maxlen=self.max_turns))
+        self._summaries = {}
+        self._state = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def append_turn(self, session_id, user_text, assistant_text, meta=None):
+        with self._lock:
+            self._turns[session_id].append({
+                "user": user_text,
+                "assistant_text": assistant_text,
+                "meta": meta or {},
+                "created_at": time.time(),
+            })
+
+    def load_recent(self, session_id, k=10):
+        with self._lock:
+            turns = self._turns.get(session_id)
+            recent = list(turns)[-k:] if turns and k > 0 else []
+            return self._summaries.get(session_id, ""), recent
+
+    def set_summary(self, session_id, summary):
+        with self._lock:
+            self._summaries[session_id] = summary
+
+    def get_state(self, session_id):
+        with self._lock:
+            return dict(self._state.get(session_id, {}))
+
+    def update_state(self, session_id, **fields):
+        with self._lock:
+            self._state[session_id].update(fields)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite store in WAL mode so several uvicorn workers can share one file:
+    readers never block the writer and vice versa.
+
+    Turns are buffered and committed in batches of `batch_size` or every
+    `flush_interval` seconds, whichever comes first; a background thread
+    commits a batch that stops filling, so other workers see every turn
+    within `flush_interval`. A worker always sees its own buffered turns
+    because reads flush first.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS turns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT NOT NULL,
+        user_text TEXT NOT NULL,
+        assistant_text TEXT NOT NULL,
+        meta TEXT,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_turns_session ON turns (session_id, id);
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        summary TEXT NOT NULL DEFAULT '',
+        state TEXT NOT NULL DEFAULT '{}',
+        updated_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 8, flush_interval: float = 0.5):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-flush", daemon=True)
+        self._flusher.start()
+
+    def append_turn(self, session_id, user_text, assistant_text, meta=None):
+        with self._lock:
+            self._pending.append((
+                session_id, user_text, assistant_text,
+                json.dumps(meta, ensure_ascii=False) if meta else None,
+                time.time(),
+            ))
+            if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self._pending:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO turns (session_id, user_text, assistant_text, meta, created_at) VALUES (?, ?, ?, ?, ?)",
+                    self._pending,
+                )
+            self._pending = []
+        self._last_flush = time.monotonic()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print("Session flush failed:", e)
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def load_recent(self, session_id, k=10):
+        with self._lock:
+            if any(row[0] == session_id for row in self._pending):
+                self._flush_locked()
+            rows = self._conn.execute(
+                "SELECT user_text, assistant_text, meta, created_at FROM turns "
+                "WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, max(k, 0)),
+            ).fetchall()
+            summary_row = self._conn.execute(
+                "SELECT summary FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+
+        turns = [{
+            "user": user_text,
+            "assistant_text": assistant_text,
+            "meta": json.loads(meta) if meta else {},
+            "created_at": created_at,
+        } for user_text, assistant_text, meta, created_at in reversed(rows)]
+        return (summary_row[0] if summary_row else ""), turns
+
+    def set_summary(self, session_id, summary):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, summary, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary, updated_at = excluded.updated_at",
+                (session_id, summary, time.time()),
+            )
+
+    def get_state(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def update_state(self, session_id, **fields):
+        # read-modify-write inside one IMMEDIATE transaction so concurrent
+        # workers cannot lose each other's fields
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT state FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                state = json.loads(row[0]) if row else {}
+                state.update(fields)
+                self._conn.execute(
+                    "INSERT INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    (session_id, json.dumps(state, ensure_ascii=False), time.time()),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        self._stop.set()
+        self._flusher.join()
+        self.flush()
+        self._conn.close()
+
+
+def create_session_store(db_path: Optional[str] = None, **kwargs) -> SessionStore:
+    """
+    SQLite store when a path is given (e.g. SESSION_DB_PATH), otherwise in-memory.
+    """
+    if db_path:
+        return SQLiteSessionStore(db_path, **kwargs)
+    return InMemorySessionStore()
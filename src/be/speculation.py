@@ -0,0 +1,228 @@
+"""
+Speculative reply generation on interim transcripts.
+
+While the user is still talking, the client posts a stable interim
+transcript (POST /speculate) and the reply text starts generating. When the
+final transcript arrives, the speculative reply is used if the two
+transcripts are similar enough and no negation was added or dropped between
+them, and the speculation is cancelled otherwise (the turn then generates as
+usual). A newer interim that differs from the pending one cancels and
+replaces it.
+"""
+import difflib
+import itertools
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional
+
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+_TOKEN = re.compile(r"[^\W_]+(?:'[^\W_]+)*", re.UNICODE)
+
+# a dropped or added negator flips the meaning however similar the rest is
+NEGATORS = {"no", "not", "never", "nothing", "nobody", "none", "nor", "neither", "cannot", "cant", "dont",
+            "doesnt", "didnt", "wont", "isnt", "arent", "wasnt", "werent", "안", "못", "아니", "아냐", "말고"}
+_KO_NEGATION = ("않", "없", "못", "아니")
+
+
+def normalize(text: str) -> str:
+    return _NON_WORD.sub(" ", (text or "").lower()).strip()
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN.findall((text or "").lower().replace("\u2019", "'"))
+
+
+def _is_negator(token: str) -> bool:
+    return (token in NEGATORS or token.endswith("n't") or token.replace("'", "") in NEGATORS
+            or any(part in token for part in _KO_NEGATION))
+
+
+def negation_changed(a: str, b: str) -> bool:
+    """
+    True when the token-level diff of `a` and `b` inserts or removes a negator
+    ("not", "don't", "안", "않아", ...), including 안/못 written onto the verb ("해" vs "안해").
+    """
+    a_tokens, b_tokens = _tokens(a), _tokens(b)
+    matcher = difflib.SequenceMatcher(None, a_tokens, b_tokens, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal":
+            continue
+        removed, added = a_tokens[i1:i2], b_tokens[j1:j2]
+        if any(_is_negator(token) for token in removed + added):
+            return True
+        for x, y in itertools.product(removed, added):
+            longer, shorter = (x, y) if len(x) > len(y) else (y, x)
+            if longer.startswith("안") and longer[1:] == shorter:
+                return True
+    return False
+
+
+def similarity(a: str, b: str) -> float:
+    """
+    0..1 character-level similarity of the normalized transcripts
+    (punctuation, case and spacing differences don't count).
+    """
+    a, b = normalize(a), normalize(b)
+    if a == b:
+        return 1.0
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def same_request(a: str, b: str, threshold: float) -> bool:
+    """
+    Whether a reply generated for transcript `a` answers `b`: identical once
+    normalized, or similar enough with no negation added or dropped.
+    """
+    if normalize(a) == normalize(b):
+        return True
+    return similarity(a, b) >= threshold and not negation_changed(a, b)
+
+
+class GenerationCancelled(RuntimeError):
+    def __init__(self, tokens: int = 0):
+        super().__init__(f"generation cancelled after ~{tokens} tokens")
+        self.tokens = tokens
+
+
+class _Speculation:
+    __slots__ = ("id", "text", "cancel", "future", "started_at", "finished_at", "tokens")
+
+    def __init__(self, text: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.text = text
+        self.cancel = threading.Event()
+        self.future = None
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.tokens = 0
+
+
+class SpeculativeGenerator:
+    """
+    :param generate: generate(text, cancel_event, **kwargs) -> (reply, tokens used); raises
+        GenerationCancelled once `cancel_event` is set
+    :param threshold: minimum similarity between speculated and final transcript to use the reply
+        (see same_request)
+    :param ttl_s: unclaimed speculations are cancelled after this long
+    """
+
+    def __init__(self, generate: Callable, threshold: float = 0.85, ttl_s: float = 20.0, max_workers: int = 4,
+                 min_chars: int = 6):
+        self.generate = generate
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.min_chars = min_chars
+        self._pending: Dict[Hashable, _Speculation] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculate")
+        self.counters = {"started": 0, "kept": 0, "superseded": 0, "expired": 0, "hits": 0, "misses": 0,
+                         "failed": 0, "wasted_tokens": 0, "saved_s": 0.0}
+
+    def _run(self, spec: _Speculation, kwargs):
+        try:
+            reply, spec.tokens = self.generate(spec.text, spec.cancel, **kwargs)
+            return reply
+        except GenerationCancelled as e:
+            spec.tokens = e.tokens
+            raise
+        finally:
+            spec.finished_at = time.monotonic()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def _discard_locked(self, spec: _Speculation, reason: str, dropped: List[_Speculation]):
+        """
+        Cancel a speculation and add it to `dropped` for _count_wasted once the lock is released.
+        """
+        spec.cancel.set()
+        self.counters[reason] += 1
+        dropped.append(spec)
+
+    def _count_wasted(self, dropped: List[_Speculation]):
+        """
+        Tokens of dropped speculations count as wasted once they have stopped. Called
+        without the lock: a finished future runs the callback (and _count) right away.
+        """
+        for spec in dropped:
+            spec.future.add_done_callback(lambda _, spec=spec: self._count("wasted_tokens", spec.tokens))
+
+    def _expire_locked(self, now, dropped: List[_Speculation]):
+        for key, spec in list(self._pending.items()):
+            if now - spec.started_at > self.ttl_s:
+                del self._pending[key]
+                self._discard_locked(spec, "expired", dropped)
+
+    def start(self, key: Hashable, text: str, **kwargs) -> Dict:
+        """
+        Speculate on `text` for `key` (e.g. session and prompt); kwargs go to generate.
+        """
+        text = (text or "").strip()
+        if len(normalize(text)) < self.min_chars:
+            return {"status": "skipped"}
+        dropped = []
+        with self._lock:
+            self._expire_locked(time.monotonic(), dropped)
+            current = self._pending.get(key)
+            if current is not None and same_request(current.text, text, self.threshold):
+                self.counters["kept"] += 1
+                result = {"status": "kept", "speculation_id": current.id}
+            else:
+                if current is not None:
+                    self._discard_locked(current, "superseded", dropped)
+                spec = self._pending[key] = _Speculation(text)
+                spec.future = self._executor.submit(self._run, spec, kwargs)
+                self.counters["started"] += 1
+                result = {"status": "started", "speculation_id": spec.id}
+        self._count_wasted(dropped)
+        return result
+
+    def claim(self, key: Hashable, final_text: str, timeout: Optional[float] = 30.0) -> Optional[str]:
+        """
+        The speculative reply for `key` when it was made for (nearly) `final_text`,
+        waiting for it to finish; None when there is none or it doesn't match.
+        """
+        claimed_at = time.monotonic()
+        dropped = []
+        with self._lock:
+            spec = self._pending.pop(key, None)
+            if spec is not None and not same_request(spec.text, final_text, self.threshold):
+                self._discard_locked(spec, "misses", dropped)
+        if spec is None or dropped:
+            self._count_wasted(dropped)
+            return None
+        try:
+            reply = spec.future.result(timeout)
+        except Exception as e:
+            print("Speculative generation failed:", e)
+            spec.cancel.set()
+            self._count("failed")
+            return None
+        # without speculation the turn would have waited the whole generation
+        waited = max(0.0, spec.finished_at - claimed_at)
+        self._count("hits")
+        self._count("saved_s", (spec.finished_at - spec.started_at) - waited)
+        return reply
+
+    def discard(self, key: Hashable):
+        """
+        Cancel the speculation for `key` without using it (e.g. the final turn needs a careful reply).
+        """
+        dropped = []
+        with self._lock:
+            spec = self._pending.pop(key, None)
+            if spec is not None:
+                self._discard_locked(spec, "misses", dropped)
+        self._count_wasted(dropped)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.counters, pending=len(self._pending), threshold=self.threshold)
+        decided = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / decided, 4) if decided else None
+        stats["saved_s_avg"] = round(stats.pop("saved_s") / stats["hits"], 3) if stats["hits"] else None
+        return stats
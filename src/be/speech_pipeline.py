@@ -0,0 +1,90 @@
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Iterator, List, Tuple
+
+# sentence end: western/CJK punctuation followed by whitespace, or a line break
+_SENTENCE_END = re.compile(r"(?<=[.!?。！？…~])\s+|\n+")
+# TTS formats whose segments can be joined byte-wise into one playable clip
+_CONCATENABLE = {"mp3", "aac", "pcm"}
+
+
+def split_sentences(text: str, min_chars: int = 12) -> List[str]:
+    """
+    Split a reply into speakable sentences. Fragments shorter than
+    `min_chars` are merged into the previous sentence so we don't pay a TTS
+    round trip for "응." on its own.
+    """
+    sentences = []
+    for part in _SENTENCE_END.split(text or ""):
+        part = part.strip()
+        if not part:
+            continue
+        if sentences and (len(part) < min_chars or len(sentences[-1]) < min_chars):
+            sentences[-1] = f"{sentences[-1]} {part}"
+        else:
+            sentences.append(part)
+    return sentences
+
+
+class SentenceSpeechPipeline:
+    """
+    Synthesize a reply sentence by sentence with concurrent TTS calls and
+    hand segments back strictly in order, each as soon as it (and every
+    earlier one) is ready. Playback can start after the first sentence
+    instead of after the whole utterance.
+
+    :param scheduler: optional priority_scheduler.PriorityScheduler; each TTS call
+        waits for an upstream slot at the turn's risk tier
+    """
+
+    def __init__(self, openai_client, tts_model="gpt-4o-mini-tts", max_workers=4, instructions=None,
+                 scheduler=None):
+        self.client = openai_client
+        self.tts_model = tts_model
+        self.max_workers = max_workers
+        self.instructions = instructions
+        self.scheduler = scheduler
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts")
+
+    def synthesize(self, text: str, voice: str, response_format: str = "mp3", risk_tier: str = "low") -> bytes:
+        kwargs = {}
+        if self.instructions:
+            kwargs["instructions"] = self.instructions
+        with self.scheduler.slot(risk_tier) if self.scheduler is not None else nullcontext():
+            response = self.client.audio.speech.create(
+                model=self.tts_model,
+                voice=voice,
+                input=text,
+                response_format=response_format,
+                **kwargs,
+            )
+        return response.content
+
+    def synthesize_all(self, text: str, voice: str, response_format: str = "mp3", risk_tier: str = "low") -> bytes:
+        """
+        One clip for the whole text. Sentences are synthesized concurrently
+        when the format can be concatenated, with one call otherwise (wav, opus).
+        """
+        if response_format not in _CONCATENABLE:
+            return self.synthesize(text, voice, response_format, risk_tier)
+        return b"".join(audio for _, _, audio in self.stream(text, voice, response_format, risk_tier))
+
+    def stream(self, text: str, voice: str, response_format: str = "mp3",
+               risk_tier: str = "low") -> Iterator[Tuple[int, str, bytes]]:
+        """
+        :return: iterator of (index, sentence, audio bytes) in sentence order
+        """
+        sentences = split_sentences(text)
+        # in the caller's context, so calls made for a turn that already holds an upstream slot use it
+        futures = [self._executor.submit(contextvars.copy_context().run, self.synthesize, sentence, voice,
+                                         response_format, risk_tier)
+                   for sentence in sentences]
+        try:
+            for index, (sentence, future) in enumerate(zip(sentences, futures)):
+                yield index, sentence, future.result()
+        finally:
+            # consumer went away: don't keep synthesizing sentences nobody will hear
+            for future in futures:
+                future.cancel()
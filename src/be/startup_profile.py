@@ -0,0 +1,110 @@
+"""
+Import-time and startup profiling.
+
+    python startup_profile.py chat_api_server        # import-time report in a fresh interpreter
+    python startup_profile.py gpt4o_audio --top 15
+
+StartupTimer records the warm-up phases of a running server (see the
+lifespan in chat_api_server) so cold starts can be compared build to build.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+
+def process_age_s() -> Optional[float]:
+    """
+    Seconds since this process was started by the OS (Linux /proc, or psutil
+    when installed); None when neither is available.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # fields after the parenthesized command name; starttime is field 22
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime_s = float(f.read().split()[0])
+        return max(0.0, uptime_s - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return max(0.0, time.time() - psutil.Process().create_time())
+    except Exception:
+        return None
+
+
+class StartupTimer:
+    """
+    Phase timings of server startup. ready() marks the end of startup, so the
+    report keeps describing the cold start however late it is requested.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self._started = time.perf_counter()
+        self._ready = None  # (since timer created, process age) at ready()
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - started, 4)
+
+    def ready(self):
+        self._ready = (time.perf_counter() - self._started, process_age_s())
+
+    def report(self) -> Dict:
+        since_timer_s, process_age = self._ready or (time.perf_counter() - self._started, process_age_s())
+        return {
+            "phases_s": dict(self.phases),
+            "total_s": round(sum(self.phases.values()), 4),
+            # from StartupTimer() (module import of the server) to ready()
+            "since_timer_start_s": round(since_timer_s, 4),
+            # from exec, including interpreter start-up and imports
+            "since_process_start_s": round(process_age, 4) if process_age is not None else None,
+        }
+
+
+def profile_imports(module: str, cwd: str = None) -> List[Tuple[str, int, int]]:
+    """
+    Import `module` in a fresh interpreter with -X importtime.
+    :return: [(module, self_us, cumulative_us)] sorted by cumulative time
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd or os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1] if result.stderr else f"import {module} failed")
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import-time cost of a backend module.")
+    parser.add_argument("module")
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+
+    rows = profile_imports(args.module)
+    total = next((cumulative for name, _, cumulative in rows if name == args.module), None)
+    print(f"import {args.module}: {total / 1000:.1f} ms" if total else f"import {args.module}: n/a")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, self_us, cumulative_us in rows[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Offline stand-in for the Realtime API, for tests and load runs without upstream.
+
+    python stub_realtime.py --port 8765    # then ENGINE=realtime REALTIME_URL=ws://127.0.0.1:8765
+
+Speaks the subset of the event protocol engines.RealtimeEngine uses: session
+updates, buffered audio with an energy-based server VAD, text items, paced
+and cancellable replies, and item truncation. connect_stub() runs the same
+session in-process, without websockets (UPSTREAM_STUB=1 uses it).
+"""
+import argparse
+import base64
+import itertools
+import json
+import math
+import os
+import queue
+import threading
+import time
+from array import array
+
+from stub_upstream import _REPLY
+
+_PCM16_BYTES_PER_CHAR = 2 * 24000 // 12  # ~12 characters spoken per second
+_ids = itertools.count(1)
+
+
+def _id(prefix: str) -> str:
+    return f"{prefix}_stub_{next(_ids)}"
+
+
+def _rms(pcm16: bytes) -> float:
+    samples = array("h")
+    samples.frombytes(pcm16[:len(pcm16) - len(pcm16) % 2])
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+class StubRealtimeSession:
+    """
+    :param emit: called with each server event (a dict)
+    :param latency_s: time to the first reply delta
+    :param chunk_delay_s: pause between reply deltas
+    :param vad_rms: input RMS above which the VAD counts a chunk as speech
+    """
+
+    def __init__(self, emit, latency_s: float = 0.3, chunk_delay_s: float = 0.02, reply_chars: int = 80,
+                 vad_rms: float = 500.0):
+        self.emit = emit
+        self.latency_s = latency_s
+        self.chunk_delay_s = chunk_delay_s
+        self.reply_chars = reply_chars
+        self.vad_rms = vad_rms
+        self.config = {"turn_detection": None, "input_audio_transcription": None}
+        self._buffer = bytearray()
+        self._speaking = False
+        self._silence_ms = 0.0
+        self._cancel = threading.Event()
+        self._response = None
+        self._lock = threading.Lock()
+        self.emit({"type": "session.created", "session": {"id": _id("sess")}})
+
+    def handle(self, event: dict):
+        kind = event.get("type")
+        if kind == "session.update":
+            self.config.update(event.get("session") or {})
+            self.emit({"type": "session.updated", "session": self.config})
+        elif kind == "input_audio_buffer.append":
+            chunk = base64.b64decode(event.get("audio", ""))
+            self._buffer += chunk
+            if self.config.get("turn_detection"):
+                self._detect(chunk)
+        elif kind == "input_audio_buffer.commit":
+            self._commit()
+        elif kind == "input_audio_buffer.clear":
+            self._buffer.clear()
+            self.emit({"type": "input_audio_buffer.cleared"})
+        elif kind == "conversation.item.create":
+            item = dict(event.get("item") or {}, id=_id("item"))
+            self.emit({"type": "conversation.item.created", "item": item})
+        elif kind == "conversation.item.truncate":
+            self.emit({"type": "conversation.item.truncated", "item_id": event.get("item_id"),
+                       "content_index": event.get("content_index", 0), "audio_end_ms": event.get("audio_end_ms")})
+        elif kind == "response.create":
+            self._start_response()
+        elif kind == "response.cancel":
+            self._cancel.set()
+        else:
+            self.emit({"type": "error", "error": {"type": "invalid_request_error",
+                                                  "message": f"Unsupported event type: {kind}"}})
+
+    def _detect(self, chunk: bytes):
+        chunk_ms = len(chunk) / 48.0
+        if _rms(chunk) >= self.vad_rms:
+            self._silence_ms = 0.0
+            if not self._speaking:
+                self._speaking = True
+                # barge-in: speech cancels the reply in progress
+                self._cancel.set()
+                self.emit({"type": "input_audio_buffer.speech_started", "item_id": _id("item")})
+        elif self._speaking:
+            self._silence_ms += chunk_ms
+            if self._silence_ms >= self.config["turn_detection"].get("silence_duration_ms", 500):
+                self._speaking = False
+                self.emit({"type": "input_audio_buffer.speech_stopped"})
+                self._commit()
+                self._start_response()
+
+    def _commit(self):
+        item_id = _id("item")
+        audio_ms = len(self._buffer) // 48
+        self._buffer.clear()
+        self.emit({"type": "input_audio_buffer.committed", "item_id": item_id})
+        if self.config.get("input_audio_transcription"):
+            self.emit({"type": "conversation.item.input_audio_transcription.completed", "item_id": item_id,
+                       "content_index": 0, "transcript": "요즘 학교 때문에 너무 힘들어."})
+        return audio_ms
+
+    def _start_response(self):
+        with self._lock:
+            if self._response is not None and self._response.is_alive():
+                self.emit({"type": "error", "error": {"type": "invalid_request_error",
+                                                      "message": "Conversation already has an active response"}})
+                return
+            self._cancel.clear()
+            self._response = threading.Thread(target=self._stream_response, name="stub-realtime-response",
+                                              daemon=True)
+            self._response.start()
+
+    def _stream_response(self):
+        response_id, item_id = _id("resp"), _id("item")
+        self.emit({"type": "response.created", "response": {"id": response_id, "status": "in_progress"}})
+        self.emit({"type": "response.output_item.added", "response_id": response_id,
+                   "item": {"id": item_id, "type": "message", "role": "assistant"}})
+        text = (_REPLY * 4)[:self.reply_chars]
+        status = "completed"
+        if self._cancel.wait(self.latency_s):
+            status = "cancelled"
+        sent = 0
+        for start in range(0, len(text), 8):
+            if status == "cancelled" or self._cancel.is_set():
+                status = "cancelled"
+                break
+            piece = text[start:start + 8]
+            self.emit({"type": "response.audio_transcript.delta", "response_id": response_id, "item_id": item_id,
+                       "delta": piece})
+            audio = os.urandom(len(piece) * _PCM16_BYTES_PER_CHAR // 64) * 64
+            self.emit({"type": "response.audio.delta", "response_id": response_id, "item_id": item_id,
+                       "delta": base64.b64encode(audio).decode("ascii")})
+            sent += len(piece)
+            time.sleep(self.chunk_delay_s)
+        self.emit({"type": "response.done", "response": {
+            "id": response_id,
+            "status": status,
+            "usage": {"input_tokens": 200, "output_tokens": sent * 2,
+                      "input_token_details": {"cached_tokens": 0, "audio_tokens": 100},
+                      "output_token_details": {"audio_tokens": sent}},
+        }})
+
+    def close(self):
+        self._cancel.set()
+
+
+class StubConnection:
+    """
+    In-process connection with the send/recv/close surface of a websockets
+    sync client connection.
+    """
+
+    def __init__(self, **options):
+        self._inbox = queue.Queue()
+        self.closed = False
+        self._session = StubRealtimeSession(lambda event: self._inbox.put(json.dumps(event, ensure_ascii=False)),
+                                            **options)
+
+    def send(self, message: str):
+        if self.closed:
+            raise ConnectionError("stub connection closed")
+        self._session.handle(json.loads(message))
+
+    def recv(self, timeout=None) -> str:
+        try:
+            message = self._inbox.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("no event")
+        if message is None:
+            raise ConnectionError("stub connection closed")
+        return message
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._session.close()
+            self._inbox.put(None)
+
+
+def connect_stub() -> StubConnection:
+    """
+    UPSTREAM_STUB_LATENCY_MS, UPSTREAM_STUB_REPLY_CHARS, as stub_upstream.stub_from_env.
+    """
+    return StubConnection(latency_s=float(os.getenv("UPSTREAM_STUB_LATENCY_MS", "300")) / 1000,
+                          reply_chars=int(os.getenv("UPSTREAM_STUB_REPLY_CHARS", "80")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the realtime stand-in over websockets.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--reply-chars", type=int, default=80)
+    args = parser.parse_args()
+
+    from websockets.sync.server import serve
+
+    def handler(connection):
+        session = StubRealtimeSession(lambda event: connection.send(json.dumps(event, ensure_ascii=False)),
+                                      latency_s=args.latency_ms / 1000, reply_chars=args.reply_chars)
+        try:
+            for message in connection:
+                session.handle(json.loads(message))
+        finally:
+            session.close()
+
+    with serve(handler, args.host, args.port, max_size=None) as server:
+        print(f"Realtime stand-in on ws://{args.host}:{args.port}")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Offline stand-in for the OpenAI client, for load tests and replays.
+
+Implements just the calls the backend makes (chat completions with or
+without audio, speech, transcriptions, moderations, models.retrieve) and
+answers after a configurable latency with payloads sized like real ones.
+"""
+import base64
+import os
+import random
+import time
+from types import SimpleNamespace
+
+# ~16 KB of mp3 per second of speech, ~12 characters spoken per second
+_AUDIO_BYTES_PER_CHAR = 16000 // 12
+_REPLY = "그동안 정말 힘들었겠구나. 그런 감정을 느끼는 건 아주 자연스러운 일이야. "
+# moderation stand-in: a category is flagged when the text contains one of its terms
+_MODERATION_TERMS = {
+    "self_harm": ["죽고 싶", "자해", "kill myself", "self-harm"],
+    "violence": ["죽여버", "때려", "kill you"],
+    "harassment": ["멍청", "idiot"],
+}
+
+
+def _sleep(mean_s: float, jitter: float):
+    time.sleep(max(0.0, random.gauss(mean_s, mean_s * jitter)))
+
+
+def _audio_base64(chars: int) -> str:
+    return base64.b64encode(os.urandom(max(1, chars * _AUDIO_BYTES_PER_CHAR))).decode("ascii")
+
+
+class _Completions:
+    def __init__(self, stub):
+        self._stub = stub
+
+    def create(self, model=None, messages=None, modalities=None, audio=None, stream=False, **kwargs):
+        self._stub.maybe_fail()
+        if stream:
+            return _ChunkStream(self._stub, messages)
+        _sleep(self._stub.latency_s, self._stub.jitter)
+        text = (_REPLY * 4)[:self._stub.reply_chars]
+        message = SimpleNamespace(role="assistant", content=text, audio=None)
+        if modalities and "audio" in modalities:
+            message.content = None
+            message.audio = SimpleNamespace(id=f"audio_stub_{random.getrandbits(32):x}",
+                                            transcript=text, data=_audio_base64(len(text)),
+                                            expires_at=int(time.time()) + 3600)
+        usage = SimpleNamespace(prompt_tokens=sum(len(str(m.get("content", ""))) for m in messages or []) // 3,
+                                completion_tokens=len(text), total_tokens=0,
+                                prompt_tokens_details=None, completion_tokens_details=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")],
+                               usage=usage, model=model)
+
+
+class _ChunkStream:
+    """
+    stream=True: the first chunk after a third of the latency, the rest
+    spread over the remainder, then a usage-only chunk.
+    """
+
+    def __init__(self, stub, messages):
+        self._stub = stub
+        self._messages = messages or []
+        self.closed = False
+
+    def __iter__(self):
+        text = (_REPLY * 4)[:self._stub.reply_chars]
+        pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+        _sleep(self._stub.latency_s / 3, self._stub.jitter)
+        for piece in pieces:
+            if self.closed:
+                return
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], usage=None)
+            time.sleep(self._stub.latency_s * 2 / 3 / len(pieces))
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in self._messages) // 3
+        yield SimpleNamespace(choices=[], usage=SimpleNamespace(
+            prompt_tokens=prompt_tokens, completion_tokens=len(pieces), total_tokens=prompt_tokens + len(pieces),
+            prompt_tokens_details=None, completion_tokens_details=None))
+
+    def close(self):
+        self.closed = True
+
+
+class _Speech:
+    def __init__(self, stub):
+        self._stub = stub
+
+    def create(self, model=None, voice=None, input="", response_format="mp3", **kwargs):
+        self._stub.maybe_fail()
+        # TTS is roughly proportional to the input length
+        _sleep(self._stub.latency_s * min(1.0, len(input) / 100 + 0.2), self._stub.jitter)
+        return SimpleNamespace(content=base64.b64decode(_audio_base64(len(input))))
+
+
+class _Transcriptions:
+    def __init__(self, stub):
+        self._stub = stub
+
+    def create(self, model=None, file=None, response_format="text", **kwargs):
+        self._stub.maybe_fail()
+        _sleep(self._stub.latency_s / 2, self._stub.jitter)
+        return "요즘 학교 때문에 너무 힘들어."
+
+
+class _Moderations:
+    def __init__(self, stub):
+        self._stub = stub
+
+    def create(self, model=None, input="", **kwargs):
+        self._stub.maybe_fail()
+        _sleep(self._stub.latency_s / 4, self._stub.jitter)
+        text = (input or "").lower()
+        hits = {category: any(term in text for term in terms) for category, terms in _MODERATION_TERMS.items()}
+        return SimpleNamespace(results=[SimpleNamespace(flagged=any(hits.values()),
+                                                        categories=SimpleNamespace(**hits))])
+
+
+class StubOpenAI:
+    def __init__(self, latency_s: float = 0.8, jitter: float = 0.25, error_rate: float = 0.0, reply_chars: int = 80):
+        self.latency_s = latency_s
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.reply_chars = reply_chars
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self.audio = SimpleNamespace(speech=_Speech(self), transcriptions=_Transcriptions(self))
+        self.moderations = _Moderations(self)
+        self.models = SimpleNamespace(retrieve=lambda model: SimpleNamespace(id=model))
+
+    def maybe_fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            _sleep(self.latency_s / 4, self.jitter)
+            raise RuntimeError("stub upstream error")
+
+
+def stub_from_env() -> StubOpenAI:
+    """
+    UPSTREAM_STUB_LATENCY_MS, UPSTREAM_STUB_ERROR_RATE, UPSTREAM_STUB_REPLY_CHARS
+    """
+    return StubOpenAI(
+        latency_s=float(os.getenv("UPSTREAM_STUB_LATENCY_MS", "800")) / 1000,
+        error_rate=float(os.getenv("UPSTREAM_STUB_ERROR_RATE", "0")),
+        reply_chars=int(os.getenv("UPSTREAM_STUB_REPLY_CHARS", "80")),
+    )
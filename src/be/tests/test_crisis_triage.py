@@ -0,0 +1,46 @@
+import pytest
+
+from crisis_triage import RISK_HIGH, RISK_LOW, RISK_MEDIUM, CrisisTriage
+
+
+@pytest.fixture(scope="module")
+def triage():
+    return CrisisTriage()
+
+
+@pytest.mark.parametrize("text", [
+    "죽고싶어",
+    "숙제 때문에 죽고 싶어",
+    "영화 보다가 생각했는데 그냥 죽고 싶어",
+    "나 자해했어",
+    "I want to kill myself",
+    "homework is too much, I want to die",
+])
+def test_intent_is_high_whatever_else_is_said(triage, text):
+    assert triage.assess(text).tier == RISK_HIGH
+
+
+@pytest.mark.parametrize("text", [
+    "I will spend it tonight",
+    "We'll extend it tomorrow",
+    "skilled myself at chess",
+    "자살 예방 캠페인 뉴스 봤어",
+    "I'm not suicidal, just tired",
+])
+def test_no_false_alarm(triage, text):
+    assert triage.assess(text).tier == RISK_LOW
+
+
+def test_latin_phrases_match_whole_words(triage):
+    assert "end it" not in triage.assess("I will spend it tonight").matches
+    assert "end it" in triage.assess("I just want to end it.").matches
+    assert "self harm" in triage.assess("I've had self-harm urges").matches
+
+
+def test_korean_spacing_variants_match(triage):
+    assert triage.assess("죽고 싶어").matches == triage.assess("죽고싶어").matches
+
+
+def test_distress_alone_is_not_high(triage):
+    assert triage.assess("I feel so lonely and hopeless").tier == RISK_MEDIUM
+    assert triage.assess("요즘 학교 때문에 너무 힘들어.").tier == RISK_LOW
@@ -0,0 +1,16 @@
+import model_router
+from model_router import ModelRouter
+
+
+def test_slow_tier_recovers_once_its_samples_age_out(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(model_router.time, "monotonic", lambda: now[0])
+    router = ModelRouter(["cheap", "big"], p95_target_s=1.0, window_s=60.0)
+    for _ in range(10):
+        router.record("cheap", 5.0, ok=True)
+    assert router.route("응").model == "big"
+
+    now[0] += 61
+    decision = router.route("응")
+    assert decision.model == "cheap"
+    assert decision.reason == "complexity"
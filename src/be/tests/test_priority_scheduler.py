@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cancellation import CancelToken, TurnCancelled
+from priority_scheduler import PriorityScheduler
+
+
+def test_async_waiters_are_admitted_by_priority_without_threads():
+    async def main():
+        scheduler = PriorityScheduler(max_concurrency=1)
+        order = []
+
+        async def turn(name, tier):
+            async with scheduler.slot_async(tier):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        scheduler.acquire("low")
+        waiting = [asyncio.create_task(turn(f"low{i}", "low")) for i in range(3)]
+        await asyncio.sleep(0)
+        waiting.append(asyncio.create_task(turn("high", "high")))
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*waiting)
+        return order
+
+    assert asyncio.run(main())[0] == "high"
+
+
+def test_calls_inside_an_admitted_turn_reuse_its_slot():
+    async def main():
+        scheduler = PriorityScheduler(max_concurrency=1)
+        async with scheduler.slot_async("low"):
+            def upstream_call():
+                with scheduler.slot("low"):
+                    return scheduler.snapshot()["running"]
+
+            running = await asyncio.to_thread(upstream_call)
+        return running, scheduler.snapshot()["running"]
+
+    assert asyncio.run(main()) == (1, 0)
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    async def main():
+        scheduler = PriorityScheduler(max_concurrency=1)
+        scheduler.acquire("low")
+        token = CancelToken()
+        waiter = asyncio.create_task(scheduler.acquire_async("medium", cancel=token))
+        await asyncio.sleep(0)
+        token.cancel("superseded")
+        with pytest.raises(TurnCancelled):
+            await waiter
+        scheduler.release()
+        return scheduler.snapshot()
+
+    snapshot = asyncio.run(main())
+    assert snapshot["running"] == 0
+    assert snapshot["tiers"]["medium"]["cancelled"] == 1
+    assert snapshot["tiers"]["medium"]["waiting"] == 0
+
+
+def test_slot_of_a_cancelled_turn_is_held_until_its_call_returns():
+    scheduler = PriorityScheduler(max_concurrency=1)
+    token = CancelToken()
+    upstream = threading.Event()
+    with pytest.raises(TurnCancelled):
+        with scheduler.slot("low", cancel=token):
+            threading.Timer(0.05, token.cancel).start()
+            token.call(upstream.wait, 5)
+    # the abandoned request is still in flight upstream
+    assert scheduler.snapshot()["running"] == 1
+    upstream.set()
+    deadline = time.monotonic() + 5
+    while scheduler.snapshot()["running"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert scheduler.snapshot()["running"] == 0
@@ -0,0 +1,52 @@
+import threading
+
+from prompt_registry import PromptRegistry
+
+
+def test_republishing_an_older_text_rolls_latest_back(tmp_path):
+    for registry in (PromptRegistry(), PromptRegistry(str(tmp_path / "prompts.db"), latest_ttl_s=0)):
+        first = registry.publish("counselor", "one")
+        registry.publish("counselor", "two")
+        assert registry.publish("counselor", "one") == first
+        assert registry.resolve("counselor") == first
+        assert registry.publish("counselor", "three").version == 3
+
+
+def test_concurrent_publishes_get_distinct_versions(tmp_path):
+    db = str(tmp_path / "prompts.db")
+    registries = [PromptRegistry(db) for _ in range(8)]
+    errors = []
+
+    def publish(i):
+        try:
+            registries[i].publish("counselor", f"text {i}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=publish, args=(i,)) for i in range(len(registries))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert sorted(p.version for p in PromptRegistry(db).list()) == list(range(1, 9))
+
+
+def test_other_workers_publish_shows_up_after_the_ttl(tmp_path):
+    db = str(tmp_path / "prompts.db")
+    reader, writer = PromptRegistry(db, latest_ttl_s=60), PromptRegistry(db)
+    writer.publish("counselor", "one")
+    assert reader.resolve("counselor").text == "one"
+    writer.publish("counselor", "two")
+    assert reader.resolve("counselor").text == "one"  # served from the cache
+    reader.latest_ttl_s = 0
+    assert reader.resolve("counselor").text == "two"
+
+
+def test_load_dir_keeps_a_newer_admin_version(tmp_path):
+    (tmp_path / "counselor.txt").write_text("bundled\n", encoding="utf-8")
+    registry = PromptRegistry()
+    registry.load_dir(tmp_path)
+    registry.publish("counselor", "edited")
+    registry.load_dir(tmp_path)
+    assert registry.resolve("counselor").text == "edited"
@@ -0,0 +1,18 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import create_rate_limiter
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_idle_buckets_are_pruned_once_full_again(backend, tmp_path, monkeypatch):
+    now = [1_000.0]
+    monkeypatch.setattr(rate_limiter.time, "time", lambda: now[0])
+    limiter = create_rate_limiter(str(tmp_path / "buckets.db") if backend == "sqlite" else None,
+                                  requests_per_min=60, tokens_per_min=6000)
+    assert limiter.check("10.0.0.1", "s1", 100) == (True, 0.0)
+
+    # charged just now: kept
+    assert limiter.backend.prune(now[0] - limiter.idle_s) == 0
+    now[0] += limiter.idle_s + 1
+    assert limiter.backend.prune(now[0] - limiter.idle_s) == 4
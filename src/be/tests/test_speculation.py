@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from speculation import SpeculativeGenerator, same_request
+
+
+@pytest.mark.parametrize("interim, final", [
+    ("I want to go home", "I want to go home."),
+    ("오늘 정말 힘들었어", "오늘 정말 힘들었어요"),
+    ("I really want to go home now", "I really want to go home right now"),
+])
+def test_same_request(interim, final):
+    assert same_request(interim, final, 0.85)
+
+
+@pytest.mark.parametrize("interim, final", [
+    ("I want to go home", "I don't want to go home"),
+    ("I don’t care about it", "I do care about it"),
+    ("나 학교 가고 싶어", "나 학교 안 가고 싶어"),
+    ("나 학교 가고 싶어", "나 학교 가고 싶지 않아"),
+    ("오늘 기분이 좋아", "오늘 기분이 안좋아"),
+])
+def test_negation_change_is_not_the_same_request(interim, final):
+    assert not same_request(interim, final, 0.85)
+
+
+def _finished_generator():
+    generator = SpeculativeGenerator(lambda text, cancel: (f"reply to {text}", 7))
+    generator.start("session", "I want to go home")
+    generator._pending["session"].future.result(5)
+    return generator
+
+
+@pytest.mark.parametrize("drop", [
+    lambda g: g.claim("session", "something else entirely", timeout=5),
+    lambda g: g.start("session", "a completely different request"),
+    lambda g: g.discard("session"),
+])
+def test_dropping_a_finished_speculation_counts_its_tokens(drop):
+    generator = _finished_generator()
+    result = []
+    worker = threading.Thread(target=lambda: result.append(drop(generator)), daemon=True)
+    worker.start()
+    worker.join(5)
+    assert not worker.is_alive()
+    assert generator.stats()["wasted_tokens"] == 7
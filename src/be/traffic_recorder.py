@@ -0,0 +1,178 @@
+import hashlib
+import hmac
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# request fields whose *size* we keep; their content never leaves the process
+_SIZED_FIELDS = ("text", "audio_base64", "system_prompt")
+# request fields that describe shape, not content
+_SHAPE_FIELDS = ("prompt_id", "voice", "audio_format", "bitrate", "trim_silence")
+MAX_BUFFERED_BODY = 32 * 1024 * 1024
+# request bodies waiting for the writer thread, in all; beyond it requests go unrecorded
+MAX_QUEUED_BYTES = 64 * 1024 * 1024
+
+
+class TrafficRecorder:
+    """
+    Append-only JSONL log of anonymized request shapes and timing, written by
+    a background thread so recording never blocks a request (bodies are
+    parsed there too).
+
+    Each line: arrival time (wall clock, so lines from several workers
+    appending to one file line up), path, hashed session id, turn number
+    within the session, request/response sizes, per-field sizes, status and
+    latency. No text, audio or raw ids are stored. Without a salt, one is
+    created next to the log (`<path>.salt`) and shared by every worker, so a
+    session hashes the same in all of them. Turn numbers are counted per
+    worker: a session whose requests land on different workers gets
+    overlapping numbers.
+
+    :param max_sessions: sessions whose turn counters are kept; the least
+        recently seen are dropped first (a dropped session that comes back
+        restarts at turn 0)
+    """
+
+    def __init__(self, path: str, salt: str = "", max_sessions: int = 10000):
+        self.path = path
+        self._salt = salt.encode() if salt else self._load_salt()
+        self.max_sessions = max_sessions
+        self._turns: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=10000)
+        self._queued_bytes = 0
+        self.dropped = 0
+        self._writer = threading.Thread(target=self._write_loop, name="traffic-recorder", daemon=True)
+        self._writer.start()
+
+    def _load_salt(self) -> bytes:
+        path = self.path + ".salt"
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            # another worker created it; wait until it has been written
+            for _ in range(50):
+                with open(path, "rb") as f:
+                    salt = f.read()
+                if salt:
+                    return salt
+                time.sleep(0.01)
+            raise RuntimeError(f"Empty traffic recording salt at {path}")
+        salt = os.urandom(32).hex().encode()
+        with os.fdopen(fd, "wb") as f:
+            f.write(salt)
+        return salt
+
+    def anonymize(self, session_id: Optional[str]) -> Optional[str]:
+        if not session_id:
+            return None
+        return hmac.new(self._salt, session_id.encode(), hashlib.sha256).hexdigest()[:16]
+
+    def record(self, arrived_at: float, path: str, body_chunks: List[bytes], request_bytes: int,
+               status: int, response_bytes: int, latency_s: float):
+        """
+        :param arrived_at: time.time() when the request arrived
+        :param body_chunks: the raw request body, parsed on the writer thread
+        """
+        size = sum(len(chunk) for chunk in body_chunks)
+        with self._lock:
+            if self._queued_bytes + size > MAX_QUEUED_BYTES:
+                self.dropped += 1
+                return
+            self._queued_bytes += size
+        try:
+            self._queue.put_nowait((arrived_at, path, body_chunks, size, request_bytes, status, response_bytes,
+                                    latency_s))
+        except queue.Full:
+            with self._lock:
+                self._queued_bytes -= size
+                self.dropped += 1
+
+    def _event(self, arrived_at, path, body_chunks, request_bytes, status, response_bytes, latency_s) -> Dict:
+        try:
+            body = json.loads(b"".join(body_chunks)) if body_chunks else None
+        except ValueError:
+            body = None
+        body = body if isinstance(body, dict) else {}
+        session = self.anonymize(body.get("session_id"))
+        turn = None
+        if session:
+            turn = self._turns.get(session, 0)
+            self._turns[session] = turn + 1
+            self._turns.move_to_end(session)
+            while len(self._turns) > self.max_sessions:
+                self._turns.popitem(last=False)
+        return {
+            "t": round(arrived_at, 4),
+            "path": path,
+            "session": session,
+            "turn": turn,
+            "request_bytes": request_bytes,
+            "fields": {name: len(body[name]) for name in _SIZED_FIELDS if isinstance(body.get(name), str)},
+            "shape": {name: body[name] for name in _SHAPE_FIELDS if body.get(name) is not None},
+            "status": status,
+            "response_bytes": response_bytes,
+            "latency_ms": round(latency_s * 1000, 1),
+        }
+
+    def _write_loop(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                arrived_at, path, body_chunks, size, *rest = self._queue.get()
+                try:
+                    f.write(json.dumps(self._event(arrived_at, path, body_chunks, *rest)) + "\n")
+                except Exception as e:
+                    print("Traffic recording failed:", e)
+                finally:
+                    with self._lock:
+                        self._queued_bytes -= size
+                if self._queue.empty():
+                    f.flush()
+
+
+class TrafficRecorderMiddleware:
+    """
+    Pure ASGI middleware: counts request/response bytes as they pass through
+    (streaming responses included) and hands the shape to the recorder once
+    the response is complete.
+    """
+
+    def __init__(self, app, recorder: TrafficRecorder, paths=("/chat-text", "/chat-audio", "/chat-text-stream")):
+        self.app = app
+        self.recorder = recorder
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        arrived_at, started = time.time(), time.monotonic()
+        chunks = []
+        sizes = {"request": 0, "response": 0, "status": 0}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                sizes["request"] += len(body)
+                if sizes["request"] <= MAX_BUFFERED_BODY:
+                    chunks.append(body)
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                sizes["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            self.recorder.record(arrived_at, scope["path"], chunks, sizes["request"],
+                                 sizes["status"] or 500, sizes["response"], time.monotonic() - started)
@@ -0,0 +1,138 @@
+"""
+Replay a recorded traffic profile (traffic_recorder.py) against a server.
+
+    UPSTREAM_STUB=1 uvicorn chat_api_server:app --port 8000 --workers 4
+    python traffic_replay.py traffic.jsonl --base-url http://localhost:8000 --speed 10 --out run-a.jsonl
+
+Requests are re-issued at their offsets from the first recorded request
+(all workers' lines share the wall clock) divided by --speed, with
+synthetic bodies of the recorded sizes and the recorded session structure
+(each recorded session maps to a fresh session id). Every replayed turn
+gets its own Idempotency-Key: synthetic bodies of equal size are identical,
+and the server would otherwise serve them as retries of one turn. The
+summary compares replayed latencies with the recorded ones; --out keeps
+per-request results so two builds can be compared.
+"""
+import argparse
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+_FILLER = "요즘 학교에서 친구들이랑 좀 힘들어. "
+
+
+def load_profile(path: str) -> List[Dict]:
+    with open(path, encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    return sorted(events, key=lambda e: e["t"])
+
+
+def synthesize_body(event: Dict, session_ids: Dict[str, str]) -> Dict:
+    fields = event.get("fields", {})
+    body = dict(event.get("shape", {}))
+    body.setdefault("voice", "shimmer")
+    if event.get("session"):
+        body["session_id"] = session_ids.setdefault(event["session"], str(uuid.uuid4()))
+    if "text" in fields:
+        body["text"] = (_FILLER * (fields["text"] // len(_FILLER) + 1))[:fields["text"]]
+    if "audio_base64" in fields:
+        raw = os.urandom(fields["audio_base64"] * 3 // 4)
+        body["audio_base64"] = base64.b64encode(raw).decode("ascii")
+    if "system_prompt" in fields:
+        body["system_prompt"] = "x" * fields["system_prompt"]
+    return body
+
+
+def percentile(values: List[float], q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def replay(events: List[Dict], base_url: str, speed: float = 1.0, concurrency: int = 64, timeout: float = 60.0):
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    session_ids: Dict[str, str] = {}
+    results = []
+    results_lock = threading.Lock()
+
+    def issue(event, body, idempotency_key):
+        started = time.perf_counter()
+        status, size = 0, 0
+        try:
+            response = session.post(base_url.rstrip("/") + event["path"], json=body, timeout=timeout, stream=True,
+                                    headers={"Idempotency-Key": idempotency_key})
+            status = response.status_code
+            for chunk in response.iter_content(chunk_size=65536):
+                size += len(chunk)
+        except Exception as e:
+            print(f"{event['path']} failed: {e}")
+        with results_lock:
+            results.append({
+                "t": event["t"],
+                "path": event["path"],
+                "status": status,
+                "response_bytes": size,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                "recorded_latency_ms": event.get("latency_ms"),
+            })
+
+    started = time.monotonic()
+    first_t = events[0]["t"] if events else 0.0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for event in events:
+            # bodies are built on the scheduling thread so per-session order is preserved
+            body = synthesize_body(event, session_ids)
+            delay = started + (event["t"] - first_t) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(issue, event, body, str(uuid.uuid4()))
+    return results, time.monotonic() - started
+
+
+def summarize(results: List[Dict], wall_s: float) -> Dict:
+    latencies = [r["latency_ms"] for r in results]
+    recorded = [r["recorded_latency_ms"] for r in results if r["recorded_latency_ms"] is not None]
+    statuses = {}
+    for r in results:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+    return {
+        "requests": len(results),
+        "wall_s": round(wall_s, 2),
+        "throughput_rps": round(len(results) / wall_s, 2) if wall_s else None,
+        "status": statuses,
+        "latency_ms": {q: percentile(latencies, p) for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "recorded_latency_ms": {q: percentile(recorded, p) for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded traffic shapes against a server.")
+    parser.add_argument("profile", help="JSONL written by TRAFFIC_RECORD_PATH")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = real time, 10 = ten times faster")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--out", help="write per-request results as JSONL")
+    args = parser.parse_args()
+
+    results, wall_s = replay(load_profile(args.profile), args.base_url, args.speed, args.concurrency)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for r in sorted(results, key=lambda r: r["t"]):
+                f.write(json.dumps(r) + "\n")
+    print(json.dumps(summarize(results, wall_s), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Per-call upstream usage, aggregated per session, prompt version, voice and model.
+
+    python usage_accounting.py usage.jsonl --by session --top 20
+
+Counters are plain dict additions under one lock; a background thread
+appends the deltas since the last flush to a JSONL file, which the report
+above aggregates. In memory only the `max_keys` most recently active keys
+per dimension are kept, so the file is the complete record. Costs are estimates from PRICES_PER_MTOK (override with
+the USAGE_PRICES env var, JSON in the same shape).
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import threading
+import time
+import wave
+from collections import OrderedDict, defaultdict
+from typing import Dict, Optional
+
+from prompt_registry import prompt_hash
+
+# USD per 1M tokens: (text in, cached text in, audio in, text out, audio out)
+PRICES_PER_MTOK = {
+    "gpt-4o-audio-preview": (2.50, 2.50, 40.00, 10.00, 80.00),
+    "gpt-4o-mini-audio-preview": (0.15, 0.15, 10.00, 0.60, 20.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.0, 0.60, 0.0),
+    "gpt-4o-realtime-preview": (5.00, 2.50, 40.00, 20.00, 80.00),
+    "gpt-4o-mini-realtime-preview": (0.60, 0.30, 10.00, 2.40, 20.00),
+}
+# USD per minute of audio, for calls that don't report token usage (TTS, transcription)
+PRICES_PER_AUDIO_MINUTE = {
+    "gpt-4o-mini-tts": 0.015,
+    "gpt-4o-transcribe": 0.006,
+}
+# nominal bitrates (bytes/s) for estimating the length of compressed audio
+_BYTES_PER_SECOND = {"mp3": 8000, "opus": 4000, "aac": 8000, "pcm16": 48000}
+DIMENSIONS = ("session", "prompt", "voice", "model")
+COUNTERS = ("calls", "errors", "text_in_tokens", "cached_in_tokens", "audio_in_tokens", "text_out_tokens",
+            "audio_out_tokens", "input_audio_s", "output_audio_s", "latency_s", "cost_usd")
+
+
+def _detail(details, name) -> int:
+    return int(getattr(details, name, 0) or 0) if details is not None else 0
+
+
+def usage_counters(usage) -> Dict[str, int]:
+    """
+    Token counts from an OpenAI `response.usage`, split into text, cached and
+    audio parts (prompt_tokens includes cached and audio tokens).
+    """
+    if usage is None:
+        return {}
+    prompt_details = getattr(usage, "prompt_tokens_details", None)
+    completion_details = getattr(usage, "completion_tokens_details", None)
+    cached_in = _detail(prompt_details, "cached_tokens")
+    audio_in = _detail(prompt_details, "audio_tokens")
+    audio_out = _detail(completion_details, "audio_tokens")
+    prompt_tokens = int(getattr(usage, "prompt_tokens", 0) or 0)
+    completion_tokens = int(getattr(usage, "completion_tokens", 0) or 0)
+    return {
+        "text_in_tokens": max(0, prompt_tokens - audio_in - cached_in),
+        "cached_in_tokens": cached_in,
+        "audio_in_tokens": audio_in,
+        "text_out_tokens": max(0, completion_tokens - audio_out),
+        "audio_out_tokens": audio_out,
+    }
+
+
+def audio_seconds(audio_base64: Optional[str], fmt: str) -> float:
+    """
+    Exact for wav and pcm16, estimated from a nominal bitrate otherwise.
+    """
+    if not audio_base64:
+        return 0.0
+    if fmt == "wav":
+        try:
+            with wave.open(io.BytesIO(base64.b64decode(audio_base64))) as f:
+                return f.getnframes() / float(f.getframerate())
+        except (wave.Error, EOFError, ValueError):
+            pass
+    size = len(audio_base64) * 3 // 4
+    return size / _BYTES_PER_SECOND.get(fmt, _BYTES_PER_SECOND["mp3"])
+
+
+def prices_from_env() -> Dict:
+    prices = dict(PRICES_PER_MTOK)
+    prices.update({model: tuple(price) for model, price in json.loads(os.getenv("USAGE_PRICES", "{}")).items()})
+    return prices
+
+
+def estimate_cost(model: str, counters: Dict[str, float], prices: Dict = None) -> float:
+    prices = prices or PRICES_PER_MTOK
+    price = prices.get(model)
+    if price is None:
+        per_minute = PRICES_PER_AUDIO_MINUTE.get(model, 0.0)
+        return (counters.get("input_audio_s", 0) + counters.get("output_audio_s", 0)) / 60 * per_minute
+    text_in, cached_in, audio_in, text_out, audio_out = price
+    return (counters.get("text_in_tokens", 0) * text_in
+            + counters.get("cached_in_tokens", 0) * cached_in
+            + counters.get("audio_in_tokens", 0) * audio_in
+            + counters.get("text_out_tokens", 0) * text_out
+            + counters.get("audio_out_tokens", 0) * audio_out) / 1_000_000
+
+
+class UsageAccountant:
+    """
+    :param max_keys: in-memory totals kept per dimension; the least recently
+        active keys (in practice old sessions) are dropped beyond it
+    """
+
+    def __init__(self, flush_path: Optional[str] = None, flush_interval_s: float = 60.0, prices: Dict = None,
+                 max_keys: int = 10000, max_prompts: int = 256):
+        self.flush_path = flush_path
+        self.flush_interval_s = flush_interval_s
+        self.prices = prices or PRICES_PER_MTOK
+        self.max_keys = max_keys
+        self.max_prompts = max_prompts
+        self._totals: Dict[str, "OrderedDict[str, Dict[str, float]]"] = {dim: OrderedDict() for dim in DIMENSIONS}
+        self._deltas = {dim: defaultdict(lambda: defaultdict(float)) for dim in DIMENSIONS}
+        self._prompt_ids: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        if flush_path:
+            threading.Thread(target=self._flush_loop, name="usage-flush", daemon=True).start()
+
+    def prompt_id(self, system_prompt: Optional[str]) -> str:
+        if not system_prompt:
+            return "-"
+        with self._lock:
+            prompt_id = self._prompt_ids.get(system_prompt)
+            if prompt_id is not None:
+                self._prompt_ids.move_to_end(system_prompt)
+                return prompt_id
+        prompt_id = prompt_hash(system_prompt)
+        with self._lock:
+            self._prompt_ids[system_prompt] = prompt_id
+            while len(self._prompt_ids) > self.max_prompts:
+                self._prompt_ids.popitem(last=False)
+        return prompt_id
+
+    def record(self, model: str, usage=None, session_id: Optional[str] = None, system_prompt: Optional[str] = None,
+               voice: Optional[str] = None, input_audio_s: float = 0.0, output_audio_s: float = 0.0,
+               latency_s: float = 0.0, ok: bool = True, extra: Dict[str, float] = None):
+        """
+        Add one upstream call. `usage` is the response's usage object (None for
+        calls that don't report one, e.g. TTS); `extra` adds raw counters.
+        """
+        counters = usage_counters(usage)
+        if extra:
+            for name, value in extra.items():
+                counters[name] = counters.get(name, 0) + value
+        counters.update(calls=1, errors=0 if ok else 1, input_audio_s=input_audio_s,
+                        output_audio_s=output_audio_s, latency_s=latency_s)
+        counters["cost_usd"] = estimate_cost(model, counters, self.prices)
+        keys = {"session": session_id or "-", "prompt": self.prompt_id(system_prompt),
+                "voice": voice or "-", "model": model or "-"}
+        with self._lock:
+            for dim, key in keys.items():
+                rows = self._totals[dim]
+                total = rows.get(key)
+                if total is None:
+                    total = rows[key] = defaultdict(float)
+                    while len(rows) > self.max_keys:
+                        rows.popitem(last=False)
+                else:
+                    rows.move_to_end(key)
+                for name, value in counters.items():
+                    total[name] += value
+                if self.flush_path:
+                    # emptied by every flush, so bounded by what one interval records
+                    delta = self._deltas[dim][key]
+                    for name, value in counters.items():
+                        delta[name] += value
+
+    def report(self, dimension: str = "session", top: int = 20, sort_by: str = "cost_usd"):
+        with self._lock:
+            rows = [dict(counters, key=key) for key, counters in self._totals[dimension].items()]
+        return _rank(rows, top, sort_by)
+
+    def get(self, dimension: str, key: str) -> Optional[Dict]:
+        with self._lock:
+            counters = self._totals[dimension].get(key)
+            return _rounded(dict(counters, key=key)) if counters else None
+
+    def flush(self):
+        if not self.flush_path:
+            return
+        with self._lock:
+            deltas = self._deltas
+            self._deltas = {dim: defaultdict(lambda: defaultdict(float)) for dim in DIMENSIONS}
+        now = time.time()
+        lines = [json.dumps(_rounded(dict(counters, ts=now, dimension=dim, key=key)), ensure_ascii=False)
+                 for dim, rows in deltas.items() for key, counters in rows.items()]
+        if lines:
+            with open(self.flush_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval_s)
+            try:
+                self.flush()
+            except OSError as e:
+                print("Usage flush failed:", e)
+
+
+def _rounded(row: Dict) -> Dict:
+    return {k: round(v, 6) if isinstance(v, float) else v for k, v in row.items()}
+
+
+def _rank(rows, top, sort_by):
+    rows.sort(key=lambda row: row.get(sort_by, 0), reverse=True)
+    return [_rounded(row) for row in rows[:top]]
+
+
+def load_report(path: str, dimension: str, top: int = 20, sort_by: str = "cost_usd"):
+    totals = defaultdict(lambda: defaultdict(float))
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if row.get("dimension") != dimension:
+                continue
+            for name in COUNTERS:
+                totals[row["key"]][name] += row.get(name, 0)
+    return _rank([dict(counters, key=key) for key, counters in totals.items()], top, sort_by)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report upstream usage from USAGE_FLUSH_PATH.")
+    parser.add_argument("path")
+    parser.add_argument("--by", choices=DIMENSIONS, default="session")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--sort", choices=COUNTERS, default="cost_usd")
+    args = parser.parse_args()
+
+    rows = load_report(args.path, args.by, args.top, args.sort)
+    print(f"{args.by:<34} {'calls':>6} {'cost $':>9} {'in tok':>8} {'cached':>8} {'audio in':>8} "
+          f"{'out tok':>8} {'audio out':>9} {'out s':>7} {'avg lat':>7}")
+    for row in rows:
+        calls = row["calls"] or 1
+        print(f"{str(row['key'])[:34]:<34} {int(row['calls']):>6} {row['cost_usd']:>9.4f} "
+              f"{int(row['text_in_tokens']):>8} {int(row['cached_in_tokens']):>8} {int(row['audio_in_tokens']):>8} "
+              f"{int(row['text_out_tokens']):>8} {int(row['audio_out_tokens']):>9} {row['output_audio_s']:>7.1f} "
+              f"{row['latency_s'] / calls:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
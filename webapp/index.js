@@ -1,47 +1,170 @@
-const livereload = require('livereload');
-const connectLivereload = require('connect-livereload');
+const cluster = require('cluster');
+const crypto = require('crypto');
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const zlib = require('zlib');
 
-const liveReloadServer = livereload.createServer();
-liveReloadServer.watch(__dirname + "/views");
-liveReloadServer.watch(__dirname + "/public");
+// 운영 모드: NODE_ENV=production 또는 --production
+const PRODUCTION = process.env.NODE_ENV === 'production' || process.argv.includes('--production');
+const PORT = parseInt(process.env.PORT || '3000', 10);
+const WORKERS = parseInt(process.env.WEB_CONCURRENCY || String(os.availableParallelism ? os.availableParallelism() : os.cpus().length), 10);
+const PUBLIC_DIR = path.join(__dirname, 'public');
+const ONE_YEAR_S = 365 * 24 * 3600;
 
-const express = require('express');
-const path = require('path');
-const app = express();
-const PORT = 3000;
+if (PRODUCTION && cluster.isPrimary) {
+  // CPU 코어마다 워커 하나; 죽은 워커는 다시 띄움
+  console.log(`Primary ${process.pid}: starting ${WORKERS} workers`);
+  for (let i = 0; i < WORKERS; i++) {
+    cluster.fork();
+  }
+  cluster.on('exit', (worker, code, signal) => {
+    if (worker.exitedAfterDisconnect) return;
+    console.log(`Worker ${worker.process.pid} exited (${signal || code}), restarting`);
+    cluster.fork();
+  });
+} else {
+  startServer();
+}
+
+// public/ 파일의 내용 해시; 뷰에서 asset('script.js') → /script.js?v=<hash>
+function assetVersions() {
+  const versions = {};
+  for (const name of fs.readdirSync(PUBLIC_DIR)) {
+    if (name.endsWith('.br') || name.endsWith('.gz')) continue;
+    const file = path.join(PUBLIC_DIR, name);
+    if (!fs.statSync(file).isFile()) continue;
+    versions[name] = crypto.createHash('sha256').update(fs.readFileSync(file)).digest('hex').slice(0, 12);
+  }
+  return versions;
+}
+
+function acceptedEncoding(req) {
+  const accept = req.headers['accept-encoding'] || '';
+  if (/\bbr\b/.test(accept)) return 'br';
+  if (/\bgzip\b/.test(accept)) return 'gzip';
+  return null;
+}
+
+// npm run precompress 로 만든 .br/.gz 가 있으면 그것을 보냄
+function precompressed(req, res, next) {
+  if (req.method !== 'GET' && req.method !== 'HEAD') return next();
+  const encoding = acceptedEncoding(req);
+  if (!encoding) return next();
+  let name;
+  try {
+    name = path.normalize(decodeURIComponent(req.path)).replace(/^[/\\]+/, '');
+  } catch (e) {
+    return next();
+  }
+  const file = path.join(PUBLIC_DIR, name + (encoding === 'br' ? '.br' : '.gz'));
+  if (!file.startsWith(PUBLIC_DIR + path.sep) || !fs.existsSync(file)) return next();
+  res.set('Content-Encoding', encoding);
+  res.set('Vary', 'Accept-Encoding');
+  res.type(path.extname(name));
+  setCacheHeaders(res, req);
+  res.sendFile(file, { cacheControl: false });
+}
+
+// 버전이 붙은 요청(?v=)은 1년 immutable, 아니면 짧게 캐시하고 ETag로 재검증
+function setCacheHeaders(res, req) {
+  const versioned = req.query && req.query.v;
+  res.set('Cache-Control', versioned ? `public, max-age=${ONE_YEAR_S}, immutable` : 'public, max-age=3600');
+}
+
+// 렌더링된 페이지(와 압축본)를 한 번만 만들어 둠
+function cachedPage(html) {
+  const body = Buffer.from(html);
+  return {
+    etag: '"' + crypto.createHash('sha256').update(body).digest('hex').slice(0, 16) + '"',
+    identity: body,
+    br: zlib.brotliCompressSync(body),
+    gzip: zlib.gzipSync(body, { level: 9 }),
+  };
+}
+
+function startServer() {
+  const express = require('express');
+  const app = express();
+
+  // OpenAI 라우터 연결을 위한 추가
+  require('dotenv').config();  // ← 환경변수 불러오기
+  const chatRouter = require('./routes/chat'); // ← chat.js 불러오기
+
+  if (!PRODUCTION) {
+    // 개발 모드에서만: .ejs/public 변경 시 자동 새로고침
+    const livereload = require('livereload');
+    const connectLivereload = require('connect-livereload');
+
+    const liveReloadServer = livereload.createServer();
+    liveReloadServer.watch(__dirname + "/views");
+    liveReloadServer.watch(__dirname + "/public");
+    liveReloadServer.server.once("connection", () => {
+      setTimeout(() => {
+        liveReloadServer.refresh("/");
+      }, 100);
+    });
 
-// OpenAI 라우터 연결을 위한 추가
-require('dotenv').config();  // ← 환경변수 불러오기
-const chatRouter = require('./routes/chat'); // ← chat.js 불러오기
+    // Express에 미들웨어 추가
+    app.use(connectLivereload());
+  }
 
-// Express에 미들웨어 추가
-app.use(connectLivereload());
+  // EJS 템플릿 설정
+  app.set('view engine', 'ejs');
+  app.set('views', path.join(__dirname, 'views'));
 
-// EJS 템플릿 설정
-app.set('view engine', 'ejs');
-app.set('views', path.join(__dirname, 'views'));
+  const versions = PRODUCTION ? assetVersions() : {};
+  const locals = {
+    livereload: !PRODUCTION,
+    asset: (name) => versions[name] ? `/${name}?v=${versions[name]}` : `/${name}`,
+  };
 
-// 정적 파일 제공
-app.use(express.static(path.join(__dirname, 'public')));
+  // 정적 파일 제공
+  if (PRODUCTION) {
+    app.use(precompressed);
+    app.use(express.static(PUBLIC_DIR, {
+      cacheControl: false,
+      setHeaders: (res) => setCacheHeaders(res, res.req),
+    }));
+  } else {
+    app.use(express.static(PUBLIC_DIR));
+  }
 
-// JSON 요청 처리 (OpenAI와 주고받기 위해 꼭 필요)
-app.use(express.json());
+  // JSON 요청 처리 (OpenAI와 주고받기 위해 꼭 필요)
+  app.use(express.json());
 
-// 기본 라우팅
-app.get('/', (req, res) => {
-  res.render('index');
-});
+  // 기본 라우팅
+  if (PRODUCTION) {
+    let page = null;
+    app.get('/', (req, res, next) => {
+      if (page) return sendPage(req, res, page);
+      app.render('index', locals, (err, html) => {
+        if (err) return next(err);
+        page = cachedPage(html);
+        sendPage(req, res, page);
+      });
+    });
+  } else {
+    app.get('/', (req, res) => {
+      res.render('index', locals);
+    });
+  }
 
-// /chat 경로에 chat 라우터 연결
-app.use('/chat', chatRouter);
+  // /chat 경로에 chat 라우터 연결
+  app.use('/chat', chatRouter);
 
-app.listen(3000, '0.0.0.0', () => {
-  console.log('✅ Server running on http://0.0.0.0:3000');
-});
+  app.listen(PORT, '0.0.0.0', () => {
+    console.log(`✅ Server running on http://0.0.0.0:${PORT}` + (PRODUCTION ? ` (production, pid ${process.pid})` : ''));
+  });
+}
 
-// .ejs 파일 변경 시 자동 새로고침 트리거
-liveReloadServer.server.once("connection", () => {
-  setTimeout(() => {
-    liveReloadServer.refresh("/");
-  }, 100);
-});
+function sendPage(req, res, page) {
+  res.set('Content-Type', 'text/html; charset=utf-8');
+  res.set('Cache-Control', 'no-cache');
+  res.set('ETag', page.etag);
+  res.set('Vary', 'Accept-Encoding');
+  if (req.headers['if-none-match'] === page.etag) return res.status(304).end();
+  const encoding = acceptedEncoding(req);
+  if (encoding) res.set('Content-Encoding', encoding);
+  res.send(encoding === 'br' ? page.br : encoding === 'gzip' ? page.gzip : page.identity);
+}
@@ -20,16 +20,10 @@ if ('webkitSpeechRecognition' in window) {
 
     const response = await fetch('/chat-text', {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: { 'Content-Type': 'application/json', 'Idempotency-Key': crypto.randomUUID() },
       body: JSON.stringify({
         text: transcript,
-        system_prompt: "You are a GPT-4o audio response bot acting as a youth counselor assistant.\n\
-          Always respond in English with a soft, sincere, and comforting voice.\n\
-          Speak to teenagers facing emotional, social, or personal challenges.\n\
-          Your tone must be warm, caring, empathetic, and reassuring—like a safe, supportive friend.\n\
-          Try to keep responses concise, clear, and kind.\n\
-          If the assistant response is too long, truncate or revise before calling the model again.\n\
-          Never judge — just listen, support, and gently guide with compassion.",
+        prompt_id: 'counselor-en',
         voice: 'shimmer'
       })
     });
@@ -0,0 +1,27 @@
+// public/ 의 텍스트 파일마다 .br / .gz 압축본을 만들어 둠 (운영 모드에서 그대로 전송)
+// 사용: npm run precompress
+const fs = require('fs');
+const path = require('path');
+const zlib = require('zlib');
+
+const PUBLIC_DIR = path.join(__dirname, '..', 'public');
+const COMPRESSIBLE = new Set(['.js', '.css', '.html', '.svg', '.json', '.txt', '.map']);
+
+function walk(dir) {
+  return fs.readdirSync(dir, { withFileTypes: true }).flatMap((entry) => {
+    const file = path.join(dir, entry.name);
+    return entry.isDirectory() ? walk(file) : [file];
+  });
+}
+
+let count = 0;
+for (const file of walk(PUBLIC_DIR)) {
+  if (!COMPRESSIBLE.has(path.extname(file))) continue;
+  const data = fs.readFileSync(file);
+  fs.writeFileSync(file + '.br', zlib.brotliCompressSync(data, {
+    params: { [zlib.constants.BROTLI_PARAM_QUALITY]: zlib.constants.BROTLI_MAX_QUALITY },
+  }));
+  fs.writeFileSync(file + '.gz', zlib.gzipSync(data, { level: 9 }));
+  count++;
+}
+console.log(`Precompressed ${count} files in ${PUBLIC_DIR}`);